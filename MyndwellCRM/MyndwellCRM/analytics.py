@@ -0,0 +1,267 @@
+import csv
+import io
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence
+import numpy as np
+from models import *
+
+MISSING = -1
+
+# Built-in dimensions every response row carries
+BASE_DIMENSIONS = ('deployment', 'company')
+
+# Person.metadata keys reported on: importer.METADATA_FIELDS without the per-person contact
+# details (mobile, alt_email), whose one-value-per-person columns would only blow up the group count
+METADATA_DIMENSIONS = ('year_of_birth', 'designation', 'department', 'location', 'marital_status',
+                       'current_role', 'year_of_joining', 'work_mode', 'shift')
+
+# Largest mixed-radix group key an int64 holds
+MAX_GROUP_KEY = 2 ** 63 - 1
+
+class CategoricalColumn:
+    """Dictionary-encoded strings stored as int32 codes; MISSING marks no value"""
+
+    def __init__(self, capacity: int):
+        self.values: List[str] = []
+        self.lookup: Dict[str, int] = {}
+        self.codes = np.full(capacity, MISSING, dtype=np.int32)
+
+    def encode(self, value: Any) -> int:
+        if value is None or value == '':
+            return MISSING
+        value = str(value)
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def resize(self, capacity: int):
+        grown = np.full(capacity, MISSING, dtype=np.int32)
+        grown[:len(self.codes)] = self.codes
+        self.codes = grown
+
+    def isin(self, values: Iterable[Any], size: int) -> np.ndarray:
+        codes = [self.lookup[str(v)] for v in values if str(v) in self.lookup]
+        return np.isin(self.codes[:size], codes)
+
+class NumericColumn:
+    """float64 values with NaN marking no value"""
+
+    def __init__(self, capacity: int):
+        self.values = np.full(capacity, np.nan, dtype=np.float64)
+
+    def resize(self, capacity: int):
+        grown = np.full(capacity, np.nan, dtype=np.float64)
+        grown[:len(self.values)] = self.values
+        self.values = grown
+
+@dataclass
+class ReportTable:
+    columns: List[str]
+    rows: List[List[Any]] = field(default_factory=list)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+    def to_csv(self) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(self.columns)
+        writer.writerows([['' if v is None else v for v in row] for row in self.rows])
+        return out.getvalue()
+
+class ResponseAnalytics:
+    """Columnar copy of survey responses for cross-tab reports.
+
+    Each response is one row. Dimensions (deployment, company and the
+    METADATA_DIMENSIONS of Person.metadata, snapshotted at submission) and the choice code
+    of each SINGLE/SCALE question are dictionary-encoded int32 columns;
+    SCALE answers also get a float64 column of the choice's weight as
+    the deployment's survey plan scores it (ResponseService.get_weights),
+    so means agree with the results page.
+    Group-by, filter and aggregate run as NumPy operations over whole
+    columns. Rows are overwritten on resubmission and masked on delete.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.RLock()
+        self.stale = True
+        self._reset(capacity)
+
+    def _reset(self, capacity: int):
+        self.size = 0
+        self.capacity = capacity
+        self._rows: Dict[str, int] = {}
+        self.live = np.zeros(capacity, dtype=bool)
+        self.dimensions: Dict[str, CategoricalColumn] = {d: CategoricalColumn(capacity)
+                                                         for d in BASE_DIMENSIONS + METADATA_DIMENSIONS}
+        self.choices: Dict[str, CategoricalColumn] = {}
+        self.scores: Dict[str, NumericColumn] = {}
+
+    def invalidate(self):
+        self.stale = True
+
+    def _reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        capacity = max(rows, self.capacity * 2)
+        grown = np.zeros(capacity, dtype=bool)
+        grown[:self.size] = self.live[:self.size]
+        self.live = grown
+        for column in (*self.dimensions.values(), *self.choices.values(), *self.scores.values()):
+            column.resize(capacity)
+        self.capacity = capacity
+
+    def _column(self, columns: Dict[str, Any], key: str, factory) -> Any:
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = factory(self.capacity)
+        return column
+
+    def _write(self, response: SurveyResponse, person: Optional[Person], questions: Dict[str, Question],
+               weights: Mapping[str, Mapping[str, float]]):
+        row = self._rows.get(response.id)
+        if row is None:
+            self._reserve(self.size + 1)
+            row = self._rows[response.id] = self.size
+            self.size += 1
+        else:
+            for column in (*self.dimensions.values(), *self.choices.values()):
+                column.codes[row] = MISSING
+            for column in self.scores.values():
+                column.values[row] = np.nan
+        self.live[row] = True
+
+        metadata = (person.metadata or {}) if person else {}
+        dimensions = {'deployment': response.deployment_id, 'company': person.company_id if person else None}
+        dimensions.update((name, metadata.get(name)) for name in METADATA_DIMENSIONS)
+        for name, value in dimensions.items():
+            column = self.dimensions[name]
+            column.codes[row] = column.encode(value)
+
+        for question_id, answer in response.answers.items():
+            question = questions.get(question_id)
+            if question is None or question.type not in (QuestionType.SINGLE, QuestionType.SCALE):
+                continue
+            column = self._column(self.choices, question_id, CategoricalColumn)
+            column.codes[row] = column.encode(answer)
+            if question.type == QuestionType.SCALE:
+                scored = weights.get(question_id)
+                if scored is None:
+                    weight = next((c.weight for c in question.choices if c.code == answer), None)
+                else:
+                    weight = scored.get(answer)
+                if weight is not None:
+                    self._column(self.scores, question_id, NumericColumn).values[row] = weight
+
+    def load(self, responses: Iterable[SurveyResponse], persons: Dict[str, Person],
+             questions: Dict[str, Question], weights: Mapping[str, Mapping[str, Mapping[str, float]]]):
+        """Rebuild from every response; weights maps deployment id -> question id -> choice weights"""
+        responses = list(responses)
+        with self._lock:
+            self._reset(max(1024, len(responses)))
+            for response in responses:
+                self._write(response, persons.get(response.person_id), questions,
+                            weights.get(response.deployment_id, {}))
+            self.stale = False
+
+    def upsert(self, response: SurveyResponse, person: Optional[Person], questions: Dict[str, Question],
+               weights: Mapping[str, Mapping[str, float]]):
+        """Write one response; weights are its deployment's, question id -> choice weights"""
+        with self._lock:
+            self._write(response, person, questions, weights)
+
+    def remove(self, response_id: str):
+        with self._lock:
+            row = self._rows.get(response_id)
+            if row is not None:
+                self.live[row] = False
+
+    def _dimension(self, name: str) -> CategoricalColumn:
+        return self.dimensions.get(name) or CategoricalColumn(self.capacity)
+
+    def dimension_names(self) -> List[str]:
+        with self._lock:
+            return list(self.dimensions)
+
+    def crosstab(self, question: Question, by: Sequence[str] = (),
+                 filters: Optional[Dict[str, Sequence[Any]]] = None) -> ReportTable:
+        """Answer distribution of one question grouped by dimensions.
+
+        One row per combination of the `by` values present, with the
+        number of responses answering the question, a count per choice
+        and, for SCALE questions, the mean and standard deviation of
+        the choice weights. `filters` keeps rows whose dimension value
+        is one of the listed values. A dimension no respondent has a
+        value for groups everything under None.
+        """
+        choice_codes = [c.code for c in question.choices]
+        scale = question.type == QuestionType.SCALE
+        columns = list(by) + ['responses'] + [c.label for c in question.choices]
+        if scale:
+            columns += ['mean', 'stddev']
+
+        with self._lock:
+            size = self.size
+            answers = self.choices.get(question.id)
+            if answers is None or not size:
+                return ReportTable(columns=columns)
+            mask = self.live[:size] & (answers.codes[:size] != MISSING)
+            for name, values in (filters or {}).items():
+                mask &= self._dimension(name).isin(values, size)
+
+            # One integer group key per row: mixed-radix over the (code + 1) of each dimension
+            key_space = 1
+            for name in by:
+                key_space *= len(self._dimension(name).values) + 1
+            if key_space > MAX_GROUP_KEY:
+                raise ValueError('Too many combinations of ' + ', '.join(by) + ' to group by; choose fewer dimensions')
+            keys = np.zeros(int(mask.sum()), dtype=np.int64)
+            radices = []
+            for name in by:
+                column = self._dimension(name)
+                radix = len(column.values) + 1
+                keys = keys * radix + (column.codes[:size][mask] + 1)
+                radices.append((column, radix))
+            groups, inverse = np.unique(keys, return_inverse=True)
+            group_count = len(groups)
+
+            # Column codes follow first-seen order; map them to the question's choice order
+            order = np.full(len(answers.values) + 1, len(choice_codes), dtype=np.int64)
+            for position, code in enumerate(choice_codes):
+                if code in answers.lookup:
+                    order[answers.lookup[code]] = position
+            choice = order[answers.codes[:size][mask]]
+            width = len(choice_codes) + 1
+            counts = np.bincount(inverse * width + choice, minlength=group_count * width)
+            counts = counts.reshape(group_count, width)[:, :len(choice_codes)]
+            totals = np.bincount(inverse, minlength=group_count)
+
+            if scale and question.id in self.scores:
+                values = self.scores[question.id].values[:size][mask]
+                present = ~np.isnan(values)
+                values = np.where(present, values, 0.0)
+                n = np.bincount(inverse, weights=present, minlength=group_count)
+                sums = np.bincount(inverse, weights=values, minlength=group_count)
+                squares = np.bincount(inverse, weights=values * values, minlength=group_count)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means = sums / n
+                    stddevs = np.sqrt(np.maximum(squares / n - means * means, 0.0))
+            else:
+                means = stddevs = np.full(group_count, np.nan)
+
+            rows = []
+            for g, key in enumerate(groups.tolist()):
+                labels = []
+                for column, radix in reversed(radices):
+                    key, code = divmod(key, radix)
+                    labels.append(column.values[code - 1] if code else None)
+                row = labels[::-1] + [int(totals[g])] + counts[g].tolist()
+                if scale:
+                    row += [None if np.isnan(means[g]) else round(float(means[g]), 4),
+                            None if np.isnan(stddevs[g]) else round(float(stddevs[g]), 4)]
+                rows.append(row)
+        rows.sort(key=lambda row: tuple((v is None, v or '') for v in row[:len(by)]))
+        return ReportTable(columns=columns, rows=rows)
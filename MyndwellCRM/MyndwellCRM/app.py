@@ -3,17 +3,51 @@ import logging
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; DEBUG logs every request and is meant for development
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
 # Create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Audit segments and the .eml outbox live under the instance folder unless
+# AUDIT_LOG_DIR / EMAIL_OUTBOX_DIR say otherwise; BACKGROUND_TASKS=0 keeps
+# the audit flusher, email workers and scheduler from starting
+app.config.update(
+    AUDIT_LOG_DIR=os.environ.get('AUDIT_LOG_DIR') or os.path.join(app.instance_path, 'audit_log'),
+    EMAIL_OUTBOX_DIR=os.environ.get('EMAIL_OUTBOX_DIR') or os.path.join(app.instance_path, 'outbox'),
+    BACKGROUND_TASKS=os.environ.get('BACKGROUND_TASKS', '1') != '0'
+)
+
+# Request, service and template timings served at /metrics, opt-in with
+# INSTRUMENTATION=1 (otherwise nothing is hooked in); with it on,
+# PROFILE_SLOW_MS=N dumps sampled stacks of requests slower than N ms to
+# PROFILE_DIR, sampling every PROFILE_INTERVAL_MS
+from instrumentation import instrumentation
+instrumentation.init_app(
+    app,
+    enabled=os.environ.get('INSTRUMENTATION', '0') == '1',
+    profile_threshold=float(os.environ['PROFILE_SLOW_MS']) / 1000 if os.environ.get('PROFILE_SLOW_MS') else None,
+    profile_directory=os.environ.get('PROFILE_DIR', 'profiles'),
+    profile_interval=float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+)
+
 # Import routes
 from routes import *
 
 # Import data store initialization
-from data_store import init_data_store
-init_data_store()
+import data_store
+from data_store import init_data_store, sync_changes
+instrumentation.instrument(data_store.SERVICES)
+init_data_store(app.config['AUDIT_LOG_DIR'])
+
+# Drop cached results other workers' writes made stale before serving each request
+app.before_request(sync_changes)
+
+# Activate, complete and remind deployments on schedule; the background
+# threads start with the first request
+from email_dispatch import configure_dispatcher
+configure_dispatcher(app.config['EMAIL_OUTBOX_DIR'])
+import scheduler
+scheduler.init_app(app)
@@ -0,0 +1,527 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from models import *
+from compact import intern
+from serialization import to_dict, from_dict
+from storage import INDEXED_FIELDS, sort_value
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process, nothing to coordinate with
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Audit entity type recorded for each collection, named as in the audit UI
+ENTITY_TYPES = {
+    'companies': 'company',
+    'persons': 'user',
+    'questions': 'question',
+    'survey_templates': 'survey',
+    'deployments': 'deployment',
+    'responses': 'response',
+    'participants': 'participant'
+}
+
+# Fields left out of diffs; bookkeeping that changes on every write
+IGNORED_FIELDS = frozenset({'id', 'created_at', 'updated_at', 'metrics'})
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+# Locations of a sealed segment's entries, next to it
+SIDECAR_SUFFIX = '.idx'
+# Held while appending, rotating or expiring so workers sharing the directory take turns
+LOCK_FILE = '.lock'
+
+class Location(NamedTuple):
+    """Where a written entry is, with the fields it is indexed under"""
+    timestamp: str
+    segment: int
+    offset: int
+    entity_type: str
+    entity_id: str
+    action: str
+
+def compute_diff(before: Optional[Any], after: Optional[Any]) -> Dict[str, List[Any]]:
+    """Field-level diff as {field: [old, new]}; old is None on create, new is None on delete"""
+    old = to_dict(before) if before is not None else {}
+    new = to_dict(after) if after is not None else {}
+    return {name: [old.get(name), new.get(name)]
+            for name in sorted(old.keys() | new.keys())
+            if name not in IGNORED_FIELDS and old.get(name) != new.get(name)}
+
+def request_context() -> Tuple[str, str, str]:
+    """(actor, ip_address, user_agent) for the request being served, if any.
+
+    The actor is the session's signed-in user ('user' key), else the
+    REMOTE_USER an authenticating server or proxy passed in, else
+    'anonymous'; writes outside a request are made by 'system'.
+    """
+    try:
+        from flask import has_request_context, request, session
+    except ImportError:
+        return 'system', '', ''
+    if not has_request_context():
+        return 'system', '', ''
+    actor = session.get('user') or request.remote_user or 'anonymous'
+    return str(actor), request.remote_addr or '', request.headers.get('User-Agent', '')
+
+def _segment_number(filename: str) -> int:
+    return int(filename[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+
+def _timestamp_key(value: str) -> str:
+    """The sort_value() of a serialized timestamp"""
+    return datetime.fromisoformat(value).isoformat(timespec='microseconds')
+
+class AuditTrail:
+    """Append-only audit log with write-behind persistence.
+
+    Entries are indexed in memory as soon as they are recorded and
+    appended to the current segment file in batches by a background
+    thread once start() runs, so requests never wait on disk. Once written, an entry is
+    kept in memory only as its Location; queries bisect the
+    (timestamp, id) ordered keys and per-field key lists, then read
+    just the entries they return from disk.
+
+    Segments rotate at segment_max_bytes and are never written again.
+    A sealed segment gets an .idx sidecar of its locations, so a restart
+    reads those instead of parsing every entry. Retention deletes whole
+    segments once their newest entry is older than retention_days, so
+    expiring history costs no rewriting; None keeps everything.
+
+    Workers sharing the directory each keep their own index. Queries
+    first tail the segments (at most every refresh_interval), so entries
+    other workers have flushed show up in every worker's listings.
+    """
+
+    def __init__(self, directory: Optional[str] = None, flush_size: int = 200, flush_interval: float = 1.0,
+                 segment_max_bytes: int = 4 * 1024 * 1024, retention_days: Optional[int] = 365,
+                 refresh_interval: float = 0.25,
+                 context: Callable[[], Tuple[str, str, str]] = request_context,
+                 clock: Callable[[], datetime] = datetime.now):
+        self.directory = directory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.segment_max_bytes = segment_max_bytes
+        self.retention_days = retention_days
+        self.refresh_interval = refresh_interval
+        self.context = context
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._pending: List[AuditLog] = []
+        self._loaded = directory is None
+        # (timestamp, id) of every entry in order, and of those with each indexed field value
+        self._keys: List[Tuple[str, str]] = []
+        self._index: Dict[Tuple[str, Any], List[Tuple[str, str]]] = {}
+        # Entry id -> its Location, or the AuditLog itself until it is written
+        self._where: Dict[str, Any] = {}
+        # Per segment number: bytes indexed so far, ids in it and its newest timestamp
+        self._read: Dict[int, int] = {}
+        self._segment_ids: Dict[int, List[str]] = {}
+        self._newest: Dict[int, str] = {}
+        # Segments sealed and fully indexed, never read again
+        self._sealed = set()
+        self._last_timestamp: Optional[datetime] = None
+        self._refreshed = time.monotonic()
+
+    def _add(self, key: Tuple[str, str], where: Any):
+        self._where[key[1]] = where
+        # Mostly appends; entries flushed late by other workers land in the middle
+        for keys in [self._keys] + [self._index.setdefault((field, getattr(where, field)), [])
+                                    for field in INDEXED_FIELDS['audit_logs']]:
+            if not keys or key > keys[-1]:
+                keys.append(key)
+            else:
+                insort(keys, key)
+
+    def _forget(self, numbers: Iterable[int]):
+        """Drop the entries of deleted segments"""
+        dropped = set()
+        for number in numbers:
+            dropped.update(self._segment_ids.pop(number, ()))
+            self._read.pop(number, None)
+            self._newest.pop(number, None)
+            self._sealed.discard(number)
+        if not dropped:
+            return
+        for record_id in dropped:
+            self._where.pop(record_id, None)
+        self._keys = [k for k in self._keys if k[1] not in dropped]
+        for value, keys in list(self._index.items()):
+            keys = [k for k in keys if k[1] not in dropped]
+            if keys:
+                self._index[value] = keys
+            else:
+                del self._index[value]
+
+    # Segment files
+
+    def _segments(self) -> Dict[int, str]:
+        names = [n for n in os.listdir(self.directory)
+                 if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX)]
+        return {_segment_number(n): os.path.join(self.directory, n) for n in names}
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}')
+
+    def _sidecar_path(self, number: int) -> str:
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{number:08d}{SIDECAR_SUFFIX}')
+
+    def _locate(self, key: Tuple[str, str], number: int, offset: int, entity_type: str, entity_id: str,
+                action: str):
+        where = self._where.get(key[1])
+        if where is not None and not isinstance(where, AuditLog):
+            # Written twice by a flush that failed after its data reached the disk
+            return
+        location = Location(key[0], number, offset, intern(entity_type), entity_id, intern(action))
+        if where is None:
+            self._add(key, location)
+        else:
+            self._where[key[1]] = location
+        self._segment_ids.setdefault(number, []).append(key[1])
+        if key[0] > self._newest.get(number, ''):
+            self._newest[number] = key[0]
+
+    def _read_sidecar(self, number: int) -> bool:
+        try:
+            with open(self._sidecar_path(number), encoding='utf-8') as f:
+                sidecar = json.load(f)
+            for timestamp, record_id, offset, entity_type, entity_id, action in sidecar['entries']:
+                self._locate((timestamp, record_id), number, offset, entity_type, entity_id, action)
+            self._read[number] = sidecar['size']
+            return True
+        except FileNotFoundError:
+            return False
+        except (ValueError, TypeError, KeyError):
+            logger.warning('Rebuilding unreadable audit index %s', self._sidecar_path(number))
+            self._forget([number])
+            return False
+
+    def _write_sidecar(self, number: int):
+        """Save a sealed segment's locations; workers racing here write the same file"""
+        locations = (self._where[record_id] for record_id in self._segment_ids.get(number, ()))
+        entries = [[w.timestamp, record_id, w.offset, w.entity_type, w.entity_id, w.action]
+                   for record_id, w in zip(self._segment_ids.get(number, ()), locations)]
+        path = self._sidecar_path(number)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({'size': self._read.get(number, 0), 'entries': entries}, f)
+        os.replace(temporary, path)
+
+    def _read_segment(self, number: int, path: str):
+        """Index a segment's entries past the part read before"""
+        offset = self._read.get(number, 0)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Expired by another worker since it was listed
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                # A torn final line from a crash mid-append is skipped
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    data = json.loads(line)
+                    self._locate((_timestamp_key(data['timestamp']), data['id']), number, offset,
+                                 data['entity_type'], data['entity_id'], data['action'])
+                except (ValueError, TypeError, KeyError):
+                    logger.warning('Skipping unreadable audit entry in %s', path)
+                offset += len(line)
+        self._read[number] = offset
+
+    def _scan(self) -> Dict[int, str]:
+        """Index whatever was appended since the last scan and forget deleted segments"""
+        segments = self._segments()
+        self._forget(set(self._read) - set(segments))
+        last = max(segments, default=0)
+        for number in sorted(segments):
+            if number in self._sealed:
+                continue
+            if number < last:
+                if number in self._read or not self._read_sidecar(number):
+                    self._read_segment(number, segments[number])
+                    if not os.path.exists(self._sidecar_path(number)):
+                        self._write_sidecar(number)
+                self._sealed.add(number)
+            else:
+                self._read_segment(number, segments[number])
+        return segments
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        if self._keys:
+            self._last_timestamp = datetime.fromisoformat(self._keys[-1][0])
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def _refresh(self):
+        """Index entries other workers appended since the last query; call holding _lock"""
+        if self.directory is None or time.monotonic() - self._refreshed < self.refresh_interval:
+            return
+        try:
+            self._scan()
+        except OSError:
+            logger.exception('Failed to read new audit entries')
+        self._refreshed = time.monotonic()
+
+    # Recording
+
+    def record(self, action: str, entity_type: str, entity_id: str, diff: Dict[str, Any]) -> AuditLog:
+        self._ensure_loaded()
+        actor, ip_address, user_agent = self.context()
+        with self._lock:
+            timestamp = self.clock()
+            if self._last_timestamp is not None and timestamp < self._last_timestamp:
+                # Keep the log in time order if the wall clock steps back
+                timestamp = self._last_timestamp
+            self._last_timestamp = timestamp
+            entry = AuditLog(id=str(uuid.uuid4()), actor=actor, action=action, entity_type=entity_type,
+                             entity_id=entity_id, diff=diff, ip_address=ip_address,
+                             user_agent=user_agent, timestamp=timestamp)
+            self._add((sort_value(entry, 'created_at'), entry.id), entry)
+            flush_now = False
+            if self.directory is not None:
+                self._pending.append(entry)
+                if len(self._pending) >= self.flush_size:
+                    # Without a flusher thread (start() not called) the writer flushes
+                    flush_now = self._flusher is None
+                    self._wakeup.set()
+        if flush_now:
+            self.flush()
+        return entry
+
+    def on_write(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: record a create, update or delete with its diff"""
+        entity_type = ENTITY_TYPES.get(collection)
+        if entity_type is None:
+            return
+        diff = compute_diff(before, after)
+        if before is None:
+            action = 'create'
+        elif after is None:
+            action = 'delete'
+        elif diff:
+            action = 'update'
+        else:
+            return
+        self.record(action, entity_type, (after or before).id, diff)
+
+    # Write-behind flushing
+
+    def open(self, directory: str):
+        """Persist entries under directory; call before the first entry is recorded"""
+        with self._lock:
+            self.directory = directory
+            self._loaded = False
+        atexit.register(self.flush)
+
+    def start(self):
+        """Flush pending entries from a background thread every flush_interval"""
+        with self._lock:
+            if self._flusher is not None or self.directory is None:
+                return
+            self._flusher = threading.Thread(target=self._run_flusher, name='audit-flusher', daemon=True)
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError:
+                logger.exception('Failed to flush audit log')
+
+    @contextmanager
+    def _segment_lock(self):
+        with self._io_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def flush(self):
+        """Append pending entries to the current segment, rotating and expiring segments as needed"""
+        if self.directory is None:
+            return
+        with self._segment_lock():
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    return
+                # Everything other workers appended is indexed, so offsets below are ours alone
+                segments = self._scan()
+            number = max(segments, default=1)
+            rotated = number in segments and (os.path.getsize(segments[number]) >= self.segment_max_bytes or
+                                              os.path.getsize(segments[number]) != self._read.get(number))
+            if rotated:
+                # Full, or ending in a line torn by a crash that an append would run on from
+                number += 1
+            lines = [(json.dumps(to_dict(entry)) + '\n').encode('utf-8') for entry in batch]
+            try:
+                with open(self._segment_path(number), 'ab') as f:
+                    offset = f.tell()
+                    f.write(b''.join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                with self._lock:
+                    self._pending[:0] = batch
+                raise
+            with self._lock:
+                for entry, line in zip(batch, lines):
+                    self._locate((sort_value(entry, 'created_at'), entry.id), number, offset,
+                                 entry.entity_type, entry.entity_id, entry.action)
+                    offset += len(line)
+                self._read[number] = offset
+                if rotated:
+                    self._write_sidecar(number - 1)
+                    self._sealed.add(number - 1)
+                    self._expire()
+
+    def compact(self):
+        """Delete segments whose entries are all past the retention window"""
+        if self.directory is None:
+            return
+        self._ensure_loaded()
+        self.flush()
+        with self._segment_lock():
+            with self._lock:
+                self._scan()
+                self._expire()
+
+    def _expire(self):
+        if self.retention_days is None:
+            return
+        cutoff = (self.clock() - timedelta(days=self.retention_days)).isoformat(timespec='microseconds')
+        expired = []
+        # Oldest first, never the segment being appended to
+        for number in sorted(self._read)[:-1]:
+            if self._newest.get(number, '') >= cutoff:
+                break
+            expired.append(number)
+        for number in expired:
+            for path in (self._segment_path(number), self._sidecar_path(number)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self._forget(expired)
+
+    # Queries
+
+    @staticmethod
+    def _range(keys: List[Tuple[str, str]], start: Optional[datetime], end: Optional[datetime],
+               after: Optional[Tuple[str, str]], descending: bool) -> range:
+        """Positions in keys within [start, end) and past the after cursor, in page order"""
+        lo = bisect_left(keys, (start.isoformat(timespec='microseconds'), '')) if start else 0
+        hi = bisect_left(keys, (end.isoformat(timespec='microseconds'), '')) if end else len(keys)
+        if after is not None:
+            if descending:
+                hi = min(hi, bisect_left(keys, tuple(after)))
+            else:
+                lo = max(lo, bisect_right(keys, tuple(after)))
+        return range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+
+    def _matching(self, filters: Dict[str, Any], start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  after: Optional[Tuple[str, str]] = None, descending: bool = False) -> Iterator[Any]:
+        """Where each matching entry is, in order, walking the smallest key list lazily"""
+        keys = min((self._index.get((field, value), []) for field, value in filters.items()),
+                   key=len) if filters else self._keys
+        for position in self._range(keys, start, end, after, descending):
+            where = self._where[keys[position][1]]
+            if all(getattr(where, field) == value for field, value in filters.items()):
+                yield where
+
+    def _fetch(self, found: List[Any]) -> List[AuditLog]:
+        """Entries at the given locations, read outside the lock"""
+        entries = []
+        files = {}
+        try:
+            for where in found:
+                if isinstance(where, AuditLog):
+                    entries.append(where)
+                    continue
+                f = files.get(where.segment)
+                if f is None:
+                    try:
+                        f = files[where.segment] = open(self._segment_path(where.segment), 'rb')
+                    except FileNotFoundError:
+                        # Expired since the lookup
+                        continue
+                f.seek(where.offset)
+                entries.append(from_dict(AuditLog, json.loads(f.readline())))
+        finally:
+            for f in files.values():
+                f.close()
+        return entries
+
+    def page(self, collection: str, filters: Dict[str, Any], sort: str = 'created_at', descending: bool = False,
+             after: Optional[Tuple[str, str]] = None, limit: int = 25,
+             start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[AuditLog]:
+        """Backend-style keyset page of entries in [start, end)"""
+        self._ensure_loaded()
+        with self._lock:
+            self._refresh()
+            # Stops after limit matches, so a page costs its own size rather than the window's
+            found = list(itertools.islice(self._matching(filters, start, end, after, descending), limit))
+        return self._fetch(found)
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> 'AuditWindow':
+        return AuditWindow(self, start, end)
+
+    def count(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            self._refresh()
+            return len(self._range(self._keys, start, end, None, False))
+
+    def get_by_entity(self, entity_type: str, entity_id: str) -> List[AuditLog]:
+        """History of one entity, oldest first"""
+        self._ensure_loaded()
+        with self._lock:
+            self._refresh()
+            found = list(self._matching({'entity_type': entity_type, 'entity_id': entity_id}))
+        return self._fetch(found)
+
+    def all(self) -> List[AuditLog]:
+        self._ensure_loaded()
+        with self._lock:
+            self._refresh()
+            found = [self._where[record_id] for _, record_id in self._keys]
+        return self._fetch(found)
+
+class AuditWindow:
+    """A time range of the audit trail, usable wherever paginate expects a backend"""
+
+    def __init__(self, trail: AuditTrail, start: Optional[datetime], end: Optional[datetime]):
+        self.trail = trail
+        self.start = start
+        self.end = end
+
+    def page(self, collection: str, filters: Dict[str, Any], sort: str = 'created_at', descending: bool = False,
+             after: Optional[Tuple[str, str]] = None, limit: int = 25) -> List[AuditLog]:
+        return self.trail.page(collection, filters, sort, descending, after, limit, self.start, self.end)
@@ -0,0 +1,269 @@
+"""Latency, throughput and memory of the services and key routes.
+
+Seeds a fresh store with synthetic companies, people, questions and
+deployments through the services, then times service calls directly
+and the dashboard, user list, company list, question search and
+single registration routes through the Flask test client. Each
+operation reports p50/p95/p99 and mean latency, throughput, and the
+peak Python allocation of one call. Results are written as JSON, so
+two runs can be compared:
+
+    python benchmarks/load_suite.py --persons 100000 --output before.json
+    python benchmarks/load_suite.py --persons 100000 --output after.json --compare before.json
+
+STORAGE_URL is honoured (--storage overrides it); the store should be
+empty, since seeding adds to whatever is there.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Words synthetic question texts are drawn from, and searched for
+WORDS = ('satisfied', 'manager', 'team', 'workload', 'benefits', 'growth', 'culture', 'remote',
+         'feedback', 'recognition', 'training', 'balance', 'leadership', 'tools', 'career', 'pay')
+
+DEPARTMENTS = ('HR', 'Engineering', 'Sales', 'Marketing', 'Finance', 'Operations')
+LOCATIONS = ('New York', 'San Francisco', 'Austin', 'London', 'Remote')
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+def summarize(kind: str, latencies: List[float], elapsed: float, peak_alloc: int, errors: int) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        'kind': kind,
+        'count': len(ordered),
+        'errors': errors,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'throughput_per_s': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'peak_alloc_kb': round(peak_alloc / 1024, 1)
+    }
+
+def measure(kind: str, operation: Callable[[int], bool], iterations: int, warmup: int,
+            memory_samples: int) -> Dict[str, Any]:
+    """Time operation(i) over iterations calls; it returns False for a failed call"""
+    for i in range(warmup):
+        operation(i)
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        begin = time.perf_counter()
+        if operation(i) is False:
+            errors += 1
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - started
+    # Separate pass: tracing allocations would distort the timings above
+    peak = 0
+    tracemalloc.start()
+    for i in range(warmup + iterations, warmup + iterations + memory_samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        operation(i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return summarize(kind, latencies, elapsed, peak, errors)
+
+def seed(scale: Dict[str, int], rng: random.Random) -> Dict[str, Any]:
+    """Create the synthetic data set through the services; returns ids the operations pick from"""
+    from data_store import (CompanyService, DeploymentService, PersonService, QuestionService,
+                            SurveyTemplateService, generate_id)
+    from models import (Company, Deployment, DeploymentStatus, Person, Question, QuestionChoice, QuestionType,
+                        SurveyQuestion, SurveyStatus, SurveyTemplate, UserStatus)
+
+    timings = {}
+    started = time.perf_counter()
+    companies = [CompanyService.create(Company(id=generate_id(), name=f'Company {c}',
+                                               domains=[f'company{c}.example.com'], status='active'))
+                 for c in range(scale['companies'])]
+    timings['companies_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    statuses = (UserStatus.ACTIVE,) * 8 + (UserStatus.PENDING, UserStatus.INACTIVE)
+    batch = []
+    for p in range(scale['persons']):
+        company = companies[p % len(companies)]
+        batch.append(Person(id=generate_id(), company_id=company.id, email=f'person{p}@{company.domains[0]}',
+                            name=f'Person {p}', roles=['user'], status=statuses[p % len(statuses)],
+                            metadata={'department': rng.choice(DEPARTMENTS), 'location': rng.choice(LOCATIONS)}))
+        if len(batch) == 1000:
+            PersonService.create_many(batch)
+            batch = []
+    if batch:
+        PersonService.create_many(batch)
+    timings['persons_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    scale_choices = [QuestionChoice(str(n), f'Level {n}', n) for n in range(1, 6)]
+    types = (QuestionType.SCALE, QuestionType.SINGLE, QuestionType.MULTI, QuestionType.FREE)
+    questions = []
+    for q in range(scale['questions']):
+        question_type = types[q % len(types)]
+        choices = [] if question_type == QuestionType.FREE else list(scale_choices)
+        questions.append(QuestionService.create(Question(
+            id=generate_id(), code=f'B{q:05d}', type=question_type, choices=choices,
+            text=f"How do you rate {' and '.join(rng.sample(WORDS, 3))} here?")))
+    timings['questions_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    template_id = generate_id()
+    SurveyTemplateService.create(SurveyTemplate(
+        id=template_id, name='Benchmark Survey', version='1.0', program='Benchmark', status=SurveyStatus.READY,
+        questions=[SurveyQuestion(id=generate_id(), survey_template_id=template_id, question_id=question.id,
+                                  order=n + 1, section='Main')
+                   for n, question in enumerate(questions[:20])]))
+    now = datetime.now()
+    deployment_statuses = (DeploymentStatus.ACTIVE, DeploymentStatus.COMPLETED, DeploymentStatus.DRAFT)
+    for d in range(scale['deployments']):
+        DeploymentService.create(Deployment(
+            id=generate_id(), company_id=companies[d % len(companies)].id, survey_template_id=template_id,
+            name=f'Deployment {d}', status=deployment_statuses[d % len(deployment_statuses)], audience_type='all',
+            start_date=now - timedelta(days=30), end_date=now + timedelta(days=30),
+            metrics={'invites_sent': 100, 'responses_received': d % 100}))
+    timings['deployments_s'] = round(time.perf_counter() - started, 3)
+    return {'timings': timings, 'company_ids': [company.id for company in companies]}
+
+def operations(seeded: Dict[str, Any], client, rng: random.Random) -> Dict[str, tuple]:
+    """name -> (kind, operation(i)) in run order; writes come last so reads see a settled store"""
+    from data_store import CompanyService, DashboardService, PersonService, QuestionService
+    from models import UserStatus
+
+    company_ids = seeded['company_ids']
+    run = f'{os.getpid()}-{int(time.time())}'
+
+    def get(path_of):
+        return lambda i: client.get(path_of(i)).status_code == 200
+
+    def register(i):
+        company_id = company_ids[i % len(company_ids)]
+        response = client.post('/register-user', json={
+            'company_id': company_id, 'email': f'bench-{run}-{i}@example.com', 'fullName': f'Bench {i}',
+            'department': rng.choice(DEPARTMENTS), 'location': rng.choice(LOCATIONS)})
+        return response.status_code == 200
+
+    return {
+        'service.DashboardService.get_kpis': ('service', lambda i: DashboardService.get_kpis()),
+        'service.CompanyService.get_all': ('service', lambda i: CompanyService.get_all()),
+        'service.PersonService.page': ('service', lambda i: PersonService.page(
+            {'company_id': rng.choice(company_ids)}, sort='name', limit=25)),
+        'service.PersonService.count_by_status': ('service', lambda i: PersonService.count_by_status(
+            UserStatus.ACTIVE)),
+        'service.PersonService.get_by_email': ('service', lambda i: PersonService.get_by_email(
+            f'person{rng.randrange(max(seeded["persons"], 1))}@company0.example.com')),
+        'service.QuestionService.search_page': ('service', lambda i: QuestionService.search_page(
+            rng.choice(WORDS), limit=20)),
+        'route.dashboard': ('route', get(lambda i: '/')),
+        'route.users_index': ('route', get(lambda i: '/users')),
+        'route.users_index.by_company': ('route', get(lambda i: f'/users?company_id={rng.choice(company_ids)}')),
+        'route.companies_index': ('route', get(lambda i: '/companies')),
+        'route.api_questions_search': ('route', get(lambda i: f'/api/questions/search?q={rng.choice(WORDS)}')),
+        'route.register_user': ('route', register),
+    }
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or 'unknown'
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    """Print p50/p95 and throughput of this run relative to a previous results file"""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)['operations']
+    print(f"\n{'vs ' + baseline_path:<40}{'p50':>9}{'p95':>9}{'ops/s':>9}", file=sys.stderr)
+    for name, current in results['operations'].items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        ratios = [current[key] / before[key] if before[key] else float('nan')
+                  for key in ('p50_ms', 'p95_ms', 'throughput_per_s')]
+        print(f'{name:<40}' + ''.join(f'{ratio:>8.2f}x' for ratio in ratios), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--companies', type=int, default=50)
+    parser.add_argument('--persons', type=int, default=20_000)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--deployments', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per operation')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed calls per operation first')
+    parser.add_argument('--memory-samples', type=int, default=5, help='calls per operation traced for peak memory')
+    parser.add_argument('--only', action='append', default=[], help='run operations whose name contains this')
+    parser.add_argument('--storage', help='STORAGE_URL for the run (default: in-memory)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+
+    if args.storage:
+        os.environ['STORAGE_URL'] = args.storage
+    os.environ.setdefault('AUDIT_LOG_DIR', tempfile.mkdtemp(prefix='load-suite-audit-'))
+    os.environ.setdefault('EMAIL_OUTBOX_DIR', tempfile.mkdtemp(prefix='load-suite-outbox-'))
+    sys.path.insert(0, APP_DIR)
+    import logging
+    from app import app
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    scale = {'companies': max(args.companies, 1), 'persons': args.persons,
+             'questions': args.questions, 'deployments': args.deployments}
+    seeded = seed(scale, rng)
+    seeded['persons'] = scale['persons']
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': os.environ.get('STORAGE_URL', 'memory'),
+            'scale': scale,
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            'seed': args.seed
+        },
+        'seed': seeded['timings'],
+        'operations': {}
+    }
+    client = app.test_client()
+    print(f"{'operation':<40}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>10}{'peak KB':>10}", file=sys.stderr)
+    for name, (kind, operation) in operations(seeded, client, rng).items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        result = measure(kind, operation, args.iterations, args.warmup, args.memory_samples)
+        results['operations'][name] = result
+        print(f"{name:<40}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}"
+              f"{result['throughput_per_s']:>10.1f}{result['peak_alloc_kb']:>10.1f}"
+              + (f"  {result['errors']} errors" if result['errors'] else ''), file=sys.stderr)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['meta']['peak_rss_mb'] = round(max_rss / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""Bytes per record for the high-cardinality models, before and after compaction.
+
+Records are built from JSON-decoded dicts, as a storage backend loads
+them, so repeated strings start out as separate objects. "before" uses
+plain dataclasses with the original fields; "after" uses the slotted,
+interning models from models.py.
+
+    python benchmarks/model_memory.py [records]
+"""
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import AuditLog, Person, SurveyQuestion, UserStatus
+
+@dataclass
+class PlainPerson:
+    id: str
+    company_id: str
+    email: str
+    name: str
+    roles: List[str]
+    status: UserStatus
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+
+@dataclass
+class PlainSurveyQuestion:
+    id: str
+    survey_template_id: str
+    question_id: str
+    order: int
+    section: str
+    branching: Dict[str, Any] = field(default_factory=dict)
+    weights: Dict[str, float] = field(default_factory=dict)
+
+@dataclass
+class PlainAuditLog:
+    id: str
+    actor: str
+    action: str
+    entity_type: str
+    entity_id: str
+    diff: Dict[str, Any]
+    ip_address: str
+    user_agent: str
+    timestamp: datetime = field(default_factory=datetime.now)
+
+COMPANIES = [str(uuid.uuid4()) for _ in range(50)]
+TEMPLATES = [str(uuid.uuid4()) for _ in range(20)]
+QUESTIONS = [str(uuid.uuid4()) for _ in range(200)]
+METADATA = {
+    'department': ['HR', 'Engineering', 'Sales', 'Finance', 'Operations', 'Product'],
+    'location': ['New York', 'San Francisco', 'Austin', 'London', 'Bangalore'],
+    'work_mode': ['remote', 'hybrid', 'onsite'],
+    'shift': ['day', 'night']
+}
+ROLES = ['user', 'manager', 'admin']
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36'
+
+def person_rows(count: int) -> str:
+    start = datetime(2024, 1, 1)
+    return json.dumps([{
+        'id': str(uuid.uuid4()),
+        'company_id': random.choice(COMPANIES),
+        'email': f'user{i}@example.com',
+        'name': f'User {i}',
+        'roles': random.sample(ROLES, random.randint(1, 2)),
+        'status': 'active',
+        'metadata': {key: random.choice(values) for key, values in METADATA.items()},
+        'created_at': (start + timedelta(seconds=i)).isoformat(),
+        'updated_at': (start + timedelta(seconds=i)).isoformat()
+    } for i in range(count)])
+
+def survey_question_rows(count: int) -> str:
+    return json.dumps([{
+        'id': str(uuid.uuid4()),
+        'survey_template_id': random.choice(TEMPLATES),
+        'question_id': random.choice(QUESTIONS),
+        'order': i % 40,
+        'section': random.choice(['Work Environment', 'Benefits', 'Feedback', 'Wellbeing'])
+    } for i in range(count)])
+
+def audit_rows(count: int) -> str:
+    start = datetime(2024, 1, 1)
+    return json.dumps([{
+        'id': str(uuid.uuid4()),
+        'actor': 'admin',
+        'action': random.choice(['create', 'update', 'delete']),
+        'entity_type': random.choice(['user', 'company', 'deployment']),
+        'entity_id': str(uuid.uuid4()),
+        'diff': {'status': ['pending', 'active']},
+        'ip_address': '10.0.0.12',
+        'user_agent': USER_AGENT,
+        'timestamp': (start + timedelta(seconds=i)).isoformat()
+    } for i in range(count)])
+
+def build_person(cls: type, row: Dict[str, Any]) -> Any:
+    row['status'] = UserStatus(row['status'])
+    row['created_at'] = datetime.fromisoformat(row['created_at'])
+    row['updated_at'] = datetime.fromisoformat(row['updated_at'])
+    return cls(**row)
+
+def build_audit_log(cls: type, row: Dict[str, Any]) -> Any:
+    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return cls(**row)
+
+def build_plain(cls: type, row: Dict[str, Any]) -> Any:
+    return cls(**row)
+
+def bytes_per_record(payload: str, cls: type, build: Callable[[type, Dict[str, Any]], Any]) -> float:
+    """Memory retained per record, including the strings decoded for it"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    records = [build(cls, row) for row in json.loads(payload)]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return retained / len(records)
+
+def main(count: int = 100_000):
+    random.seed(7)
+    cases = [
+        ('Person', person_rows(count), PlainPerson, Person, build_person),
+        ('SurveyQuestion', survey_question_rows(count), PlainSurveyQuestion, SurveyQuestion, build_plain),
+        ('AuditLog', audit_rows(count), PlainAuditLog, AuditLog, build_audit_log)
+    ]
+    print(f'{count:,} records each')
+    print(f"{'model':<16}{'before':>10}{'after':>10}{'saved':>8}")
+    for name, payload, before_cls, after_cls, build in cases:
+        before = bytes_per_record(payload, before_cls, build)
+        after = bytes_per_record(payload, after_cls, build)
+        print(f'{name:<16}{before:>10.0f}{after:>10.0f}{1 - after / before:>8.0%}')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
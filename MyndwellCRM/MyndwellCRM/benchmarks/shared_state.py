@@ -0,0 +1,142 @@
+"""Read-after-write consistency across worker processes sharing one store.
+
+Starts N processes that each import the app against the same SQLite
+database, as gunicorn workers do, and drives them in turn through the
+HTTP routes. After a write through one worker, the very next request
+to every other worker must see it: in the user list and in the
+dashboard counters, which each worker caches. Audit entries are
+written behind, so once they are flushed every worker must list the
+same ones.
+
+    python benchmarks/shared_state.py [workers] [rounds]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def worker(storage_url: str, directory: str, conn):
+    """Serve ('get' | 'post' | 'form', path, body) requests from the parent over a pipe"""
+    os.environ['STORAGE_URL'] = storage_url
+    os.environ['AUDIT_LOG_DIR'] = os.path.join(directory, 'audit')
+    os.environ['EMAIL_OUTBOX_DIR'] = os.path.join(directory, 'outbox')
+    sys.path.insert(0, APP_DIR)
+    import logging
+    from app import app
+    logging.disable(logging.CRITICAL)
+    client = app.test_client()
+    conn.send(os.getpid())
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        method, path, body = command
+        if method == 'get':
+            response = client.get(path)
+        elif method == 'form':
+            response = client.post(path, data=body)
+        else:
+            response = client.post(path, json=body)
+        conn.send((response.status_code, response.get_json(silent=True)))
+
+class Harness:
+    def __init__(self, workers: int):
+        directory = tempfile.mkdtemp(prefix='shared-state-')
+        storage_url = f"sqlite:///{os.path.join(directory, 'myndwell.db')}"
+        context = multiprocessing.get_context('spawn')
+        self.conns, self.processes = [], []
+        for _ in range(workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=worker, args=(storage_url, directory, child))
+            process.start()
+            self.conns.append(parent)
+            self.processes.append(process)
+        self.pids = [conn.recv() for conn in self.conns]
+        self.failures = []
+
+    def request(self, index: int, method: str, path: str, body=None):
+        self.conns[index].send((method, path, body))
+        return self.conns[index].recv()
+
+    def expect(self, label: str, index: int, actual, expected):
+        if actual != expected:
+            self.failures.append(f'{label}: worker {index} (pid {self.pids[index]}) read {actual!r}, expected {expected!r}')
+
+    def kpis(self, index: int):
+        return self.request(index, 'get', '/api/dashboard')[1]
+
+    def emails(self, index: int, company_id: str):
+        items = self.request(index, 'get', f'/api/users?company_id={company_id}&limit=500')[1]['items']
+        return sorted(item['email'] for item in items)
+
+    def run_round(self, number: int):
+        workers = len(self.conns)
+        writer = number % workers
+        readers = [i for i in range(workers) if i != writer]
+        before = self.kpis(writer)
+
+        name = f'Company {uuid.uuid4().hex[:8]}'
+        self.request(writer, 'form', '/companies/create', {'name': name, 'domains': 'example.com', 'status': 'active'})
+        companies = self.request(writer, 'get', '/api/companies?order=desc&limit=1')[1]['items']
+        company_id = companies[0]['id']
+        for i in readers:
+            self.expect(f'round {number} company count', i, self.kpis(i)['total_companies'],
+                        before['total_companies'] + 1)
+
+        email = f'user-{uuid.uuid4().hex[:8]}@example.com'
+        self.request(writer, 'post', '/register-user', {'company_id': company_id, 'email': email, 'fullName': email})
+        for i in readers:
+            self.expect(f'round {number} user count', i, self.kpis(i)['total_users'], before['total_users'] + 1)
+            self.expect(f'round {number} user list', i, self.emails(i, company_id), [email])
+
+        # The user is removed through a different worker than the one that created it
+        deleter = readers[0] if readers else writer
+        person_id = self.request(deleter, 'get', f'/api/users?company_id={company_id}')[1]['items'][0]['id']
+        self.request(deleter, 'form', f'/users/{person_id}/delete', {})
+        for i in range(workers):
+            self.expect(f'round {number} user count after delete', i, self.kpis(i)['total_users'],
+                        before['total_users'])
+            self.expect(f'round {number} user list after delete', i, self.emails(i, company_id), [])
+
+    def audit_ids(self, index: int):
+        items = self.request(index, 'get', '/api/audit-logs?entity_type=company&limit=100')[1]['items']
+        return sorted(item['id'] for item in items)
+
+    def check_audit(self):
+        # Past the flush interval and the trail's refresh interval
+        time.sleep(1.5)
+        expected = self.audit_ids(0)
+        for i in range(1, len(self.conns)):
+            self.expect('audit entries', i, self.audit_ids(i), expected)
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+
+def main(workers: int = 4, rounds: int = 20):
+    harness = Harness(workers)
+    try:
+        # Warm every worker's caches so stale reads would show
+        for i in range(workers):
+            harness.kpis(i)
+        started = time.perf_counter()
+        for number in range(rounds):
+            harness.run_round(number)
+        elapsed = time.perf_counter() - started
+        harness.check_audit()
+    finally:
+        harness.close()
+    print(f'{workers} workers, {rounds} rounds in {elapsed:.2f}s')
+    for failure in harness.failures:
+        print(f'  {failure}')
+    print('FAILED' if harness.failures else 'all reads after writes consistent')
+    return 1 if harness.failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*(int(arg) for arg in sys.argv[1:3])))
@@ -0,0 +1,61 @@
+"""Warm start time of the file:// storage backend.
+
+Writes a snapshot of N people (default 1,000,000) plus a journal of
+further writes, then times opening the store, the first page of the
+people list, and a lookup by id.
+
+    python benchmarks/warm_start.py [records] [journal_writes]
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import Person, UserStatus
+from snapshot import PersistentMemoryBackend, write_snapshot
+from storage import COLLECTIONS, MemoryBackend
+
+def people(count: int, company_ids: list):
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        yield Person(id=str(uuid.uuid4()), company_id=company_ids[i % len(company_ids)],
+                     email=f'user{i}@example.com', name=f'User {i}', roles=['user'],
+                     status=UserStatus.ACTIVE,
+                     metadata={'department': ('HR', 'Engineering', 'Sales')[i % 3], 'location': 'Austin'},
+                     created_at=start + timedelta(seconds=i), updated_at=start + timedelta(seconds=i))
+
+def timed(label: str, action):
+    started = time.perf_counter()
+    result = action()
+    print(f'{label:<32}{time.perf_counter() - started:>8.2f}s')
+    return result
+
+def main(count: int = 1_000_000, journal_writes: int = 10_000):
+    directory = tempfile.mkdtemp(prefix='warm-start-')
+    company_ids = [str(uuid.uuid4()) for _ in range(100)]
+
+    seed = MemoryBackend({c: {} for c in COLLECTIONS})
+    with seed.bulk():
+        timed(f'build {count:,} people', lambda: seed.put_many('persons', people(count, company_ids)))
+    timed('write snapshot', lambda: write_snapshot(os.path.join(directory, 'snapshot.bin'), seed.store, seed._keys, seed.sorted))
+    print(f"{'snapshot size':<32}{os.path.getsize(os.path.join(directory, 'snapshot.bin')) / 2**20:>8.1f}MB")
+    some_id = next(iter(seed.store['persons']))
+    del seed
+
+    backend = PersistentMemoryBackend({}, directory, fsync='never')
+    timed(f'journal {journal_writes:,} writes', lambda: [
+        backend.put('persons', person) for person in people(journal_writes, company_ids)])
+    del backend
+
+    backend = timed('warm start (map + replay)', lambda: PersistentMemoryBackend({}, directory, fsync='never'))
+    print(f"{'records':<32}{backend.count('persons'):>9,}")
+    timed('first page by name', lambda: backend.page('persons', {}, sort='name', limit=25))
+    timed('get by id', lambda: backend.get('persons', some_id))
+    timed('find by company', lambda: backend.find('persons', 'company_id', company_ids[0]))
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
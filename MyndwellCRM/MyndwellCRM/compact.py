@@ -0,0 +1,106 @@
+import sys
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+def intern(value: Any) -> Any:
+    """Intern strings so repeated values share one object"""
+    return sys.intern(value) if type(value) is str else value
+
+def intern_list(values: Any) -> Any:
+    return [intern(v) for v in values] if isinstance(values, (list, tuple)) else values
+
+class MetadataSchema:
+    """An ordered key set shared by every metadata mapping that uses it"""
+    __slots__ = ('keys', 'index')
+
+    def __init__(self, keys: Tuple[str, ...]):
+        self.keys = keys
+        self.index = {key: position for position, key in enumerate(keys)}
+
+# Key tuple -> schema; people imported for one company share one key set
+_schemas: Dict[Tuple[str, ...], MetadataSchema] = {}
+
+def metadata_schema(keys: Tuple[str, ...]) -> MetadataSchema:
+    keys = tuple(intern(str(k)) for k in keys)
+    schema = _schemas.get(keys)
+    if schema is None:
+        schema = _schemas.setdefault(keys, MetadataSchema(keys))
+    return schema
+
+class CompactMetadata(MutableMapping):
+    """dict-compatible metadata stored as a shared schema plus a tuple of values.
+
+    Mutation swaps in the schema for the new key set, so the common case
+    of many records with the same keys costs one tuple per record
+    instead of one dict.
+    """
+    __slots__ = ('_schema', '_values')
+
+    def __init__(self, data: Any = ()):
+        items = dict(data)
+        self._schema = metadata_schema(tuple(items))
+        self._values = tuple(intern(v) for v in items.values())
+
+    @classmethod
+    def of(cls, value: Any) -> Any:
+        if isinstance(value, CompactMetadata) or value is None:
+            return value
+        return cls(value)
+
+    def __getitem__(self, key: str) -> Any:
+        position = self._schema.index.get(key)
+        if position is None:
+            raise KeyError(key)
+        return self._values[position]
+
+    def __setitem__(self, key: str, value: Any):
+        items = dict(zip(self._schema.keys, self._values))
+        items[key] = value
+        self._schema = metadata_schema(tuple(items))
+        self._values = tuple(intern(v) for v in items.values())
+
+    def __delitem__(self, key: str):
+        items = dict(zip(self._schema.keys, self._values))
+        del items[key]
+        self._schema = metadata_schema(tuple(items))
+        self._values = tuple(items.values())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._schema.keys)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._schema.index
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        return (CompactMetadata, (dict(self.items()),))
+
+    def copy(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+class Normalized:
+    """Data descriptor over a slot that normalizes every value assigned to it"""
+    __slots__ = ('slot', 'convert')
+
+    def __init__(self, slot: Any, convert: Callable[[Any], Any]):
+        self.slot = slot
+        self.convert = convert
+
+    def __get__(self, obj: Any, owner: Any = None) -> Any:
+        return self if obj is None else self.slot.__get__(obj, owner)
+
+    def __set__(self, obj: Any, value: Any):
+        self.slot.__set__(obj, self.convert(value))
+
+def normalize_fields(**converters: Callable[[Any], Any]):
+    """Class decorator for slotted dataclasses: run each field's converter on assignment"""
+    def decorate(cls):
+        for name, convert in converters.items():
+            setattr(cls, name, Normalized(cls.__dict__[name], convert))
+        return cls
+    return decorate
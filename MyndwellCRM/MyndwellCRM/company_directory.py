@@ -0,0 +1,150 @@
+import itertools
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from models import *
+
+# Registration dropdown -> Person.metadata key its values come from
+OPTION_FIELDS = {
+    'Designations': 'designation',
+    'Departments': 'department',
+    'CompanyLocations': 'location',
+    'CurrentRoles': 'current_role',
+    'WorkMode': 'work_mode',
+    'Shift': 'shift'
+}
+
+# Offered after the values a company's people already use, so a new company's form is not empty
+DEFAULT_OPTIONS = {
+    'Designations': ('Manager', 'Senior Developer', 'Developer', 'Analyst', 'Coordinator'),
+    'Departments': ('Engineering', 'HR', 'Sales', 'Marketing', 'Finance'),
+    'CompanyLocations': ('New York', 'San Francisco', 'Austin', 'Remote'),
+    'CurrentRoles': ('Team Lead', 'Individual Contributor', 'Manager', 'Director'),
+    'WorkMode': ('Remote', 'On-site', 'Hybrid'),
+    'Shift': ('Day Shift', 'Night Shift', 'Flexible')
+}
+
+def _values(person: Person) -> Tuple[Tuple[str, str], ...]:
+    """(option, value) pairs a person contributes"""
+    metadata = person.metadata or {}
+    return tuple((option, str(metadata[key]).strip()) for option, key in OPTION_FIELDS.items()
+                 if metadata.get(key) not in (None, ''))
+
+class CompanyOptions:
+    """Counts of the metadata values one company's people use"""
+
+    def __init__(self, serial: int, persons: Iterable[Person]):
+        self.serial = serial
+        self.counts: Dict[str, Counter] = {option: Counter() for option in OPTION_FIELDS}
+        # What each person was counted under; services update records in place
+        self.filed: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+        self.version = 0
+        self._options: Optional[Dict[str, List[str]]] = None
+        for person in persons:
+            self.put(person)
+
+    def put(self, person: Person):
+        values = _values(person)
+        if self.filed.get(person.id) == values:
+            return
+        self.discard(person.id)
+        for option, value in values:
+            self.counts[option][value] += 1
+        self.filed[person.id] = values
+        self._changed()
+
+    def discard(self, person_id: str):
+        values = self.filed.pop(person_id, None)
+        if values is None:
+            return
+        for option, value in values:
+            counts = self.counts[option]
+            counts[value] -= 1
+            if counts[value] <= 0:
+                del counts[value]
+        self._changed()
+
+    @property
+    def tag(self) -> str:
+        """Changes with every recount; serial keeps tags of rebuilt tables from repeating"""
+        return f'{self.serial}.{self.version}'
+
+    def _changed(self):
+        self.version += 1
+        self._options = None
+
+    def options(self) -> Dict[str, List[str]]:
+        """Values in use, most common first, followed by the defaults not yet used"""
+        if self._options is None:
+            options = {}
+            for option, counts in self.counts.items():
+                used = [value for value, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+                seen = {value.lower() for value in used}
+                options[option] = used + [value for value in DEFAULT_OPTIONS[option] if value.lower() not in seen]
+            self._options = options
+        return self._options
+
+class CompanyDirectory:
+    """Registration dropdown options per company, maintained from person writes.
+
+    A company's counts are built from its people on first request and
+    then kept current by the write listener. Each change bumps the
+    company's version, which the options endpoint uses as its ETag, so
+    clients revalidate cheaply and only that company's tag changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._companies: Dict[str, CompanyOptions] = {}
+        self._serials = itertools.count(1)
+        # Invalidations and person writes seen, to tell whether one landed while a table was being built
+        self._epoch = 0
+        self._writes = 0
+
+    def invalidate(self, company_id: Optional[str] = None):
+        with self._lock:
+            self._epoch += 1
+            if company_id is None:
+                self._companies.clear()
+            else:
+                self._companies.pop(company_id, None)
+
+    def loaded(self) -> bool:
+        with self._lock:
+            return bool(self._companies)
+
+    def get(self, company_id: str, load) -> Tuple[str, Dict[str, List[str]]]:
+        """(version tag, options) for a company; load(company_id) yields its people when not yet built"""
+        with self._lock:
+            table = self._companies.get(company_id)
+            if table is not None:
+                return table.tag, table.options()
+            epoch, writes, serial = self._epoch, self._writes, next(self._serials)
+        table = CompanyOptions(serial, load(company_id))
+        with self._lock:
+            # Only keep a table no write raced with; the next request rebuilds otherwise
+            if (self._epoch, self._writes) == (epoch, writes) and company_id not in self._companies:
+                self._companies[company_id] = table
+            return table.tag, table.options()
+
+    def apply(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: recount a changed person under their company"""
+        if collection == 'companies' and after is None and before is not None:
+            self.invalidate(before.id)
+        if collection != 'persons':
+            return
+        with self._lock:
+            self._writes += 1
+            if before is not None and before.company_id in self._companies:
+                self._companies[before.company_id].discard(before.id)
+            if after is not None and after.company_id in self._companies:
+                self._companies[after.company_id].put(after)
+
+    def on_remote_write(self, person_id: str, person: Optional[Person]):
+        """Recount a person another process wrote; person is their stored state or None"""
+        with self._lock:
+            self._writes += 1
+            for table in self._companies.values():
+                table.discard(person_id)
+            if person is not None and person.company_id in self._companies:
+                self._companies[person.company_id].put(person)
@@ -1,7 +1,24 @@
+import itertools
+import os
+import threading
 import uuid
+from copy import copy
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Tuple
 from models import *
+from storage import COLLECTIONS, StorageBackend, create_backend, index_key, sort_value
+from search_index import QuestionSearchIndex
+from kpis import KPIAggregates
+from response_aggregates import DeploymentResults, ResponseAggregates
+from analytics import ReportTable, ResponseAnalytics
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, Page, decode_cursor, encode_cursor, paginate, walk
+from audit import AuditTrail
+from read_cache import ReadCache
+from live_updates import MetricsBus
+from participant_index import ORDER_FIELDS, STATUS_FIELDS, ParticipantIndex
+from company_directory import CompanyDirectory
+from survey_plan import SurveyPlan, SurveyPlanCache, SurveyPlanError, compile_survey
 
 # In-memory data store
 data_store = {
@@ -10,14 +27,213 @@ data_store = {
     'questions': {},
     'survey_templates': {},
     'deployments': {},
-    'audit_logs': {}
+    'responses': {},
+    'participants': {}
 }
 
 def generate_id():
     return str(uuid.uuid4())
 
-def init_data_store():
-    """Initialize the data store with sample data"""
+# Storage backend behind the services. The default in-memory backend keeps
+# its records in data_store; STORAGE_URL=file://<directory> keeps that store
+# across restarts with a snapshot and write-ahead journal, and an SQLAlchemy
+# URL (e.g. sqlite:///myndwell.db or postgresql://...) shares one store
+# across workers (gunicorn -w N); sync_changes() keeps each worker's
+# caches in step with the others' writes.
+backend: StorageBackend = None
+
+# Full-text index over the question bank, rebuilt from the backend on first use
+question_index = QuestionSearchIndex()
+
+# Dashboard counters, loaded from the backend on first use
+dashboard_kpis = KPIAggregates()
+
+# Per-deployment survey results, built from stored responses on first read
+response_aggregates = ResponseAggregates()
+
+# Columnar copy of responses for cross-tab reports, loaded on first query
+response_analytics = ResponseAnalytics()
+
+# Per-deployment participant status tables for the survey tracker and
+# reminder selection, built from stored rows on first use
+participant_index = ParticipantIndex()
+
+# Registration dropdown options per company, counted from its people's
+# metadata on first request and kept current by person writes
+company_directory = CompanyDirectory()
+
+# Compiled branching and validation plans of survey templates, used for
+# every submitted response
+survey_plans = SurveyPlanCache(lambda question_id: backend.get('questions', question_id))
+
+# Shared snapshots and id->name maps of the small collections (companies,
+# questions, survey templates, deployments) plus derived views over them,
+# including rendered page fragments
+read_cache = ReadCache(lambda collection: backend.all(collection),
+                       lambda collection, record_id: backend.get(collection, record_id),
+                       derived_size=256)
+
+# Changes SurveyTemplateService.edit_questions applies to a template's question list
+QUESTION_OPERATIONS = ('add', 'remove', 'move', 'section', 'reorder')
+
+# Inputs of the per-company report summaries
+REPORT_INPUTS = ('companies', 'deployments', 'responses', 'questions', 'survey_templates')
+
+# Callbacks run after every service write as listener(collection, before, after);
+# before is None for a create and after is None for a delete
+write_listeners: List[Callable[[str, Optional[Any], Optional[Any]], None]] = []
+
+def add_write_listener(listener: Callable[[str, Optional[Any], Optional[Any]], None]):
+    write_listeners.append(listener)
+    return listener
+
+def _notify_write(collection: str, before: Optional[Any], after: Optional[Any]):
+    for listener in write_listeners:
+        listener(collection, before, after)
+
+# Callbacks run as listener(collection, record_id) for each write another
+# process sharing the backend committed; they drop what this process cached
+sync_listeners: List[Callable[[str, str], None]] = []
+
+def add_sync_listener(listener: Callable[[str, str], None]):
+    sync_listeners.append(listener)
+    return listener
+
+# Position in the backend's change feed this process has caught up to
+_change_cursor: Optional[int] = None
+_sync_lock = threading.Lock()
+
+def sync_changes():
+    """Invalidate cached results made stale by other workers' writes; run before each request"""
+    global _change_cursor
+    with _sync_lock:
+        _change_cursor, changes = backend.changes_since(_change_cursor)
+    if changes is None:
+        _invalidate_caches()
+        return
+    for collection, record_id in changes:
+        for listener in sync_listeners:
+            listener(collection, record_id)
+
+# Live deployment metrics for the monitor page's event stream; each tick
+# also catches up on other workers' writes while anyone is watching
+metrics_bus = MetricsBus(poll=sync_changes)
+
+def _publish_metrics(collection: str, before: Optional[Any], after: Optional[Any]):
+    if collection == 'deployments' and after is not None:
+        metrics_bus.publish(after.id, after.metrics)
+
+def _publish_remote_metrics(collection: str, record_id: str):
+    if collection == 'deployments' and metrics_bus.subscribed(record_id):
+        deployment = backend.get('deployments', record_id)
+        if deployment:
+            metrics_bus.publish(deployment.id, deployment.metrics)
+
+def _refresh_participants(collection: str, before: Optional[Any], after: Optional[Any]):
+    if collection == 'persons' and before is not None and after is not None and \
+            (before.name, before.email) != (after.name, after.email):
+        ParticipantService.refresh_person(after)
+
+def _update_question_index(collection: str, before: Optional[Any], after: Optional[Any]):
+    if collection != 'questions':
+        return
+    if after is None:
+        question_index.remove(before.id)
+    else:
+        question_index.add(after)
+
+# Append-only audit trail of every service write, persisted in segment
+# files under the directory init_data_store() opens (the app's
+# AUDIT_LOG_DIR); segments older than AUDIT_RETENTION_DAYS (default 365,
+# 0 keeps everything) are deleted
+audit_trail = AuditTrail(retention_days=int(os.environ.get('AUDIT_RETENTION_DAYS', 365)) or None)
+
+def _update_response_analytics(collection: str, before: Optional[Any], after: Optional[Any]):
+    # Edited questions and templates can change how stored answers are scored
+    if collection in ('questions', 'survey_templates') and before is not None:
+        response_analytics.invalidate()
+    if collection != 'responses' or response_analytics.stale:
+        return
+    if after is None:
+        response_analytics.remove(before.id)
+    else:
+        questions = {qid: backend.get('questions', qid) for qid in after.answers}
+        deployment = backend.get('deployments', after.deployment_id)
+        response_analytics.upsert(after, backend.get('persons', after.person_id),
+                                  {qid: q for qid, q in questions.items() if q},
+                                  ResponseService.get_weights(deployment) if deployment else {})
+
+def _invalidate_for_remote_write(collection: str, record_id: str):
+    if collection == 'questions':
+        question_index.invalidate()
+        response_aggregates.invalidate()
+        response_analytics.invalidate()
+    elif collection == 'survey_templates':
+        response_aggregates.invalidate()
+        response_analytics.invalidate()
+    elif collection == 'deployments':
+        response_aggregates.invalidate(record_id)
+    elif collection == 'responses':
+        response = backend.get('responses', record_id)
+        if response is None:
+            response_aggregates.invalidate()
+            response_analytics.remove(record_id)
+        else:
+            response_aggregates.invalidate(response.deployment_id)
+            _update_response_analytics('responses', None, response)
+    elif collection == 'participants' and participant_index.loaded():
+        participant_index.on_remote_write(record_id, backend.get('participants', record_id))
+    elif collection == 'persons' and company_directory.loaded():
+        company_directory.on_remote_write(record_id, backend.get('persons', record_id))
+    elif collection == 'companies':
+        company_directory.invalidate(record_id)
+    if collection in ('companies', 'persons', 'survey_templates', 'deployments'):
+        dashboard_kpis.invalidate()
+
+def _invalidate_caches():
+    question_index.invalidate()
+    dashboard_kpis.invalidate()
+    response_aggregates.invalidate()
+    response_analytics.invalidate()
+    read_cache.invalidate()
+    participant_index.invalidate()
+    survey_plans.invalidate()
+    company_directory.invalidate()
+
+add_write_listener(_update_question_index)
+add_write_listener(dashboard_kpis.apply)
+add_write_listener(response_aggregates.apply)
+add_write_listener(_update_response_analytics)
+add_write_listener(audit_trail.on_write)
+add_write_listener(read_cache.on_write)
+add_write_listener(_publish_metrics)
+add_write_listener(_refresh_participants)
+add_write_listener(participant_index.apply)
+add_write_listener(survey_plans.on_write)
+add_write_listener(company_directory.apply)
+add_sync_listener(_invalidate_for_remote_write)
+add_sync_listener(read_cache.on_remote_write)
+add_sync_listener(_publish_remote_metrics)
+add_sync_listener(survey_plans.on_remote_write)
+
+def configure_storage(url: str = 'memory') -> StorageBackend:
+    """Select the storage backend used by all services"""
+    global backend, _change_cursor
+    in_memory = url == 'memory' or url.startswith('file:')
+    backend = create_backend(url, store=data_store if in_memory else None)
+    _change_cursor = backend.changes_since(None)[0]
+    _invalidate_caches()
+    return backend
+
+configure_storage(os.environ.get('STORAGE_URL', 'memory'))
+
+def init_data_store(audit_directory: Optional[str] = None):
+    """Open the audit trail under audit_directory and initialize the data store with sample data"""
+    if audit_directory is not None:
+        audit_trail.open(audit_directory)
+    # Workers sharing a database race here; only the first to claim it seeds
+    if backend.count('companies') or not backend.claim('sample-data'):
+        return
     
     # Create sample companies
     company1 = Company(
@@ -34,8 +250,8 @@ def init_data_store():
         status="active"
     )
     
-    data_store['companies'][company1.id] = company1
-    data_store['companies'][company2.id] = company2
+    CompanyService.create(company1)
+    CompanyService.create(company2)
     
     # Create sample persons
     person1 = Person(
@@ -68,9 +284,9 @@ def init_data_store():
         metadata={"department": "Product", "location": "Austin"}
     )
     
-    data_store['persons'][person1.id] = person1
-    data_store['persons'][person2.id] = person2
-    data_store['persons'][person3.id] = person3
+    PersonService.create(person1)
+    PersonService.create(person2)
+    PersonService.create(person3)
     
     # Create sample questions
     question1 = Question(
@@ -112,9 +328,9 @@ def init_data_store():
         validation=QuestionValidation(required=False)
     )
     
-    data_store['questions'][question1.id] = question1
-    data_store['questions'][question2.id] = question2
-    data_store['questions'][question3.id] = question3
+    QuestionService.create(question1)
+    QuestionService.create(question2)
+    QuestionService.create(question3)
     
     # Create sample survey template
     survey_template1 = SurveyTemplate(
@@ -153,7 +369,7 @@ def init_data_store():
     for sq in survey_template1.questions:
         sq.survey_template_id = survey_template1.id
     
-    data_store['survey_templates'][survey_template1.id] = survey_template1
+    SurveyTemplateService.create(survey_template1)
     
     # Create sample deployment
     deployment1 = Deployment(
@@ -190,17 +406,58 @@ HR Team""",
         }
     )
     
-    data_store['deployments'][deployment1.id] = deployment1
+    DeploymentService.create(deployment1)
+    
+    # Invites for the sample deployment: John has opened the survey, Jane has not
+    ParticipantService.enroll(deployment1, [person1, person2])
+    ParticipantService.record_deliveries(deployment1.id, {
+        person1.id: ('sent', datetime.now() - timedelta(days=5)),
+        person2.id: ('sent', datetime.now() - timedelta(days=4))
+    })
+    ParticipantService.record_progress(deployment1.id, person1.id, ParticipationStatus.IN_PROGRESS)
 
 # CRUD Operations
 class CompanyService:
     @staticmethod
-    def get_all() -> List[Company]:
-        return list(data_store['companies'].values())
+    def get_all() -> Tuple[Company, ...]:
+        return read_cache.all('companies')
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        return paginate(backend, 'companies', filters, sort, descending, cursor, limit)
     
     @staticmethod
     def get_by_id(company_id: str) -> Optional[Company]:
-        return data_store['companies'].get(company_id)
+        return read_cache.get('companies', company_id)
+    
+    @staticmethod
+    def name_map() -> Mapping[str, str]:
+        return read_cache.names('companies')
+    
+    @staticmethod
+    def domains(company_id: str) -> Optional[FrozenSet[str]]:
+        """Lower-cased email domains of a company (None if there is no such company), cached until companies change"""
+        def build():
+            company = CompanyService.get_by_id(company_id)
+            return frozenset(domain.lower() for domain in company.domains) if company else None
+        return read_cache.derived(('company_domains', company_id), ('companies',), build)
+    
+    @staticmethod
+    def domain_owners() -> Mapping[str, str]:
+        """Every company email domain -> id of the company that owns it"""
+        def build():
+            return MappingProxyType({domain.lower(): c.id for c in CompanyService.get_all() for domain in c.domains})
+        return read_cache.derived('domain_owners', ('companies',), build)
+    
+    @staticmethod
+    def registration_options(company_id: str) -> Tuple[str, Dict[str, List[str]]]:
+        """(version tag, dropdown values) for a company's registration form; the tag changes with the values"""
+        return company_directory.get(company_id, lambda cid: backend.find('persons', 'company_id', cid))
+    
+    @staticmethod
+    def count() -> int:
+        return backend.count('companies')
     
     @staticmethod
     def create(company: Company) -> Company:
@@ -208,35 +465,78 @@ class CompanyService:
             company.id = generate_id()
         company.created_at = datetime.now()
         company.updated_at = datetime.now()
-        data_store['companies'][company.id] = company
+        backend.put('companies', company)
+        _notify_write('companies', None, company)
         return company
     
     @staticmethod
     def update(company_id: str, updates: Dict) -> Optional[Company]:
-        company = data_store['companies'].get(company_id)
+        company = backend.get('companies', company_id)
         if company:
+            before = copy(company)
             for key, value in updates.items():
                 if hasattr(company, key):
                     setattr(company, key, value)
             company.updated_at = datetime.now()
+            backend.put('companies', company)
+            _notify_write('companies', before, company)
         return company
     
     @staticmethod
     def delete(company_id: str) -> bool:
-        return data_store['companies'].pop(company_id, None) is not None
+        company = backend.get('companies', company_id)
+        if company is None or not backend.delete('companies', company_id):
+            return False
+        _notify_write('companies', company, None)
+        return True
 
 class PersonService:
     @staticmethod
     def get_all() -> List[Person]:
-        return list(data_store['persons'].values())
+        return backend.all('persons')
     
     @staticmethod
     def get_by_company(company_id: str) -> List[Person]:
-        return [p for p in data_store['persons'].values() if p.company_id == company_id]
+        return backend.find('persons', 'company_id', company_id)
+    
+    @staticmethod
+    def get_by_status(status: UserStatus) -> List[Person]:
+        return backend.find('persons', 'status', status)
+    
+    @staticmethod
+    def get_by_email(email: str) -> Optional[Person]:
+        matches = backend.find('persons', 'email', email)
+        return matches[0] if matches else None
+    
+    @staticmethod
+    def count() -> int:
+        return backend.count('persons')
+    
+    @staticmethod
+    def count_by_company(company_id: str) -> int:
+        return backend.count('persons', 'company_id', company_id)
+    
+    @staticmethod
+    def count_by_status(status: UserStatus) -> int:
+        return backend.count('persons', 'status', status)
+    
+    @staticmethod
+    def counts_by_company() -> Dict[str, int]:
+        return backend.counts_by('persons', 'company_id')
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        return paginate(backend, 'persons', filters, sort, descending, cursor, limit)
+    
+    @staticmethod
+    def walk(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False) -> Iterator[Person]:
+        """Every matching person in order, read a page at a time for exports"""
+        return walk(backend, 'persons', filters, sort, descending)
     
     @staticmethod
     def get_by_id(person_id: str) -> Optional[Person]:
-        return data_store['persons'].get(person_id)
+        return backend.get('persons', person_id)
     
     @staticmethod
     def create(person: Person) -> Person:
@@ -244,31 +544,63 @@ class PersonService:
             person.id = generate_id()
         person.created_at = datetime.now()
         person.updated_at = datetime.now()
-        data_store['persons'][person.id] = person
+        backend.put('persons', person)
+        _notify_write('persons', None, person)
         return person
     
+    @staticmethod
+    def create_many(persons: List[Person]) -> List[Person]:
+        now = datetime.now()
+        for person in persons:
+            if not person.id:
+                person.id = generate_id()
+            person.created_at = now
+            person.updated_at = now
+        backend.put_many('persons', persons)
+        for person in persons:
+            _notify_write('persons', None, person)
+        return persons
+    
     @staticmethod
     def update(person_id: str, updates: Dict) -> Optional[Person]:
-        person = data_store['persons'].get(person_id)
+        person = backend.get('persons', person_id)
         if person:
+            before = copy(person)
             for key, value in updates.items():
                 if hasattr(person, key):
                     setattr(person, key, value)
             person.updated_at = datetime.now()
+            backend.put('persons', person)
+            _notify_write('persons', before, person)
         return person
     
     @staticmethod
     def delete(person_id: str) -> bool:
-        return data_store['persons'].pop(person_id, None) is not None
+        person = backend.get('persons', person_id)
+        if person is None or not backend.delete('persons', person_id):
+            return False
+        _notify_write('persons', person, None)
+        return True
 
 class QuestionService:
     @staticmethod
-    def get_all() -> List[Question]:
-        return list(data_store['questions'].values())
+    def get_all() -> Tuple[Question, ...]:
+        return read_cache.all('questions')
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        return paginate(backend, 'questions', filters, sort, descending, cursor, limit)
     
     @staticmethod
     def get_by_id(question_id: str) -> Optional[Question]:
-        return data_store['questions'].get(question_id)
+        return read_cache.get('questions', question_id)
+    
+    @staticmethod
+    def unknown_ids(question_ids: Iterable[str]) -> List[str]:
+        """The given ids that are not in the question bank, in order"""
+        bank = read_cache.snapshot('questions').by_id
+        return [question_id for question_id in dict.fromkeys(question_ids) if question_id not in bank]
     
     @staticmethod
     def create(question: Question) -> Question:
@@ -276,27 +608,64 @@ class QuestionService:
             question.id = generate_id()
         question.created_at = datetime.now()
         question.updated_at = datetime.now()
-        data_store['questions'][question.id] = question
+        backend.put('questions', question)
+        _notify_write('questions', None, question)
         return question
     
     @staticmethod
-    def search(query: str) -> List[Question]:
-        results = []
-        query_lower = query.lower()
-        for question in data_store['questions'].values():
-            if (query_lower in question.text.lower() or 
-                query_lower in question.code.lower()):
-                results.append(question)
-        return results
+    def update(question_id: str, updates: Dict) -> Optional[Question]:
+        question = backend.get('questions', question_id)
+        if question:
+            before = copy(question)
+            for key, value in updates.items():
+                if hasattr(question, key):
+                    setattr(question, key, value)
+            question.updated_at = datetime.now()
+            backend.put('questions', question)
+            _notify_write('questions', before, question)
+        return question
+    
+    @staticmethod
+    def delete(question_id: str) -> bool:
+        question = backend.get('questions', question_id)
+        if question is None or not backend.delete('questions', question_id):
+            return False
+        _notify_write('questions', question, None)
+        return True
+    
+    @staticmethod
+    def search_page(query: str, types: Optional[List[QuestionType]] = None,
+                    offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Question], int]:
+        if question_index.stale:
+            question_index.rebuild(backend.all('questions'))
+        return question_index.search(query, types=types, offset=offset, limit=limit)
+    
+    @staticmethod
+    def search(query: str, types: Optional[List[QuestionType]] = None,
+               offset: int = 0, limit: Optional[int] = None) -> List[Question]:
+        return QuestionService.search_page(query, types, offset, limit)[0]
 
 class SurveyTemplateService:
     @staticmethod
-    def get_all() -> List[SurveyTemplate]:
-        return list(data_store['survey_templates'].values())
+    def get_all() -> Tuple[SurveyTemplate, ...]:
+        return read_cache.all('survey_templates')
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        return paginate(backend, 'survey_templates', filters, sort, descending, cursor, limit)
     
     @staticmethod
     def get_by_id(template_id: str) -> Optional[SurveyTemplate]:
-        return data_store['survey_templates'].get(template_id)
+        return read_cache.get('survey_templates', template_id)
+    
+    @staticmethod
+    def name_map() -> Mapping[str, str]:
+        return read_cache.names('survey_templates')
+    
+    @staticmethod
+    def count_by_status(status: SurveyStatus) -> int:
+        return backend.count('survey_templates', 'status', status)
     
     @staticmethod
     def create(template: SurveyTemplate) -> SurveyTemplate:
@@ -304,27 +673,122 @@ class SurveyTemplateService:
             template.id = generate_id()
         template.created_at = datetime.now()
         template.updated_at = datetime.now()
-        data_store['survey_templates'][template.id] = template
+        backend.put('survey_templates', template)
+        _notify_write('survey_templates', None, template)
         return template
     
     @staticmethod
     def update(template_id: str, updates: Dict) -> Optional[SurveyTemplate]:
-        template = data_store['survey_templates'].get(template_id)
+        template = backend.get('survey_templates', template_id)
         if template:
+            before = copy(template)
             for key, value in updates.items():
                 if hasattr(template, key):
                     setattr(template, key, value)
             template.updated_at = datetime.now()
+            backend.put('survey_templates', template)
+            _notify_write('survey_templates', before, template)
         return template
+    
+    @staticmethod
+    def edit_questions(template_id: str, operations: List[Dict[str, Any]]) -> Optional[SurveyTemplate]:
+        """Apply a batch of question list changes to a template in one write.
+        
+        Each operation is {'op': 'add', 'question_id', 'section', 'position'?},
+        {'op': 'remove' | 'move', 'question_id', 'position'}, {'op': 'section',
+        'question_id', 'section'} or {'op': 'reorder', 'question_ids': [...]}.
+        Raises ValueError naming the first operation that does not apply, or
+        if the result no longer compiles; nothing is saved unless all apply.
+        """
+        template = backend.get('survey_templates', template_id)
+        if template is None:
+            return None
+        if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+            raise ValueError('operations must be a list of objects')
+        bank = read_cache.snapshot('questions').by_id
+        unknown = QuestionService.unknown_ids(str(op.get('question_id')) for op in operations
+                                            if op.get('op') == 'add' and 'question_id' in op)
+        if unknown:
+            raise ValueError(f"Unknown question(s): {', '.join(unknown)}")
+        items = [copy(sq) for sq in sorted(template.questions, key=lambda sq: sq.order)]
+        
+        def index_of(question_id: Any) -> int:
+            for index, sq in enumerate(items):
+                if sq.question_id == question_id:
+                    return index
+            raise ValueError(f'{question_id} is not in this survey')
+        
+        def position_of(op: Dict[str, Any], default: int) -> int:
+            position = op.get('position', default)
+            if not isinstance(position, int) or isinstance(position, bool):
+                raise ValueError('position must be an integer')
+            return min(max(position, 0), len(items))
+        
+        for number, op in enumerate(operations, 1):
+            kind = op.get('op')
+            try:
+                if kind not in QUESTION_OPERATIONS:
+                    raise ValueError(f"op must be one of {', '.join(QUESTION_OPERATIONS)}")
+                if kind == 'add':
+                    if any(sq.question_id == op['question_id'] for sq in items):
+                        raise ValueError(f"{op['question_id']} is already in this survey")
+                    items.insert(position_of(op, len(items)), SurveyQuestion(
+                        id=generate_id(), survey_template_id=template_id, question_id=op['question_id'],
+                        order=0, section=str(op.get('section') or '')))
+                elif kind == 'remove':
+                    del items[index_of(op.get('question_id'))]
+                elif kind == 'move':
+                    moved = items.pop(index_of(op.get('question_id')))
+                    items.insert(position_of(op, len(items)), moved)
+                elif kind == 'section':
+                    items[index_of(op.get('question_id'))].section = str(op.get('section') or '')
+                else:
+                    order = op.get('question_ids')
+                    if not isinstance(order, list) or sorted(map(str, order)) != sorted(sq.question_id for sq in items):
+                        raise ValueError("question_ids must list every question in the survey exactly once")
+                    by_question = {sq.question_id: sq for sq in items}
+                    items = [by_question[question_id] for question_id in order]
+            except (KeyError, ValueError) as e:
+                message = f'missing {e.args[0]}' if isinstance(e, KeyError) else str(e)
+                raise ValueError(f'Operation {number} ({kind}): {message}')
+        for order, sq in enumerate(items, 1):
+            sq.order = order
+        
+        # Removing a question other questions branch to would leave the survey unanswerable
+        edited = copy(template)
+        edited.questions = items
+        compile_survey(edited, {sq.question_id: bank[sq.question_id] for sq in items if sq.question_id in bank})
+        return SurveyTemplateService.update(template_id, {'questions': items})
 
 class DeploymentService:
     @staticmethod
-    def get_all() -> List[Deployment]:
-        return list(data_store['deployments'].values())
+    def get_all() -> Tuple[Deployment, ...]:
+        return read_cache.all('deployments')
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        return paginate(backend, 'deployments', filters, sort, descending, cursor, limit)
     
     @staticmethod
     def get_by_id(deployment_id: str) -> Optional[Deployment]:
-        return data_store['deployments'].get(deployment_id)
+        return read_cache.get('deployments', deployment_id)
+    
+    @staticmethod
+    def get_by_company(company_id: str) -> List[Deployment]:
+        return backend.find('deployments', 'company_id', company_id)
+    
+    @staticmethod
+    def get_by_status(status: DeploymentStatus) -> List[Deployment]:
+        return backend.find('deployments', 'status', status)
+    
+    @staticmethod
+    def count_by_company(company_id: str) -> int:
+        return backend.count('deployments', 'company_id', company_id)
+    
+    @staticmethod
+    def count_by_status(status: DeploymentStatus) -> int:
+        return backend.count('deployments', 'status', status)
     
     @staticmethod
     def create(deployment: Deployment) -> Deployment:
@@ -332,15 +796,420 @@ class DeploymentService:
             deployment.id = generate_id()
         deployment.created_at = datetime.now()
         deployment.updated_at = datetime.now()
-        data_store['deployments'][deployment.id] = deployment
+        backend.put('deployments', deployment)
+        _notify_write('deployments', None, deployment)
         return deployment
     
     @staticmethod
     def update(deployment_id: str, updates: Dict) -> Optional[Deployment]:
-        deployment = data_store['deployments'].get(deployment_id)
+        deployment = backend.get('deployments', deployment_id)
         if deployment:
+            before = copy(deployment)
             for key, value in updates.items():
                 if hasattr(deployment, key):
                     setattr(deployment, key, value)
             deployment.updated_at = datetime.now()
+            backend.put('deployments', deployment)
+            _notify_write('deployments', before, deployment)
+        return deployment
+    
+    @staticmethod
+    def increment_metrics(deployment_id: str, deltas: Dict[str, int]) -> Optional[Deployment]:
+        """Add deltas to a deployment's metrics atomically, so concurrent callers all count"""
+        def apply(deployment: Deployment):
+            metrics = dict(deployment.metrics)
+            for key, delta in deltas.items():
+                metrics[key] = metrics.get(key, 0) + delta
+            if metrics.get('invites_sent'):
+                metrics['completion_rate'] = round(100 * metrics.get('responses_received', 0) / metrics['invites_sent'])
+            deployment.metrics = metrics
+            deployment.updated_at = datetime.now()
+
+        changed = backend.modify('deployments', deployment_id, apply)
+        if changed is None:
+            return None
+        before, deployment = changed
+        _notify_write('deployments', before, deployment)
         return deployment
+
+class ResponseService:
+    @staticmethod
+    def get_by_deployment(deployment_id: str) -> List[SurveyResponse]:
+        return backend.find('responses', 'deployment_id', deployment_id)
+    
+    @staticmethod
+    def get_for_person(deployment_id: str, person_id: str) -> Optional[SurveyResponse]:
+        for response in backend.find('responses', 'person_id', person_id):
+            if response.deployment_id == deployment_id:
+                return response
+        return None
+    
+    @staticmethod
+    def count_by_deployment(deployment_id: str) -> int:
+        return backend.count('responses', 'deployment_id', deployment_id)
+    
+    @staticmethod
+    def get_plan(deployment: Deployment) -> Optional[SurveyPlan]:
+        """Compiled plan of the deployment's survey; raises SurveyPlanError if its rules are broken"""
+        template = backend.get('survey_templates', deployment.survey_template_id)
+        return survey_plans.get(template) if template is not None else None
+    
+    @staticmethod
+    def get_questions(deployment: Deployment) -> List[Question]:
+        """Questions of the deployment's survey, in survey order"""
+        template = backend.get('survey_templates', deployment.survey_template_id)
+        if template is None:
+            return []
+        questions = (backend.get('questions', sq.question_id)
+                     for sq in sorted(template.questions, key=lambda sq: sq.order))
+        return [q for q in questions if q]
+    
+    @staticmethod
+    def get_weights(deployment: Deployment) -> Dict[str, Mapping[str, float]]:
+        """Choice weights per question id as the survey plan scores them: template overrides over the bank's"""
+        try:
+            plan = ResponseService.get_plan(deployment)
+        except SurveyPlanError:
+            plan = None
+        if plan is not None:
+            return {p.question.id: p.weights for p in plan.questions}
+        # A survey whose rules no longer compile still reports its stored answers the same way
+        template = backend.get('survey_templates', deployment.survey_template_id)
+        overrides = {sq.question_id: sq.weights for sq in template.questions} if template else {}
+        weights = {}
+        for question in ResponseService.get_questions(deployment):
+            merged = {c.code: float(c.weight) for c in question.choices if c.weight is not None}
+            merged.update({code: float(w) for code, w in overrides.get(question.id, {}).items()})
+            weights[question.id] = merged
+        return weights
+    
+    @staticmethod
+    def submit(deployment_id: str, person_id: str, answers: Dict[str, Any]) -> SurveyResponse:
+        """Record a person's answers, replacing any earlier submission"""
+        deployment = backend.get('deployments', deployment_id)
+        if deployment is None:
+            raise ValueError('Deployment not found')
+        if deployment.status != DeploymentStatus.ACTIVE:
+            raise ValueError('This survey is not accepting responses')
+        person = backend.get('persons', person_id)
+        if person is None or person.company_id != deployment.company_id:
+            raise ValueError('This survey link is not valid')
+        
+        plan = ResponseService.get_plan(deployment)
+        if plan is None:
+            raise ValueError('This survey is no longer available')
+        normalized = plan.evaluate(answers)
+        
+        response = ResponseService.get_for_person(deployment_id, person_id)
+        if response is None:
+            response = SurveyResponse(id=generate_id(), deployment_id=deployment_id,
+                                      person_id=person_id, answers=normalized)
+            backend.put('responses', response)
+            _notify_write('responses', None, response)
+            DeploymentService.increment_metrics(deployment_id, {'responses_received': 1})
+        else:
+            before = copy(response)
+            response.answers = normalized
+            response.updated_at = datetime.now()
+            backend.put('responses', response)
+            _notify_write('responses', before, response)
+        ParticipantService.record_progress(deployment_id, person_id, ParticipationStatus.COMPLETED)
+        return response
+    
+    @staticmethod
+    def get_results(deployment_id: str) -> Optional[DeploymentResults]:
+        """Precomputed per-question results, built from stored responses on first use"""
+        results = response_aggregates.get(deployment_id)
+        if results is None:
+            deployment = backend.get('deployments', deployment_id)
+            if deployment is None:
+                return None
+            results = response_aggregates.load(deployment_id, ResponseService.get_questions(deployment),
+                                               ResponseService.get_by_deployment(deployment_id),
+                                               ResponseService.get_weights(deployment))
+        return results
+    
+    @staticmethod
+    def summarize(deployments: List[Deployment]) -> Dict[str, Any]:
+        """Responses, completion rate and mean SCALE score across deployments"""
+        responses = invites = scale_count = 0
+        scale_sum = 0.0
+        for deployment in deployments:
+            results = ResponseService.get_results(deployment.id)
+            responses += results.responses
+            invites += deployment.metrics.get('invites_sent', 0)
+            scale_sum += results.scale_sum
+            scale_count += results.scale_count
+        return {
+            'responses': responses,
+            'completion_rate': round(100 * responses / invites) if invites else 0,
+            'satisfaction': round(scale_sum / scale_count, 1) if scale_count else None
+        }
+    
+    @staticmethod
+    def summarize_by_company() -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]:
+        """summarize() for each company's deployments and for all of them, cached until an input changes"""
+        def build():
+            deployments = DeploymentService.get_all()
+            by_company: Dict[str, List[Deployment]] = {}
+            for deployment in deployments:
+                by_company.setdefault(deployment.company_id, []).append(deployment)
+            return ({c.id: ResponseService.summarize(by_company.get(c.id, [])) for c in CompanyService.get_all()},
+                    ResponseService.summarize(deployments))
+        return read_cache.derived('company_summaries', REPORT_INPUTS, build)
+
+class ParticipantService:
+    """Per-deployment status of each invited person.
+
+    Rows are stored under an id derived from the deployment and person,
+    so they are fetched directly, and queried through participant_index.
+    """
+
+    @staticmethod
+    def participant_id(deployment_id: str, person_id: str) -> str:
+        return str(uuid.uuid5(uuid.NAMESPACE_OID, f'{deployment_id}:{person_id}'))
+
+    @staticmethod
+    def get(deployment_id: str, person_id: str) -> Optional[Participant]:
+        return backend.get('participants', ParticipantService.participant_id(deployment_id, person_id))
+
+    @staticmethod
+    def count_by_deployment(deployment_id: str) -> int:
+        return backend.count('participants', 'deployment_id', deployment_id)
+
+    @staticmethod
+    def _save(changes: List[Tuple[Optional[Participant], Participant]]):
+        backend.put_many('participants', [after for _, after in changes])
+        for before, after in changes:
+            _notify_write('participants', before, after)
+
+    @staticmethod
+    def _row(deployment: Deployment, person: Person) -> Participant:
+        return Participant(id=ParticipantService.participant_id(deployment.id, person.id),
+                           deployment_id=deployment.id, company_id=deployment.company_id,
+                           person_id=person.id, name=person.name, email=person.email)
+
+    @staticmethod
+    def enroll(deployment: Deployment, persons: Iterable[Person]) -> int:
+        """Add a pending row for each person not already in the deployment"""
+        changes = []
+        for person in persons:
+            if ParticipantService.get(deployment.id, person.id) is None:
+                changes.append((None, ParticipantService._row(deployment, person)))
+        ParticipantService._save(changes)
+        return len(changes)
+
+    @staticmethod
+    def record_deliveries(deployment_id: str, outcomes: Dict[str, Tuple[str, datetime]]):
+        """Apply send outcomes, person id -> ('sent' | 'reminded' | 'failed', when), in one batch"""
+        deployment = backend.get('deployments', deployment_id)
+        if deployment is None:
+            return
+        changes = []
+        for person_id, (outcome, when) in outcomes.items():
+            participant = ParticipantService.get(deployment_id, person_id)
+            if participant is None:
+                person = backend.get('persons', person_id)
+                if person is None:
+                    continue
+                before, participant = None, ParticipantService._row(deployment, person)
+            else:
+                before = copy(participant)
+            if outcome == 'failed':
+                if participant.invite_status != InviteStatus.SENT:
+                    participant.invite_status = InviteStatus.FAILED
+            elif outcome == 'reminded':
+                participant.reminders_sent += 1
+                participant.last_reminded_at = when
+            else:
+                participant.invite_status = InviteStatus.SENT
+                participant.sent_at = participant.sent_at or when
+            participant.updated_at = when
+            changes.append((before, participant))
+        ParticipantService._save(changes)
+
+    @staticmethod
+    def record_progress(deployment_id: str, person_id: str, status: ParticipationStatus) -> Optional[Participant]:
+        """Move a participant forward to status; progress never goes back"""
+        participant = ParticipantService.get(deployment_id, person_id)
+        if participant is None:
+            deployment = backend.get('deployments', deployment_id)
+            person = backend.get('persons', person_id)
+            if deployment is None or person is None:
+                return None
+            before, participant = None, ParticipantService._row(deployment, person)
+        else:
+            before = copy(participant)
+            order = list(ParticipationStatus)
+            if order.index(status) <= order.index(participant.survey_status):
+                return participant
+        participant.survey_status = status
+        participant.updated_at = datetime.now()
+        if status == ParticipationStatus.COMPLETED:
+            participant.completed_at = participant.updated_at
+        ParticipantService._save([(before, participant)])
+        return participant
+
+    @staticmethod
+    def refresh_person(person: Person):
+        """Copy a person's new name and email onto their participant rows"""
+        changes = []
+        for participant in backend.find('participants', 'person_id', person.id):
+            if (participant.name, participant.email) != (person.name, person.email):
+                before = copy(participant)
+                participant.name, participant.email = person.name, person.email
+                changes.append((before, participant))
+        ParticipantService._save(changes)
+
+    @staticmethod
+    def matching(deployment_id: str, filters: Optional[Dict[str, Any]] = None, search: str = '',
+                 sent_before: Optional[datetime] = None, sort: str = 'sent_at', descending: bool = False,
+                 cursor: Optional[str] = None) -> Iterator[Participant]:
+        """Participants of a deployment passing every condition, in sort order from cursor.
+
+        filters are exact matches on status fields; search matches name or
+        email case-insensitively; sent_before keeps invites sent at or
+        before that time. Oldest-send-first walks stop at the cutoff, and
+        with a survey_status filter read only that status's sent invites.
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v not in (None, '')}
+        unknown = set(filters) - set(STATUS_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot filter participants by {', '.join(sorted(unknown))}")
+        if sort not in ORDER_FIELDS:
+            raise ValueError(f"Cannot sort participants by {sort}")
+        after = decode_cursor(cursor) if cursor else None
+        if not participant_index.loaded(deployment_id):
+            participant_index.load(deployment_id, backend.find('participants', 'deployment_id', deployment_id))
+        
+        cutoff = None
+        if sent_before is not None:
+            filters['invite_status'] = InviteStatus.SENT
+            cutoff = sent_before.isoformat(timespec='microseconds')
+        stops_at_cutoff = cutoff is not None and sort == 'sent_at' and not descending
+        if stops_at_cutoff and 'survey_status' in filters:
+            status = ParticipationStatus(index_key('survey_status', filters.pop('survey_status')))
+            candidates = participant_index.sent_before(deployment_id, status, cutoff, after)
+            filters.pop('invite_status')
+        else:
+            candidates = participant_index.walk(deployment_id, filters, sort, descending, after)
+            filters = {}
+        wanted = {field: index_key(field, value) for field, value in filters.items()}
+        needle = search.strip().lower()
+        
+        def matches():
+            for participant in candidates:
+                if cutoff is not None and sort_value(participant, 'sent_at') > cutoff:
+                    if stops_at_cutoff:
+                        return
+                    continue
+                if any(index_key(f, getattr(participant, f)) != v for f, v in wanted.items()):
+                    continue
+                if needle and needle not in participant.name.lower() and needle not in participant.email.lower():
+                    continue
+                yield participant
+        return matches()
+
+    @staticmethod
+    def status_counts(deployment_id: str) -> Dict[str, Dict[str, int]]:
+        """Participants of a deployment per value of each status field, read from the index buckets"""
+        if not participant_index.loaded(deployment_id):
+            participant_index.load(deployment_id, backend.find('participants', 'deployment_id', deployment_id))
+        return participant_index.counts(deployment_id)
+
+    @staticmethod
+    def page(deployment_id: str, filters: Optional[Dict[str, Any]] = None, search: str = '',
+             sent_before: Optional[datetime] = None, sort: str = 'sent_at', descending: bool = False,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        items = list(itertools.islice(ParticipantService.matching(
+            deployment_id, filters, search, sent_before, sort, descending, cursor), limit + 1))
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor((sort_value(items[-1], sort), items[-1].id))
+        return Page(items=items, next_cursor=next_cursor, limit=limit, sort=sort, descending=descending)
+
+    @staticmethod
+    def awaiting_reminder(deployment_id: str, days: float, now: Optional[datetime] = None,
+                          statuses: Iterable[ParticipationStatus] = (ParticipationStatus.NOT_STARTED,)
+                          ) -> Iterator[Participant]:
+        """Invited participants still in one of statuses (by default, not started) days after their invite"""
+        cutoff = (now or datetime.now()) - timedelta(days=days)
+        return itertools.chain.from_iterable(
+            ParticipantService.matching(deployment_id, {'survey_status': status}, sent_before=cutoff)
+            for status in statuses)
+
+class ReportService:
+    @staticmethod
+    def _analytics() -> ResponseAnalytics:
+        if response_analytics.stale:
+            response_analytics.load(backend.all('responses'),
+                                    {p.id: p for p in backend.all('persons')},
+                                    {q.id: q for q in backend.all('questions')},
+                                    {d.id: ResponseService.get_weights(d) for d in backend.all('deployments')})
+        return response_analytics
+    
+    @staticmethod
+    def dimensions() -> List[str]:
+        return ReportService._analytics().dimension_names()
+    
+    @staticmethod
+    def crosstab(question_id: str, by: Optional[List[str]] = None,
+                 filters: Optional[Dict[str, List[str]]] = None) -> ReportTable:
+        """Answer counts (and SCALE mean/stddev) for a question, grouped by dimensions"""
+        question = backend.get('questions', question_id)
+        if question is None:
+            raise ValueError('Question not found')
+        if question.type not in (QuestionType.SINGLE, QuestionType.SCALE):
+            raise ValueError('Cross-tabs are available for single-choice and scale questions')
+        return ReportService._analytics().crosstab(question, by or [], filters)
+
+class AuditLogService:
+    @staticmethod
+    def get_all() -> List[AuditLog]:
+        return audit_trail.all()
+    
+    @staticmethod
+    def page(filters: Optional[Dict] = None, sort: str = 'created_at', descending: bool = True,
+             cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+             start: Optional[datetime] = None, end: Optional[datetime] = None) -> Page:
+        return paginate(audit_trail.window(start, end), 'audit_logs', filters, sort, descending, cursor, limit)
+    
+    @staticmethod
+    def walk(filters: Optional[Dict] = None, descending: bool = False, start: Optional[datetime] = None,
+             end: Optional[datetime] = None) -> Iterator[AuditLog]:
+        """Every matching entry in the window in time order, read a page at a time for exports"""
+        return walk(audit_trail.window(start, end), 'audit_logs', filters, 'created_at', descending)
+    
+    @staticmethod
+    def get_by_entity(entity_type: str, entity_id: str) -> List[AuditLog]:
+        return audit_trail.get_by_entity(entity_type, entity_id)
+    
+    @staticmethod
+    def count(start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        return audit_trail.count(start, end)
+
+class DashboardService:
+    @staticmethod
+    def get_kpis() -> Dict[str, int]:
+        if dashboard_kpis.stale:
+            dashboard_kpis.load(backend)
+        return dashboard_kpis.counters()
+    
+    @staticmethod
+    def get_recent_deployments() -> List[Deployment]:
+        if dashboard_kpis.stale:
+            dashboard_kpis.load(backend)
+        deployments = (backend.get('deployments', did) for did in dashboard_kpis.recent_ids())
+        return [d for d in deployments if d]
+
+# Service classes, for instrumentation
+SERVICES = (CompanyService, PersonService, QuestionService, SurveyTemplateService, DeploymentService,
+            ResponseService, ParticipantService, ReportService, AuditLogService, DashboardService)
+
+def collection_sizes() -> Dict[str, int]:
+    """Records stored per collection, audit logs included"""
+    sizes = {collection: backend.count(collection) for collection in COLLECTIONS}
+    sizes['audit_logs'] = AuditLogService.count()
+    return sizes
@@ -0,0 +1,487 @@
+import heapq
+import itertools
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from email.message import EmailMessage
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from models import *
+from data_store import DeploymentService, ParticipantService, PersonService
+from email_templates import CompiledEmail, TemplateError, template_cache
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+@dataclass
+class OutgoingEmail:
+    deployment_id: str
+    company_id: str
+    person_id: str
+    to: str
+    subject: str
+    body: str
+    reminder: bool = False
+    attempt: int = 1
+    max_attempts: int = 1
+
+@dataclass
+class AudienceExpansion:
+    """A deployment's recipients, rendered and queued one batch at a time"""
+    deployment: Deployment
+    recipients: Iterator[Person]
+    compiled: CompiledEmail
+    reminder: bool
+
+class EmailTransport:
+    """Delivers one rendered email; raises on failure so the engine can retry"""
+
+    def send(self, message: OutgoingEmail):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemoryTransport(EmailTransport):
+    """Keeps sent messages in a list, for tests and local development"""
+
+    def __init__(self):
+        self.sent: List[OutgoingEmail] = []
+        self._lock = threading.Lock()
+
+    def send(self, message: OutgoingEmail):
+        with self._lock:
+            self.sent.append(message)
+
+class FileTransport(EmailTransport):
+    """Writes each message as an .eml file into an outbox directory"""
+
+    def __init__(self, directory: str, sender: str = 'noreply@myndwell.com'):
+        self.directory = directory
+        self.sender = sender
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, message: OutgoingEmail):
+        email = _mime_message(message, self.sender)
+        path = os.path.join(self.directory, f"{message.deployment_id}-{message.person_id}-{time.time_ns()}.eml")
+        with open(path, 'wb') as fh:
+            fh.write(email.as_bytes())
+
+class SMTPTransport(EmailTransport):
+    """Sends through an SMTP relay, keeping one connection per worker thread"""
+
+    def __init__(self, host: str, port: int = 587, username: Optional[str] = None,
+                 password: Optional[str] = None, use_tls: bool = True, sender: str = 'noreply@myndwell.com'):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender
+        self._local = threading.local()
+
+    def _connection(self) -> smtplib.SMTP:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.use_tls:
+                conn.starttls()
+            if self.username:
+                conn.login(self.username, self.password or '')
+            self._local.conn = conn
+        return conn
+
+    def send(self, message: OutgoingEmail):
+        try:
+            self._connection().send_message(_mime_message(message, self.sender))
+        except smtplib.SMTPException:
+            self.close()
+            raise
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                pass
+
+def _mime_message(message: OutgoingEmail, sender: str) -> EmailMessage:
+    email = EmailMessage()
+    email['From'] = sender
+    email['To'] = message.to
+    email['Subject'] = message.subject
+    email.set_content(message.body)
+    return email
+
+def transport_from_env(outbox_directory: str = 'outbox') -> EmailTransport:
+    """SMTP when SMTP_HOST is set, otherwise .eml files in outbox_directory"""
+    sender = os.environ.get('EMAIL_SENDER', 'noreply@myndwell.com')
+    if os.environ.get('SMTP_HOST'):
+        return SMTPTransport(
+            host=os.environ['SMTP_HOST'],
+            port=int(os.environ.get('SMTP_PORT', 587)),
+            username=os.environ.get('SMTP_USERNAME'),
+            password=os.environ.get('SMTP_PASSWORD'),
+            use_tls=os.environ.get('SMTP_USE_TLS', '1') != '0',
+            sender=sender
+        )
+    return FileTransport(outbox_directory, sender=sender)
+
+class RateLimiter:
+    """Token bucket per key (company id)"""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> float:
+        """Take a token; returns 0 on success or the seconds to wait before retrying"""
+        with self._lock:
+            now = self.clock()
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+def survey_link(deployment_id: str, person_id: str) -> str:
+    base_url = os.environ.get('SURVEY_BASE_URL', 'http://localhost:5000').rstrip('/')
+    return f"{base_url}/respond/{deployment_id}/{person_id}"
+
+def resolve_audience(deployment: Deployment) -> Iterator[Person]:
+    """Active recipients for a deployment according to its audience_type"""
+    if deployment.audience_type == 'csv':
+        for email in deployment.audience_data.get('emails', []):
+            person = PersonService.get_by_email(email)
+            if person and person.company_id == deployment.company_id:
+                yield person
+        return
+    segment = deployment.audience_data if deployment.audience_type == 'segment' else {}
+    for person in PersonService.get_by_company(deployment.company_id):
+        if person.status != UserStatus.ACTIVE:
+            continue
+        if all(person.metadata.get(key) == value for key, value in segment.items()):
+            yield person
+
+class DispatchEngine:
+    """Background email dispatcher for deployments.
+
+    Requests only enqueue a job; worker threads expand the audience,
+    render messages in batches from the deployment's cached compiled
+    template, and send them through the transport. Sends are
+    throttled per company by a token bucket: a message that finds the
+    bucket empty waits in its company's FIFO, and a single wake-up per
+    company sits on the heap at the bucket's next refill, so a deep
+    backlog costs nothing until tokens are available. The audience is
+    rendered lazily, the next batch only once the company's unsent
+    backlog is down to one batch. Failed sends are retried with
+    exponential backoff up to the deployment's max_attempts, and
+    deployment metrics and participant statuses are updated in small
+    batches.
+    """
+
+    def __init__(self, transport: EmailTransport, workers: int = 4, rate_per_company: float = 10.0,
+                 burst: int = 20, backoff_base: float = 2.0, backoff_max: float = 300.0,
+                 metrics_flush_size: int = 100, metrics_flush_interval: float = 1.0,
+                 render_batch_size: int = 500, clock: Callable[[], float] = time.monotonic):
+        self.transport = transport
+        self.workers = workers
+        self.limiter = RateLimiter(rate_per_company, burst, clock)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.metrics_flush_size = metrics_flush_size
+        self.metrics_flush_interval = metrics_flush_interval
+        self.render_batch_size = render_batch_size
+        self.clock = clock
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self._ready = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._in_flight = 0
+        # Messages waiting for a token, per company, and queued-but-unsent messages per company
+        self._throttled: Dict[str, Deque[OutgoingEmail]] = {}
+        self._backlog: Dict[str, int] = {}
+        self._pending_metrics: Dict[str, Dict[str, int]] = {}
+        self._pending_outcomes: Dict[str, Dict[str, Tuple[str, datetime]]] = {}
+        self._pending_count = 0
+        # (deployment id, person id) of invites queued and not yet recorded on the participant
+        self._inviting: Set[Tuple[str, str]] = set()
+        self._last_flush = clock()
+        self._metrics_lock = threading.Lock()
+
+    def start(self):
+        with self._ready:
+            if self._running:
+                return
+            self._running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'email-dispatch-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        with self._ready:
+            self._running = False
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self.transport.close()
+        self.flush_metrics(force=True)
+
+    def pending(self) -> int:
+        with self._ready:
+            return len(self._queue) + self._in_flight + sum(len(q) for q in self._throttled.values())
+
+    def wait_idle(self, timeout: float = 30.0) -> bool:
+        """Block until the queue drains (used by tests and shutdown)"""
+        deadline = time.monotonic() + timeout
+        while self.pending():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        self.flush_metrics(force=True)
+        return True
+
+    def _push(self, ready_at: float, job: Any):
+        with self._ready:
+            heapq.heappush(self._queue, (ready_at, next(self._sequence), job))
+            self._ready.notify()
+
+    def enqueue_deployment(self, deployment_id: str, person_ids: Optional[List[str]] = None,
+                           reminder: bool = False):
+        """Queue invites (or reminders) for a deployment's audience or the given people"""
+        self._push(self.clock(), ('expand', deployment_id, person_ids, reminder))
+
+    def _next_job(self) -> Any:
+        with self._ready:
+            if not self._running:
+                return _STOP
+            now = self.clock()
+            if self._queue and self._queue[0][0] <= now:
+                _, _, job = heapq.heappop(self._queue)
+                self._in_flight += 1
+                return job
+            timeout = self._queue[0][0] - now if self._queue else self.metrics_flush_interval
+            self._ready.wait(min(max(timeout, 0.001), self.metrics_flush_interval))
+            return None
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            if job is _STOP:
+                return
+            if job is not None:
+                try:
+                    kind = job[0]
+                    if kind == 'expand':
+                        self._expand(*job[1:])
+                    elif kind == 'render':
+                        self._render(job[1])
+                    elif kind == 'wake':
+                        self._wake(job[1])
+                    elif kind == 'deliver':
+                        self._deliver(job[1])
+                    else:
+                        self._send(job[1])
+                except Exception:
+                    logger.exception('Email dispatch job failed')
+                finally:
+                    with self._ready:
+                        self._in_flight -= 1
+            self.flush_metrics()
+
+    def _expand(self, deployment_id: str, person_ids: Optional[List[str]], reminder: bool):
+        deployment = DeploymentService.get_by_id(deployment_id)
+        if deployment is None or deployment.email_template is None:
+            logger.warning('Deployment %s has no email template; nothing sent', deployment_id)
+            return
+        if deployment.channel != 'email':
+            logger.warning('Deployment %s uses channel %s; only email is dispatched', deployment_id, deployment.channel)
+            return
+        if person_ids is None:
+            recipients = resolve_audience(deployment)
+        else:
+            recipients = (p for p in map(PersonService.get_by_id, person_ids) if p)
+        try:
+            compiled = template_cache.get(deployment)
+        except TemplateError as e:
+            logger.warning('Deployment %s email template is invalid: %s', deployment_id, e)
+            return
+        self._render(AudienceExpansion(deployment, recipients, compiled, reminder))
+
+    def _render(self, expansion: AudienceExpansion):
+        """Queue the next batch of an audience once the company's backlog has room for it"""
+        deployment = expansion.deployment
+        with self._ready:
+            backlog = self._backlog.get(deployment.company_id, 0)
+        if backlog > self.render_batch_size:
+            delay = (backlog - self.render_batch_size) / self.limiter.rate
+            self._push(self.clock() + delay, ('render', expansion))
+            return
+        batch = list(itertools.islice(expansion.recipients, self.render_batch_size))
+        if not batch:
+            return
+        if not expansion.reminder:
+            ParticipantService.enroll(deployment, batch)
+            # People already invited, or queued by a send still in progress, are not invited again
+            rows = [ParticipantService.get(deployment.id, p.id) for p in batch]
+            with self._ready:
+                batch = [p for p, row in zip(batch, rows) if (row is None or row.invite_status != InviteStatus.SENT)
+                         and (deployment.id, p.id) not in self._inviting]
+                self._inviting.update((deployment.id, p.id) for p in batch)
+            if not batch:
+                self._push(self.clock(), ('render', expansion))
+                return
+        rendered = expansion.compiled.render_batch(
+            {'name': p.name, 'survey_link': survey_link(deployment.id, p.id)} for p in batch
+        )
+        subject_prefix = 'Reminder: ' if expansion.reminder else ''
+        max_attempts = max(deployment.max_attempts, 1)
+        with self._ready:
+            self._backlog[deployment.company_id] = self._backlog.get(deployment.company_id, 0) + len(batch)
+        now = self.clock()
+        for p, (subject, body) in zip(batch, rendered):
+            self._push(now, ('send', OutgoingEmail(
+                deployment_id=deployment.id,
+                company_id=deployment.company_id,
+                person_id=p.id,
+                to=p.email,
+                subject=subject_prefix + subject,
+                body=body,
+                reminder=expansion.reminder,
+                max_attempts=max_attempts
+            )))
+        # Queued behind this batch's sends, which share its due time
+        self._push(now, ('render', expansion))
+
+    def _send(self, message: OutgoingEmail):
+        """Send now if the company has a token, otherwise wait in line behind its throttled messages"""
+        company_id = message.company_id
+        with self._ready:
+            throttled = self._throttled.get(company_id)
+            if throttled is None:
+                wait = self.limiter.acquire(company_id)
+                if wait:
+                    throttled = self._throttled[company_id] = deque()
+                    self._push(self.clock() + wait, ('wake', company_id))
+            if throttled is not None:
+                throttled.append(message)
+                return
+        self._deliver(message)
+
+    def _wake(self, company_id: str):
+        """Release as many of a company's throttled messages as it has tokens for"""
+        ready = []
+        with self._ready:
+            throttled = self._throttled.get(company_id)
+            while throttled:
+                wait = self.limiter.acquire(company_id)
+                if wait:
+                    self._push(self.clock() + wait, ('wake', company_id))
+                    break
+                ready.append(throttled.popleft())
+            else:
+                self._throttled.pop(company_id, None)
+        now = self.clock()
+        for message in ready:
+            self._push(now, ('deliver', message))
+
+    def _deliver(self, message: OutgoingEmail):
+        """Send a message that holds a token"""
+        try:
+            self.transport.send(message)
+        except Exception as e:
+            if message.attempt >= message.max_attempts:
+                logger.warning('Giving up on %s after %d attempts: %s', message.to, message.attempt, e)
+                self._settle(message)
+                self._record(message.deployment_id, 'invites_failed', message.person_id, 'failed')
+                return
+            delay = min(self.backoff_base * 2 ** (message.attempt - 1), self.backoff_max)
+            message.attempt += 1
+            self._push(self.clock() + delay * random.uniform(0.8, 1.2), ('send', message))
+            return
+        self._settle(message)
+        if message.reminder:
+            self._record(message.deployment_id, 'reminders_sent', message.person_id, 'reminded')
+        else:
+            self._record(message.deployment_id, 'invites_sent', message.person_id, 'sent')
+
+    def _settle(self, message: OutgoingEmail):
+        with self._ready:
+            remaining = self._backlog.get(message.company_id, 0) - 1
+            if remaining > 0:
+                self._backlog[message.company_id] = remaining
+            else:
+                self._backlog.pop(message.company_id, None)
+
+    def _record(self, deployment_id: str, metric: str, person_id: str, outcome: str):
+        with self._metrics_lock:
+            counts = self._pending_metrics.setdefault(deployment_id, {})
+            counts[metric] = counts.get(metric, 0) + 1
+            self._pending_outcomes.setdefault(deployment_id, {})[person_id] = (outcome, datetime.now())
+            self._pending_count += 1
+
+    def flush_metrics(self, force: bool = False):
+        """Apply accumulated metric increments and participant outcomes to their deployments"""
+        with self._metrics_lock:
+            due = self._pending_count >= self.metrics_flush_size or \
+                  self.clock() - self._last_flush >= self.metrics_flush_interval
+            if not self._pending_metrics or not (force or due):
+                return
+            pending, self._pending_metrics = self._pending_metrics, {}
+            outcomes, self._pending_outcomes = self._pending_outcomes, {}
+            self._pending_count = 0
+            self._last_flush = self.clock()
+        for deployment_id, deltas in pending.items():
+            DeploymentService.increment_metrics(deployment_id, deltas)
+        for deployment_id, person_outcomes in outcomes.items():
+            ParticipantService.record_deliveries(deployment_id, person_outcomes)
+            with self._ready:
+                self._inviting.difference_update((deployment_id, person_id) for person_id, (outcome, _)
+                                                 in person_outcomes.items() if outcome != 'reminded')
+
+_dispatcher: Optional[DispatchEngine] = None
+_dispatcher_lock = threading.Lock()
+_outbox_directory = 'outbox'
+
+def configure_dispatcher(outbox_directory: str):
+    """Where the engine created by get_dispatcher() writes .eml files without SMTP_HOST"""
+    global _outbox_directory
+    _outbox_directory = outbox_directory
+
+def get_dispatcher() -> DispatchEngine:
+    """The process-wide dispatch engine, created on first use; its workers run once start() is called"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = DispatchEngine(
+                transport_from_env(_outbox_directory),
+                workers=int(os.environ.get('EMAIL_WORKERS', 4)),
+                rate_per_company=float(os.environ.get('EMAIL_RATE_PER_COMPANY', 10))
+            )
+        return _dispatcher
+
+def set_dispatcher(engine: DispatchEngine) -> DispatchEngine:
+    """Replace the process-wide engine (e.g. with a MemoryTransport one in tests)"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher is not engine:
+            _dispatcher.stop()
+        _dispatcher = engine
+        engine.start()
+        return engine
@@ -0,0 +1,103 @@
+import hashlib
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from models import *
+from data_store import add_sync_listener, add_write_listener
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+# Placeholders a deployment email may use
+KNOWN_PLACEHOLDERS = ('name', 'survey_link')
+
+class TemplateError(ValueError):
+    """Raised when an email template uses placeholders we cannot fill"""
+
+def _to_format_string(text: str) -> Tuple[str, Tuple[str, ...]]:
+    """Turn '{{name}}' placeholders into a str.format pattern, escaping literal braces"""
+    parts, fields, position = [], [], 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        parts.append(text[position:match.start()].replace('{', '{{').replace('}', '}}'))
+        parts.append('{' + match.group(1) + '}')
+        fields.append(match.group(1))
+        position = match.end()
+    parts.append(text[position:].replace('{', '{{').replace('}', '}}'))
+    return ''.join(parts), tuple(fields)
+
+@dataclass(frozen=True)
+class CompiledEmail:
+    """Render plan for an EmailTemplate: one format pattern per part"""
+    subject: str
+    body: str
+    preview_text: str
+    fields: frozenset
+
+    def render(self, values: Dict[str, str]) -> Tuple[str, str]:
+        return self.subject.format_map(values), self.body.format_map(values)
+
+    def render_batch(self, recipients: Iterable[Dict[str, str]]) -> List[Tuple[str, str]]:
+        subject, body = self.subject.format_map, self.body.format_map
+        return [(subject(values), body(values)) for values in recipients]
+
+def template_hash(template: EmailTemplate) -> str:
+    content = '\0'.join((template.subject, template.body, template.preview_text or ''))
+    return hashlib.sha1(content.encode()).hexdigest()
+
+def compile_template(template: EmailTemplate) -> CompiledEmail:
+    """Parse a template once, rejecting unknown placeholders up front"""
+    subject, subject_fields = _to_format_string(template.subject)
+    body, body_fields = _to_format_string(template.body)
+    preview, preview_fields = _to_format_string(template.preview_text or '')
+    fields = frozenset(subject_fields + body_fields + preview_fields)
+    unknown = sorted(fields - set(KNOWN_PLACEHOLDERS))
+    if unknown:
+        raise TemplateError(
+            f"Unknown placeholder(s): {', '.join('{{' + f + '}}' for f in unknown)}. "
+            f"Available: {', '.join('{{' + f + '}}' for f in KNOWN_PLACEHOLDERS)}"
+        )
+    return CompiledEmail(subject=subject, body=body, preview_text=preview, fields=fields)
+
+class TemplateCache:
+    """Compiled email templates keyed by deployment id and template hash"""
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, CompiledEmail]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, deployment: Deployment) -> Optional[CompiledEmail]:
+        if deployment.email_template is None:
+            return None
+        digest = template_hash(deployment.email_template)
+        with self._lock:
+            entry = self._entries.get(deployment.id)
+            if entry and entry[0] == digest:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        compiled = compile_template(deployment.email_template)
+        with self._lock:
+            self._entries[deployment.id] = (digest, compiled)
+        return compiled
+
+    def invalidate(self, deployment_id: str):
+        with self._lock:
+            self._entries.pop(deployment_id, None)
+
+    def on_write(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: drop a deployment's plan when its template changes or it is deleted"""
+        if collection != 'deployments' or before is None:
+            return
+        if after is None or before.email_template != after.email_template:
+            self.invalidate(before.id)
+
+    def on_remote_write(self, collection: str, record_id: str):
+        """Sync listener: another worker changed or deleted a deployment"""
+        if collection == 'deployments':
+            self.invalidate(record_id)
+
+template_cache = TemplateCache()
+add_write_listener(template_cache.on_write)
+add_sync_listener(template_cache.on_remote_write)
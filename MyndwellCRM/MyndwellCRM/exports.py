@@ -0,0 +1,251 @@
+import csv
+import io
+import itertools
+import json
+import math
+import re
+import zipfile
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Tuple
+from xml.sax.saxutils import escape
+from flask import Response
+from models import *
+from importer import METADATA_FIELDS
+
+# Records formatted per chunk written to the client
+EXPORT_BATCH = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+# (header, value of a record) for each column of an export
+Columns = List[Tuple[str, Callable[[Any], Any]]]
+
+# Leading characters spreadsheet apps would evaluate as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Characters XML 1.0 does not allow, even escaped
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+def cell(value: Any) -> Any:
+    """A record value as a spreadsheet cell: numbers stay numbers, everything else becomes text.
+
+    NaN and infinities have no spreadsheet form and are left empty.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        # float() also turns numpy scalars into plain floats, whose repr is the number
+        return float(value) if math.isfinite(value) else ''
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(timespec='seconds') if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return '; '.join(str(cell(v)) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=str, sort_keys=True)
+    return str(value)
+
+def _batches(columns: Columns, records: Iterable[Any]) -> Iterator[List[List[Any]]]:
+    records = iter(records)
+    for batch in iter(lambda: list(itertools.islice(records, EXPORT_BATCH)), []):
+        yield [[cell(value(record)) for _, value in columns] for record in batch]
+
+def csv_chunks(columns: Columns, records: Iterable[Any]) -> Iterator[str]:
+    """CSV text, one chunk per batch of records; the BOM makes Excel read it as UTF-8"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([header for header, _ in columns])
+    yield buffer.getvalue()
+    for rows in _batches(columns, records):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([["'" + v if isinstance(v, str) and v.startswith(FORMULA_PREFIXES) else v for v in row]
+                          for row in rows])
+        yield buffer.getvalue()
+
+class _Sink:
+    """Write-only file ZipFile streams into, emptied after every batch.
+
+    Having no seek() or tell(), it makes ZipFile write each entry's sizes
+    and CRC in a trailing data descriptor instead of going back to patch
+    the local header, so the archive can be sent as it is produced.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _column_letter(index: int) -> str:
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_row(number: int, letters: List[str], values: List[Any]) -> str:
+    cells = []
+    for letter, value in zip(letters, values):
+        if isinstance(value, str):
+            if value:
+                text = escape(INVALID_XML.sub('', value))
+                cells.append(f'<c r="{letter}{number}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        elif isinstance(value, int) or math.isfinite(value):
+            cells.append(f'<c r="{letter}{number}"><v>{value!r}</v></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+def _xlsx_parts(sheet: str) -> Dict[str, str]:
+    name = escape(re.sub(r'[\[\]:*?/\\]', ' ', sheet)[:31] or 'Sheet1', {'"': '&quot;'})
+    return {
+        '[Content_Types].xml':
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '</Types>',
+        '_rels/.rels':
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="xl/workbook.xml" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>',
+        'xl/workbook.xml':
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>',
+        'xl/_rels/workbook.xml.rels':
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="worksheets/sheet1.xml" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/worksheet"/>'
+            '</Relationships>'
+    }
+
+def xlsx_chunks(columns: Columns, records: Iterable[Any], sheet: str = 'Sheet1') -> Iterator[bytes]:
+    """A one-sheet .xlsx workbook, compressed and sent a batch of records at a time.
+
+    Cells are inline strings and numbers, so no shared string table has
+    to be held until the end; importer.iter_xlsx_rows reads them back.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for part, content in _xlsx_parts(sheet).items():
+            archive.writestr(part, content)
+        letters = [_column_letter(i) for i in range(len(columns))]
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as fh:
+            fh.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                      '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                      '<sheetData>' + _xlsx_row(1, letters, [header for header, _ in columns])).encode())
+            yield sink.drain()
+            number = 1
+            for rows in _batches(columns, records):
+                fh.write(''.join(_xlsx_row(number + i, letters, row) for i, row in enumerate(rows, 1)).encode())
+                number += len(rows)
+                yield sink.drain()
+            fh.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+def export_response(name: str, fmt: str, columns: Columns, records: Iterable[Any], sheet: str = 'Sheet1') -> Response:
+    """Stream records as a .csv or .xlsx download; the body is produced as the client reads it"""
+    if fmt == 'xlsx':
+        chunks = xlsx_chunks(columns, records, sheet)
+    else:
+        chunks = csv_chunks(columns, records)
+    response = Response(chunks, mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    # Keep proxies such as nginx from holding the stream back until it ends
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Column sets
+
+def person_columns(company_names: Mapping[str, str]) -> Columns:
+    """Person fields, headed so the file can be re-imported through the bulk importer"""
+    return [
+        ('ID', lambda p: p.id),
+        ('Full Name', lambda p: p.name),
+        ('Email', lambda p: p.email),
+        ('Company ID', lambda p: p.company_id),
+        ('Company', lambda p: company_names.get(p.company_id, '')),
+        ('Status', lambda p: p.status),
+        ('Roles', lambda p: p.roles)
+    ] + [(key.replace('_', ' ').title(), lambda p, key=key: (p.metadata or {}).get(key))
+         for key in METADATA_FIELDS] + [
+        ('Created At', lambda p: p.created_at)
+    ]
+
+def participant_columns(now: datetime) -> Columns:
+    return [
+        ('Name', lambda p: p.name),
+        ('Email', lambda p: p.email),
+        ('Person ID', lambda p: p.person_id),
+        ('Invite Status', lambda p: p.invite_status),
+        ('Survey Status', lambda p: p.survey_status),
+        ('Report Status', lambda p: p.report_status),
+        ('Sent At', lambda p: p.sent_at),
+        ('Days Since Invite', lambda p: (now - p.sent_at).days if p.sent_at else None),
+        ('Reminders Sent', lambda p: p.reminders_sent),
+        ('Last Reminded At', lambda p: p.last_reminded_at),
+        ('Completed At', lambda p: p.completed_at)
+    ]
+
+# Rows of result_rows(): one per answer choice, or one per free-text question
+RESULT_COLUMNS: Columns = [
+    ('Question Code', lambda r: r[0]['code']),
+    ('Question', lambda r: r[0]['text']),
+    ('Type', lambda r: r[0]['type']),
+    ('Answered', lambda r: r[0]['answered']),
+    ('Choice Code', lambda r: r[1]['code'] if r[1] else None),
+    ('Choice', lambda r: r[1]['label'] if r[1] else None),
+    ('Count', lambda r: r[1]['count'] if r[1] else None),
+    ('Share %', lambda r: round(100 * r[1]['count'] / r[0]['answered'], 1) if r[1] and r[0]['answered'] else None),
+    ('Mean', lambda r: r[0].get('mean')),
+    ('Std Dev', lambda r: r[0].get('stddev'))
+]
+
+def result_rows(results: Dict[str, Any]) -> Iterator[Tuple[Dict[str, Any], Any]]:
+    """(question, choice) pairs of DeploymentResults.to_dict(), choice None for free text"""
+    for question in results['questions']:
+        if question.get('counts'):
+            for choice in question['counts']:
+                yield question, choice
+        else:
+            yield question, None
+
+AUDIT_COLUMNS: Columns = [
+    ('Timestamp', lambda a: a.timestamp),
+    ('Actor', lambda a: a.actor),
+    ('Action', lambda a: a.action),
+    ('Entity Type', lambda a: a.entity_type),
+    ('Entity ID', lambda a: a.entity_id),
+    ('IP Address', lambda a: a.ip_address),
+    ('User Agent', lambda a: a.user_agent),
+    ('Changes', lambda a: a.diff)
+]
@@ -0,0 +1,299 @@
+import csv
+import io
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+from models import *
+from data_store import CompanyService, PersonService
+
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELS_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOC_RELS_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+# Largest shared-string table read from an .xlsx; the table is held in memory while rows stream
+MAX_SHARED_STRINGS = 1000000
+MAX_SHARED_STRING_CHARS = 64 * 1024 * 1024
+
+# Normalized header -> Person attribute or metadata key
+COLUMN_ALIASES = {
+    'fullname': 'name',
+    'name': 'name',
+    'email': 'email',
+    'emailaddress': 'email',
+    'companyid': 'company_id',
+    'yearofbirth': 'year_of_birth',
+    'mobile': 'mobile',
+    'altemail': 'alt_email',
+    'alternateemail': 'alt_email',
+    'designation': 'designation',
+    'department': 'department',
+    'location': 'location',
+    'maritalstatus': 'marital_status',
+    'currentrole': 'current_role',
+    'yearofjoining': 'year_of_joining',
+    'workmode': 'work_mode',
+    'shift': 'shift'
+}
+
+METADATA_FIELDS = ('year_of_birth', 'mobile', 'alt_email', 'designation', 'department', 'location',
+                   'marital_status', 'current_role', 'year_of_joining', 'work_mode', 'shift')
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@([^@\s]+\.[^@\s]+)$')
+
+class ImportFormatError(ValueError):
+    """Raised when an uploaded file cannot be read as a user sheet"""
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    created: int = 0
+    error_count: int = 0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def errors_truncated(self) -> bool:
+        return self.error_count > len(self.errors)
+
+def _column_index(ref: str) -> int:
+    index = 0
+    for char in ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - 64)
+    return index - 1
+
+def _read_shared_strings(archive: zipfile.ZipFile) -> List[str]:
+    if 'xl/sharedStrings.xml' not in archive.namelist():
+        return []
+    strings = []
+    chars = 0
+    with archive.open('xl/sharedStrings.xml') as fh:
+        table = None
+        for event, elem in ET.iterparse(fh, events=('start', 'end')):
+            if event == 'start':
+                if elem.tag == SHEET_NS + 'sst':
+                    table = elem
+                continue
+            if elem.tag != SHEET_NS + 'si':
+                continue
+            text = ''.join(t.text or '' for t in elem.iter(SHEET_NS + 't'))
+            chars += len(text)
+            if len(strings) >= MAX_SHARED_STRINGS or chars > MAX_SHARED_STRING_CHARS:
+                raise ImportFormatError('Workbook has too much text to import at once; '
+                                        'split it into smaller files or save it as .csv')
+            strings.append(text)
+            if table is not None:
+                table.remove(elem)
+    return strings
+
+def _sheet_number(name: str) -> Tuple[int, str]:
+    digits = re.sub(r'\D', '', posixpath.basename(name))
+    return (int(digits) if digits else 0, name)
+
+def _first_sheet(archive: zipfile.ZipFile) -> str:
+    """Part name of the workbook's first sheet, as listed in xl/workbook.xml"""
+    names = set(archive.namelist())
+    try:
+        with archive.open('xl/workbook.xml') as fh:
+            sheet = ET.parse(fh).getroot().find(f'{SHEET_NS}sheets/{SHEET_NS}sheet')
+        with archive.open('xl/_rels/workbook.xml.rels') as fh:
+            targets = {rel.get('Id'): rel.get('Target', '')
+                       for rel in ET.parse(fh).getroot().iter(RELS_NS + 'Relationship')}
+    except (KeyError, ET.ParseError):
+        sheet = None
+    if sheet is not None:
+        target = targets.get(sheet.get(DOC_RELS_NS + 'id'), '')
+        # Targets are relative to xl/ unless they start at the package root
+        part = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+        if part in names:
+            return part
+    # No usable workbook part: fall back to the lowest-numbered worksheet
+    sheets = sorted((n for n in names if n.startswith('xl/worksheets/') and n.endswith('.xml')), key=_sheet_number)
+    if not sheets:
+        raise ImportFormatError('Workbook has no worksheets')
+    return sheets[0]
+
+def iter_xlsx_rows(stream: BinaryIO) -> Iterator[List[Optional[str]]]:
+    """Yield the first sheet's rows one at a time without loading the whole sheet.
+
+    Rows stream in bounded memory, but the shared-string table they
+    refer to is read up front and held; workbooks whose table exceeds
+    MAX_SHARED_STRINGS or MAX_SHARED_STRING_CHARS are rejected.
+    """
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        raise ImportFormatError('File is not a valid .xlsx workbook')
+    with archive:
+        shared = _read_shared_strings(archive)
+        with archive.open(_first_sheet(archive)) as fh:
+            sheet_data = None
+            for event, elem in ET.iterparse(fh, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == SHEET_NS + 'sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != SHEET_NS + 'row':
+                    continue
+                row: List[Optional[str]] = []
+                for cell in elem.iter(SHEET_NS + 'c'):
+                    position = _column_index(cell.get('r', '')) if cell.get('r') else len(row)
+                    cell_type = cell.get('t')
+                    value_elem = cell.find(SHEET_NS + 'v')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(SHEET_NS + 't'))
+                    elif value_elem is None:
+                        value = None
+                    elif cell_type == 's':
+                        value = shared[int(value_elem.text)]
+                    else:
+                        value = value_elem.text
+                    row.extend([None] * (position - len(row)))
+                    row.append(value)
+                yield row
+                elem.clear()
+                if sheet_data is not None:
+                    sheet_data.remove(elem)
+
+def iter_csv_rows(stream: BinaryIO) -> Iterator[List[str]]:
+    """Yield CSV rows one at a time; undecodable or malformed text raises ImportFormatError"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    try:
+        yield from reader
+    except UnicodeDecodeError:
+        raise ImportFormatError('File is not UTF-8 text; please save it as UTF-8 CSV')
+    except csv.Error as e:
+        raise ImportFormatError(f'Line {reader.line_num} is not valid CSV ({e}); please save the file as UTF-8 CSV')
+    finally:
+        text.detach()
+
+def iter_rows(stream: BinaryIO, filename: str) -> Iterator[List[Optional[str]]]:
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension == 'csv':
+        return iter_csv_rows(stream)
+    if extension == 'xlsx':
+        return iter_xlsx_rows(stream)
+    if extension == 'xls':
+        raise ImportFormatError('Legacy .xls files are not supported, please save as .xlsx or .csv')
+    raise ImportFormatError('Unsupported file type, please upload a .csv or .xlsx file')
+
+def _normalize_header(header: Optional[str]) -> Optional[str]:
+    key = re.sub(r'[^a-z]', '', (header or '').lower())
+    return COLUMN_ALIASES.get(key)
+
+def registrant_values(record: Dict[str, Any]) -> Dict[str, str]:
+    """Non-empty fields of a registrant keyed by Person attribute or metadata key.
+
+    Keys are matched like sheet headers, so 'Full Name', 'fullName' and
+    'name' all mean the same.
+    """
+    values = {}
+    for key, value in record.items():
+        column = _normalize_header(key)
+        if column and value not in (None, ''):
+            values[column] = str(value).strip()
+    return values
+
+def register_persons(records: Iterable[Tuple[int, Dict[str, str]]], company_id: Optional[str] = None,
+                     batch_size: int = 500, max_errors: int = 1000) -> ImportResult:
+    """Validate (row number, registrant values) pairs and create the valid ones in batches.
+
+    Emails must belong to one of the company's domains: company_id's,
+    else the row's own company_id's, else any company's, which then
+    decides the company; a row naming a company other than company_id
+    is rejected. Emails repeated within the input or already
+    registered are rejected. Only the pending batch is held in memory;
+    rows already flushed are deduplicated through the email index.
+    """
+    if company_id and CompanyService.domains(company_id) is None:
+        raise ImportFormatError('Company not found')
+    result = ImportResult()
+
+    def reject(row_number: int, email: str, error: str):
+        result.error_count += 1
+        if len(result.errors) < max_errors:
+            result.errors.append({'row': row_number, 'email': email, 'error': error})
+
+    batch: List[Person] = []
+    pending_emails = set()
+    for row_number, values in records:
+        if not values:
+            continue
+        result.rows += 1
+
+        email = values.get('email', '').lower()
+        name = values.get('name', '')
+        match = EMAIL_PATTERN.match(email)
+        if not name:
+            reject(row_number, email, 'Full name is required')
+            continue
+        if not match:
+            reject(row_number, email, 'Invalid email address')
+            continue
+        domain = match.group(1)
+        owner = company_id or values.get('company_id')
+        if company_id and values.get('company_id') not in (None, company_id):
+            reject(row_number, email, 'Company does not match the selected company')
+            continue
+        if owner:
+            allowed = CompanyService.domains(owner)
+            if allowed is None:
+                reject(row_number, email, 'Company not found')
+                continue
+            if domain not in allowed:
+                owner = None
+        else:
+            owner = CompanyService.domain_owners().get(domain)
+        if owner is None:
+            reject(row_number, email, 'Email domain does not belong to the company')
+            continue
+        if email in pending_emails or PersonService.get_by_email(email):
+            reject(row_number, email, 'Email is already registered')
+            continue
+
+        batch.append(Person(
+            id='',
+            company_id=owner,
+            email=email,
+            name=name,
+            roles=['user'],
+            status=UserStatus.ACTIVE,
+            metadata={key: values.get(key) for key in METADATA_FIELDS}
+        ))
+        pending_emails.add(email)
+        if len(batch) >= batch_size:
+            PersonService.create_many(batch)
+            result.created += len(batch)
+            batch = []
+            pending_emails.clear()
+
+    if batch:
+        PersonService.create_many(batch)
+        result.created += len(batch)
+    return result
+
+def import_persons(stream: BinaryIO, filename: str, company_id: Optional[str] = None,
+                   batch_size: int = 500, max_errors: int = 1000) -> ImportResult:
+    """Stream users from a CSV/XLSX upload into PersonService in batches (see register_persons)"""
+    if company_id and not CompanyService.get_by_id(company_id):
+        raise ImportFormatError('Company not found')
+    rows = iter_rows(stream, filename)
+
+    header = next(rows, None)
+    columns = [_normalize_header(h) for h in header or []]
+    if 'email' not in columns or 'name' not in columns:
+        raise ImportFormatError('Header row must include Full Name and Email columns')
+
+    def records() -> Iterator[Tuple[int, Dict[str, str]]]:
+        for row_number, row in enumerate(rows, start=2):
+            values = {}
+            for column, value in zip(columns, row):
+                if column and value not in (None, ''):
+                    values[column] = str(value).strip()
+            yield row_number, values
+
+    return register_persons(records(), company_id, batch_size, max_errors)
@@ -0,0 +1,243 @@
+import inspect
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from flask import Flask, before_render_template, g, request, template_rendered
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """Cumulative latency histogram per label set, in the Prometheus data model"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, labels: Tuple[str, ...], seconds: float):
+        bucket = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(BUCKETS) + 1), 0.0]
+            series[0][bucket] += 1
+            series[1] += seconds
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for labels, counts, total in series:
+            base = ','.join(f'{name}="{_label(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{base},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+def _fold(frame) -> str:
+    """A thread's stack as one line of folded frames, outermost first"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving requests and keeps those of slow requests.
+
+    While a request runs, a sampler thread records its thread's stack
+    every interval seconds. When the request took at least threshold
+    seconds, its samples are written to directory as folded stacks
+    ("frame;frame;frame count" per line), the input format of
+    flamegraph.pl, speedscope and similar tools. Faster requests'
+    samples are dropped.
+    """
+
+    def __init__(self, threshold: float, directory: str, interval: float = 0.005):
+        self.threshold = threshold
+        self.directory = directory
+        self.interval = interval
+        self.dumps = 0
+        self._lock = threading.Lock()
+        # Signalled when a request starts, so the sampler sleeps while none is in flight
+        self._busy = threading.Condition(self._lock)
+        self._active: Dict[int, Counter] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            self._busy.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def end(self, label: str, seconds: float) -> Optional[str]:
+        """Stop sampling this thread's request; returns the dump's path if it was slow enough"""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or seconds < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%dT%H%M%S.%f')}-{re.sub(r'[^A-Za-z0-9_.-]', '_', label)}" \
+               f'-{int(seconds * 1000)}ms.folded'
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fh:
+            for stack, count in samples.most_common():
+                fh.write(f'{stack} {count}\n')
+        with self._lock:
+            self.dumps += 1
+        return path
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._busy.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != me:
+                        samples[_fold(frame)] += 1
+
+class Instrumentation:
+    """Request, service and template timings, exported at /metrics.
+
+    Nothing is hooked in until init_app() and instrument() run with the
+    feature enabled, so a disabled process pays no per-call cost at all:
+    routes, services and templates run unwrapped. The profiler is a
+    separate opt-in, since sampling stacks costs CPU on every request.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profiler: Optional[SamplingProfiler] = None
+        self.requests = Histogram('myndwell_http_request_duration_seconds',
+                                  'Time to produce a response (streamed bodies excluded)',
+                                  ('endpoint', 'method', 'status'))
+        self.services = Histogram('myndwell_service_call_duration_seconds',
+                                  'Time spent in service methods, including nested service calls',
+                                  ('method',))
+        self.templates = Histogram('myndwell_template_render_duration_seconds',
+                                   'Time to render a page template', ('template',))
+        self._rendering = threading.local()
+
+    def init_app(self, app: Flask, enabled: bool = True, profile_threshold: Optional[float] = None,
+                 profile_directory: str = 'profiles', profile_interval: float = 0.005):
+        """Time every request and rendered template; profile requests slower than profile_threshold seconds"""
+        self.enabled = enabled
+        if not enabled:
+            return
+        if profile_threshold is not None:
+            self.profiler = SamplingProfiler(profile_threshold, profile_directory, profile_interval)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+
+    def instrument(self, classes: Iterable[type]):
+        """Wrap the static methods of service classes in timers"""
+        if not self.enabled:
+            return
+        for cls in classes:
+            for name, attribute in list(vars(cls).items()):
+                # A generator's time is spent by its consumer, not in the call
+                if isinstance(attribute, staticmethod) and not inspect.isgeneratorfunction(attribute.__func__):
+                    setattr(cls, name, staticmethod(self._timed(f'{cls.__name__}.{name}', attribute.__func__)))
+
+    def _timed(self, label: str, function: Callable) -> Callable:
+        observe, labels = self.services.observe, (label,)
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(labels, time.perf_counter() - started)
+        return timed
+
+    # Request hooks
+
+    def _start_request(self):
+        g._instrument_started = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.begin()
+
+    def _record(self, status: int):
+        started = g.pop('_instrument_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        self.requests.observe((endpoint, request.method, str(status)), elapsed)
+        if self.profiler is not None:
+            path = self.profiler.end(endpoint, elapsed)
+            if path:
+                logger.warning('Slow request %s %s took %.0fms, stacks in %s',
+                               request.method, request.path, elapsed * 1000, path)
+
+    def _finish_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # Requests that raised never reach after_request
+        self._record(500)
+
+    def _start_render(self, sender, template, context, **extra):
+        stack = getattr(self._rendering, 'stack', None)
+        if stack is None:
+            stack = self._rendering.stack = []
+        stack.append(time.perf_counter())
+
+    def _finish_render(self, sender, template, context, **extra):
+        stack = getattr(self._rendering, 'stack', None)
+        if stack:
+            self.templates.observe((template.name or 'string',), time.perf_counter() - stack.pop())
+
+    def render(self, sizes: Dict[str, int]) -> str:
+        """Prometheus text exposition of every timing plus record counts per collection"""
+        lines = ['# HELP myndwell_instrumentation_enabled Whether timings are being recorded',
+                 '# TYPE myndwell_instrumentation_enabled gauge',
+                 f'myndwell_instrumentation_enabled {int(self.enabled)}',
+                 '# HELP myndwell_collection_records Records stored per collection',
+                 '# TYPE myndwell_collection_records gauge']
+        lines.extend(f'myndwell_collection_records{{collection="{_label(name)}"}} {count}'
+                     for name, count in sorted(sizes.items()))
+        if self.profiler is not None:
+            lines.extend(['# HELP myndwell_slow_request_profiles_total Stack dumps written for slow requests',
+                          '# TYPE myndwell_slow_request_profiles_total counter',
+                          f'myndwell_slow_request_profiles_total {self.profiler.dumps}'])
+        for histogram in (self.requests, self.services, self.templates):
+            lines.extend(histogram.render())
+        return '\n'.join(lines) + '\n'
+
+# Process-wide timings; app.py enables them when INSTRUMENTATION=1
+instrumentation = Instrumentation()
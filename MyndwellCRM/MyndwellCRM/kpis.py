@@ -0,0 +1,69 @@
+import heapq
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from models import *
+
+# KPI name -> (collection, indexed field, value); a field of None counts every record
+KPI_DEFINITIONS: Dict[str, Tuple[str, Optional[str], Any]] = {
+    'total_companies': ('companies', None, None),
+    'total_users': ('persons', None, None),
+    'active_surveys': ('survey_templates', 'status', SurveyStatus.READY),
+    'active_deployments': ('deployments', 'status', DeploymentStatus.ACTIVE)
+}
+
+def _matches(record: Optional[Any], field: Optional[str], value: Any) -> int:
+    if record is None:
+        return 0
+    return 1 if field is None or getattr(record, field) == value else 0
+
+class KPIAggregates:
+    """Dashboard counters and recent deployments, maintained from service writes.
+
+    Counters are loaded once from the backend's indexed counts and then
+    adjusted by the delta each write makes. The most recent
+    deployments are kept in a bounded min-heap of (created_at, id).
+    """
+
+    def __init__(self, recent_size: int = 5):
+        self.recent_size = recent_size
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._recent: List[Tuple[Any, str]] = []
+        self.stale = True
+
+    def invalidate(self):
+        self.stale = True
+
+    def load(self, backend):
+        counters = {name: backend.count(collection, field, value)
+                    for name, (collection, field, value) in KPI_DEFINITIONS.items()}
+        recent = heapq.nlargest(self.recent_size,
+                                ((d.created_at, d.id) for d in backend.all('deployments')))
+        heapq.heapify(recent)
+        with self._lock:
+            self._counters = counters
+            self._recent = recent
+            self.stale = False
+
+    def apply(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: adjust counters for a create, update or delete"""
+        if self.stale:
+            return
+        with self._lock:
+            for name, (kpi_collection, field, value) in KPI_DEFINITIONS.items():
+                if kpi_collection == collection:
+                    self._counters[name] += _matches(after, field, value) - _matches(before, field, value)
+            if collection == 'deployments' and before is None and after is not None:
+                entry = (after.created_at, after.id)
+                if len(self._recent) < self.recent_size:
+                    heapq.heappush(self._recent, entry)
+                elif entry > self._recent[0]:
+                    heapq.heapreplace(self._recent, entry)
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def recent_ids(self) -> List[str]:
+        with self._lock:
+            return [deployment_id for _, deployment_id in sorted(self._recent, reverse=True)]
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """One subscriber's mailbox of changes per topic.
+
+    Changes delivered while the reader is busy are merged, so a slow
+    reader skips intermediate values rather than queueing them.
+    """
+    __slots__ = ('topics', '_lock', '_ready', '_pending', '_sequence')
+
+    def __init__(self, topics: Iterable[str]):
+        self.topics = frozenset(topics)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._sequence = 0
+
+    def deliver(self, sequence: int, topic: str, changes: Dict[str, Any]):
+        with self._lock:
+            self._pending.setdefault(topic, {}).update(changes)
+            self._sequence = sequence
+            self._ready.set()
+
+    def wait(self, timeout: float) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+        """(tick sequence, changes per topic) once any arrive, or (sequence, {}) after timeout"""
+        self._ready.wait(timeout)
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._ready.clear()
+            return self._sequence, pending
+
+class MetricsBus:
+    """Coalescing publish/subscribe hub for live counters.
+
+    Publishers hand over the current values of a topic (a deployment id)
+    as often as they change. The bus keeps only the keys that differ from
+    what it last sent and, once per tick, delivers that delta to every
+    subscriber of the topic. Delivery is a dict merge into the
+    subscriber's mailbox, so fan-out costs no thread per subscriber: one
+    ticker thread, started with the first subscription, does it all.
+    poll, if given, runs at the start of each tick while anyone is
+    subscribed, to pick up writes made by other processes.
+    """
+
+    def __init__(self, interval: float = 1.0, poll: Optional[Callable[[], None]] = None):
+        self.interval = interval
+        self.poll = poll
+        self.sequence = 0
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._sent: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, Dict[str, Any]] = {}
+        self._ticker: Optional[threading.Thread] = None
+
+    def subscribed(self, topic: str) -> bool:
+        with self._lock:
+            return bool(self._subscribers.get(topic))
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        subscription = Subscription(topics)
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers[topic].add(subscription)
+            if self._ticker is None:
+                self._ticker = threading.Thread(target=self._run, name='metrics-bus', daemon=True)
+                self._ticker.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+                    self._sent.pop(topic, None)
+                    self._changed.pop(topic, None)
+
+    def publish(self, topic: str, values: Dict[str, Any]):
+        """Record the latest values of topic; ignored while nobody is subscribed to it"""
+        with self._lock:
+            if topic not in self._subscribers:
+                return
+            sent, pending = self._sent.get(topic, {}), self._changed.get(topic, {})
+            changed = {key: value for key, value in values.items() if key in pending or sent.get(key, self) != value}
+            if changed:
+                self._changed.setdefault(topic, {}).update(changed)
+
+    def tick(self):
+        """Deliver everything published since the previous tick"""
+        if self.poll is not None:
+            with self._lock:
+                active = bool(self._subscribers)
+            if active:
+                self.poll()
+        with self._lock:
+            if not self._changed:
+                return
+            changed, self._changed = self._changed, {}
+            self.sequence += 1
+            for topic, changes in changed.items():
+                self._sent.setdefault(topic, {}).update(changes)
+                for subscription in self._subscribers.get(topic, ()):
+                    subscription.deliver(self.sequence, topic, changes)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception:
+                # A failed poll must not end live updates for everyone
+                logger.exception('Metrics bus tick failed')
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'sequence': self.sequence, 'topics': len(self._subscribers),
+                    'subscriptions': len({s for subs in self._subscribers.values() for s in subs})}
@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass, field
 from enum import Enum
+from compact import CompactMetadata, intern, intern_list, normalize_fields
 
 class UserStatus(Enum):
     ACTIVE = "active"
@@ -20,6 +21,20 @@ class DeploymentStatus(Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+class InviteStatus(Enum):
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+class ParticipationStatus(Enum):
+    NOT_STARTED = "not_started"
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+
+class ReportStatus(Enum):
+    PENDING = "pending"
+    GENERATED = "generated"
+
 class QuestionType(Enum):
     SINGLE = "single"
     MULTI = "multi"
@@ -35,7 +50,11 @@ class Company:
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
 
-@dataclass
+# Person, SurveyQuestion and AuditLog exist in large numbers, so they use
+# slots, and repeated strings (ids of parents, roles, metadata keys and
+# values) are interned on assignment.
+@normalize_fields(company_id=intern, roles=intern_list, metadata=CompactMetadata.of)
+@dataclass(slots=True)
 class Person:
     id: str
     company_id: str
@@ -71,7 +90,8 @@ class Question:
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
 
-@dataclass
+@normalize_fields(survey_template_id=intern, question_id=intern, section=intern)
+@dataclass(slots=True)
 class SurveyQuestion:
     id: str
     survey_template_id: str
@@ -119,6 +139,38 @@ class Deployment:
     updated_at: datetime = field(default_factory=datetime.now)
 
 @dataclass
+class SurveyResponse:
+    id: str
+    deployment_id: str
+    person_id: str
+    answers: Dict[str, Any] = field(default_factory=dict)  # question_id -> choice code, list of codes, or text
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+
+# One row per person invited to a deployment; name and email are copied
+# from the person so the tracker can search and sort without joining
+@normalize_fields(deployment_id=intern, company_id=intern)
+@dataclass(slots=True)
+class Participant:
+    id: str
+    deployment_id: str
+    company_id: str
+    person_id: str
+    name: str
+    email: str
+    invite_status: InviteStatus = InviteStatus.PENDING
+    survey_status: ParticipationStatus = ParticipationStatus.NOT_STARTED
+    report_status: ReportStatus = ReportStatus.PENDING
+    sent_at: Optional[datetime] = None
+    reminders_sent: int = 0
+    last_reminded_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    updated_at: datetime = field(default_factory=datetime.now)
+
+@normalize_fields(actor=intern, action=intern, entity_type=intern, entity_id=intern,
+                  ip_address=intern, user_agent=intern)
+@dataclass(slots=True)
 class AuditLog:
     id: str
     actor: str
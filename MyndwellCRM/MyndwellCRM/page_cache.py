@@ -0,0 +1,86 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+from typing import Callable, Hashable, Optional, Sequence
+from flask import Response, make_response, request, session
+from markupsafe import Markup
+from data_store import read_cache
+
+# Generations restart with every process, so tags from other workers never match
+PROCESS_TAG = uuid.uuid4().hex[:12]
+
+def page_etag(collections: Sequence[str]) -> str:
+    """Entity tag for the current request over the generations of collections"""
+    key = repr((PROCESS_TAG, request.endpoint, sorted(request.args.items(multi=True)),
+                read_cache.generations(collections)))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def last_modified(collections: Sequence[str]) -> Optional[datetime]:
+    """Last-Modified for collections, or None while a change is under a second old.
+
+    HTTP dates carry whole seconds, so a date is only handed out once a
+    later write is sure to land in a later second than the one it names.
+    """
+    modified = read_cache.modified(collections)
+    if datetime.now(timezone.utc) - modified < timedelta(seconds=1):
+        return None
+    return modified.replace(microsecond=0)
+
+def not_modified(etag: str, modified: Optional[datetime]) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    return modified is not None and since is not None and modified <= since
+
+def conditional(*collections: str) -> Callable:
+    """Answer GETs of a page with 304 Not Modified until one of collections changes.
+
+    The view only runs when the client's copy is stale. Pages with flashed
+    messages waiting are always rendered and never tagged, since they show
+    something the data versions do not cover.
+    """
+    def decorate(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+            etag = page_etag(collections)
+            modified = last_modified(collections)
+            if not_modified(etag, modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified is not None:
+                response.last_modified = modified
+            # Cacheable, but always revalidated
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorate
+
+def revalidated(tag: str, render: Callable[[], Response]) -> Response:
+    """render() tagged with an ETag for this process's version tag, or 304 if the client has it"""
+    etag = hashlib.sha1(f'{PROCESS_TAG}:{request.path}:{tag}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def fragment(name: str, collections: Sequence[str], key: Hashable = None, caller: Callable = None) -> Markup:
+    """Jinja call block whose rendered body is reused until one of collections changes.
+
+        {% call fragment('company_cards', ['companies', 'persons'], key=request.full_path) %}
+            ...
+        {% endcall %}
+
+    key separates renderings of the same block that differ by more than
+    the data, such as the page of a list.
+    """
+    return read_cache.derived(('fragment', name, key), tuple(collections), lambda: Markup(caller()))
@@ -0,0 +1,76 @@
+import base64
+import json
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from storage import INDEXED_FIELDS, SORT_FIELDS, StorageBackend, sort_value
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+@dataclass
+class Page:
+    items: List[Any] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+    limit: int = DEFAULT_PAGE_SIZE
+    sort: str = 'created_at'
+    descending: bool = False
+
+    @property
+    def has_more(self) -> bool:
+        return self.next_cursor is not None
+
+def encode_cursor(position: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, record_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(value), str(record_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def _checked(collection: str, filters: Optional[Dict[str, Any]], sort: str) -> Dict[str, Any]:
+    """Filters with blanks dropped, after checking they and sort are indexed"""
+    filters = {k: v for k, v in (filters or {}).items() if v not in (None, '')}
+    unknown = set(filters) - set(INDEXED_FIELDS[collection])
+    if unknown:
+        raise ValueError(f"Cannot filter {collection} by {', '.join(sorted(unknown))}")
+    if sort not in SORT_FIELDS[collection]:
+        raise ValueError(f"Cannot sort {collection} by {sort}")
+    return filters
+
+def paginate(backend: StorageBackend, collection: str, filters: Optional[Dict[str, Any]] = None,
+             sort: str = 'created_at', descending: bool = False, cursor: Optional[str] = None,
+             limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    """Fetch one keyset page; the cursor encodes the (sort value, id) of the last item served"""
+    filters = _checked(collection, filters, sort)
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    after = decode_cursor(cursor) if cursor else None
+
+    items = backend.page(collection, filters, sort=sort, descending=descending, after=after, limit=limit + 1)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor((sort_value(last, sort), last.id))
+    return Page(items=items, next_cursor=next_cursor, limit=limit, sort=sort, descending=descending)
+
+def walk(backend: StorageBackend, collection: str, filters: Optional[Dict[str, Any]] = None,
+         sort: str = 'created_at', descending: bool = False, batch: int = 500) -> Iterator[Any]:
+    """Every matching record in order, read one keyset page of batch records at a time.
+
+    Arguments are checked on the call rather than on first iteration, so
+    callers can report a bad filter before they start streaming.
+    """
+    filters = _checked(collection, filters, sort)
+
+    def records():
+        after = None
+        while True:
+            items = backend.page(collection, filters, sort=sort, descending=descending, after=after, limit=batch)
+            yield from items
+            if len(items) < batch:
+                return
+            after = (sort_value(items[-1], sort), items[-1].id)
+    return records()
@@ -0,0 +1,197 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from models import *
+from storage import index_key, sort_value
+
+# Status fields a deployment's participants are bucketed by
+STATUS_FIELDS = ('invite_status', 'survey_status', 'report_status')
+
+# Fields a deployment's participants can be listed in order of
+ORDER_FIELDS = ('sent_at', 'name', 'email', 'created_at')
+
+# Entries copied out of a sorted list per lock acquisition while walking
+WALK_BATCH = 500
+
+# A filtered walk whose smallest status bucket is under this share of the
+# deployment sorts the bucket instead of scanning the whole ordered list
+SELECTIVE_FILTER_RATIO = 0.25
+
+class DeploymentParticipants:
+    """Status table of one deployment's participants.
+
+    Each record is filed in a bucket per status value and in a list of
+    (sort value, id) per sort field. Status filters read the buckets:
+    a selective one is ordered directly, and counts per status are the
+    bucket sizes. Sent invites are also kept in a list per survey
+    status ordered by sent_at, so "not started N days after the invite"
+    is one bisect.
+    """
+
+    def __init__(self, participants: Iterable[Participant]):
+        self.records: Dict[str, Participant] = {}
+        self.buckets: Dict[str, Dict[Any, Set[str]]] = {field: defaultdict(set) for field in STATUS_FIELDS}
+        self.ordered: Dict[str, List[Tuple[str, str]]] = {field: [] for field in ORDER_FIELDS}
+        self.sent: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        # Each record's (sort value, id) per sort field, as filed in ordered
+        self.entries: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        # Where each record is filed; services update records in place, so
+        # the old keys cannot be recomputed from the record itself
+        self._filed: Dict[str, List[Tuple[Any, Any]]] = {}
+        for participant in participants:
+            self._file(participant, append=True)
+        for entries in list(self.ordered.values()) + list(self.sent.values()):
+            entries.sort()
+
+    def _file(self, participant: Participant, append: bool = False):
+        add = list.append if append else insort
+        filed = []
+        for field in STATUS_FIELDS:
+            bucket = self.buckets[field][index_key(field, getattr(participant, field))]
+            bucket.add(participant.id)
+            filed.append((bucket, None))
+        lists = list(self.ordered.items())
+        if participant.invite_status == InviteStatus.SENT:
+            lists.append(('sent_at', self.sent[participant.survey_status.value]))
+        for field, entries in lists:
+            entry = (sort_value(participant, field), participant.id)
+            add(entries, entry)
+            filed.append((entries, entry))
+        self.records[participant.id] = participant
+        self.entries[participant.id] = {field: (sort_value(participant, field), participant.id)
+                                        for field in ORDER_FIELDS}
+        self._filed[participant.id] = filed
+
+    def matching_entries(self, filters: Dict[str, Any], sort: str) -> Optional[List[Tuple[str, str]]]:
+        """Sorted entries of the records in every filter's bucket, or None when
+        the filters are not selective enough to beat walking the ordered list"""
+        buckets = sorted((self.buckets[field].get(value, set()) for field, value in filters.items()), key=len)
+        if not buckets or len(buckets[0]) >= len(self.records) * SELECTIVE_FILTER_RATIO:
+            return None
+        return sorted(self.entries[i][sort] for i in buckets[0] if all(i in b for b in buckets[1:]))
+
+    def counts(self) -> Dict[str, Dict[Any, int]]:
+        return {field: {value: len(ids) for value, ids in buckets.items() if ids}
+                for field, buckets in self.buckets.items()}
+
+    def put(self, participant: Participant):
+        self.discard(participant.id)
+        self._file(participant)
+
+    def discard(self, participant_id: str):
+        filed = self._filed.pop(participant_id, None)
+        if filed is None:
+            return
+        del self.records[participant_id]
+        del self.entries[participant_id]
+        for container, entry in filed:
+            if entry is None:
+                container.discard(participant_id)
+                continue
+            position = bisect_left(container, entry)
+            if position < len(container) and container[position] == entry:
+                del container[position]
+
+class ParticipantIndex:
+    """Per-deployment participant status tables, maintained from participant writes.
+
+    A deployment's table is built from its stored rows on first use and
+    kept current by the write listener, like ResponseAggregates. Walks
+    copy a batch of sorted entries at a time under the lock and resume by
+    bisecting from the last one, so a long export or reminder run neither
+    blocks writers nor trips over their changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[str, DeploymentParticipants] = {}
+
+    def invalidate(self, deployment_id: Optional[str] = None):
+        with self._lock:
+            if deployment_id is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(deployment_id, None)
+
+    def loaded(self, deployment_id: Optional[str] = None) -> bool:
+        """Whether deployment_id's table (or, with None, any table) is built"""
+        with self._lock:
+            return deployment_id in self._tables if deployment_id is not None else bool(self._tables)
+
+    def load(self, deployment_id: str, participants: Iterable[Participant]):
+        table = DeploymentParticipants(participants)
+        with self._lock:
+            self._tables[deployment_id] = table
+
+    def apply(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: refile a changed participant in its deployment's table"""
+        if collection == 'deployments' and before is not None and after is None:
+            self.invalidate(before.id)
+        if collection != 'participants':
+            return
+        with self._lock:
+            if before is not None and before.deployment_id in self._tables:
+                self._tables[before.deployment_id].discard(before.id)
+            if after is not None and after.deployment_id in self._tables:
+                self._tables[after.deployment_id].put(after)
+
+    def on_remote_write(self, participant_id: str, participant: Optional[Participant]):
+        """Refile a participant another process wrote; participant is its stored state or None"""
+        with self._lock:
+            for table in self._tables.values():
+                table.discard(participant_id)
+            if participant is not None and participant.deployment_id in self._tables:
+                self._tables[participant.deployment_id].put(participant)
+
+    def _batches(self, deployment_id: str, entries_of, descending: bool, after: Optional[Tuple[str, str]],
+                 until: Optional[Tuple[str, str]] = None) -> Iterator[List[Participant]]:
+        """Records in list order after the given entry (and up to until), a batch per lock acquisition"""
+        while True:
+            with self._lock:
+                table = self._tables.get(deployment_id)
+                if table is None:
+                    return
+                entries = entries_of(table)
+                if descending:
+                    end = bisect_left(entries, tuple(after)) if after is not None else len(entries)
+                    chunk = entries[max(end - WALK_BATCH, 0):end][::-1]
+                else:
+                    start = bisect_right(entries, tuple(after)) if after is not None else 0
+                    stop = bisect_right(entries, until) if until is not None else len(entries)
+                    chunk = entries[start:min(start + WALK_BATCH, stop)]
+                batch = [table.records[record_id] for _, record_id in chunk if record_id in table.records]
+            if not chunk:
+                return
+            yield batch
+            after = chunk[-1]
+
+    def walk(self, deployment_id: str, filters: Dict[str, Any], sort: str, descending: bool = False,
+             after: Optional[Tuple[str, str]] = None) -> Iterator[Participant]:
+        """Participants matching every status filter, in sort order after the given (sort value, id)"""
+        wanted = {field: index_key(field, value) for field, value in filters.items()}
+        with self._lock:
+            table = self._tables.get(deployment_id)
+            selected = table.matching_entries(wanted, sort) if table is not None and wanted else None
+        if selected is not None:
+            # Few matches: walk the sorted bucket, rechecking records changed since it was taken
+            entries_of = lambda table: selected
+        else:
+            entries_of = lambda table: table.ordered[sort]
+        for batch in self._batches(deployment_id, entries_of, descending, after):
+            for participant in batch:
+                if all(index_key(f, getattr(participant, f)) == v for f, v in wanted.items()):
+                    yield participant
+
+    def counts(self, deployment_id: str) -> Dict[str, Dict[Any, int]]:
+        """Participants per value of each status field"""
+        with self._lock:
+            table = self._tables.get(deployment_id)
+            return table.counts() if table is not None else {}
+
+    def sent_before(self, deployment_id: str, survey_status: ParticipationStatus, cutoff: str,
+                    after: Optional[Tuple[str, str]] = None) -> Iterator[Participant]:
+        """Sent invites in survey_status whose sent_at sort value is at most cutoff, oldest first"""
+        for batch in self._batches(deployment_id, lambda table: table.sent.get(survey_status.value, []), False,
+                                   after, until=(cutoff, '\uffff')):
+            yield from batch
@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Sequence, Tuple
+
+class CollectionSnapshot:
+    """Immutable view of one collection at one generation"""
+    __slots__ = ('generation', 'records', 'by_id', 'names')
+
+    def __init__(self, generation: int, records: Iterable[Any]):
+        self.generation = generation
+        self.records: Tuple[Any, ...] = tuple(records)
+        self.by_id: Mapping[str, Any] = MappingProxyType({r.id: r for r in self.records})
+        self.names: Mapping[str, str] = MappingProxyType({r.id: getattr(r, 'name', r.id) for r in self.records})
+
+class ReadCache:
+    """Versioned read-through cache for the small, often-listed collections.
+
+    Every write bumps its collection's generation counter. A collection
+    snapshot (a tuple of its records plus id->record and id->name maps)
+    is built on the first read after a bump and shared by all readers
+    until the next one. Derived views spanning several collections live
+    in a bounded LRU keyed by name and the generations of their inputs,
+    so a write to any input retires them without further bookkeeping.
+    """
+
+    def __init__(self, load_all: Callable[[str], Iterable[Any]], load_one: Callable[[str, str], Optional[Any]],
+                 derived_size: int = 64):
+        self.load_all = load_all
+        self.load_one = load_one
+        self.derived_size = derived_size
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = defaultdict(int)
+        # When each collection last changed; anything older predates this cache
+        self.created = datetime.now(timezone.utc)
+        self._modified: Dict[str, datetime] = {}
+        self._snapshots: Dict[str, CollectionSnapshot] = {}
+        self._derived: 'OrderedDict[Tuple[Hashable, ...], Any]' = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def _count(self, kind: str, hit: bool):
+        self._stats[kind]['hits' if hit else 'misses'] += 1
+
+    def generation(self, collection: str) -> int:
+        with self._lock:
+            return self._generations[collection]
+
+    def generations(self, collections: Sequence[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._generations[c] for c in collections)
+
+    def modified(self, collections: Sequence[str]) -> datetime:
+        """Latest change to any of collections seen by this process (UTC)"""
+        with self._lock:
+            return max((self._modified.get(c, self.created) for c in collections), default=self.created)
+
+    def bump(self, collection: str):
+        with self._lock:
+            self._generations[collection] += 1
+            self._modified[collection] = datetime.now(timezone.utc)
+            self._snapshots.pop(collection, None)
+
+    def invalidate(self):
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            for collection in self._generations:
+                self._generations[collection] += 1
+                self._modified[collection] = now
+            self._snapshots.clear()
+            self._derived.clear()
+
+    def on_write(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener"""
+        self.bump(collection)
+
+    def on_remote_write(self, collection: str, record_id: str):
+        """Sync listener"""
+        self.bump(collection)
+
+    def snapshot(self, collection: str) -> CollectionSnapshot:
+        with self._lock:
+            generation = self._generations[collection]
+            snapshot = self._snapshots.get(collection)
+            self._count('snapshot', snapshot is not None)
+        if snapshot is not None:
+            return snapshot
+        # Built outside the lock; a write meanwhile bumps the generation and the result is not kept
+        snapshot = CollectionSnapshot(generation, self.load_all(collection))
+        with self._lock:
+            if self._generations[collection] == generation:
+                self._snapshots[collection] = snapshot
+        return snapshot
+
+    def all(self, collection: str) -> Tuple[Any, ...]:
+        return self.snapshot(collection).records
+
+    def get(self, collection: str, record_id: str) -> Optional[Any]:
+        """A record from the current snapshot if one is built, else read through to the store"""
+        with self._lock:
+            snapshot = self._snapshots.get(collection)
+            self._count('get', snapshot is not None)
+        return snapshot.by_id.get(record_id) if snapshot is not None else self.load_one(collection, record_id)
+
+    def names(self, collection: str) -> Mapping[str, str]:
+        return self.snapshot(collection).names
+
+    def derived(self, name: Hashable, collections: Sequence[str], build: Callable[[], Any]) -> Any:
+        """Result of build(), reused until a write touches any of collections"""
+        with self._lock:
+            key = (name,) + tuple(self._generations[c] for c in collections)
+            found = key in self._derived
+            self._count('derived', found)
+            if found:
+                self._derived.move_to_end(key)
+                return self._derived[key]
+        value = build()
+        with self._lock:
+            if key == (name,) + tuple(self._generations[c] for c in collections):
+                self._derived[key] = value
+                while len(self._derived) > self.derived_size:
+                    self._derived.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {kind: dict(counts) for kind, counts in self._stats.items()}
+            stats['generations'] = dict(self._generations)
+            stats['derived_entries'] = len(self._derived)
+        return stats
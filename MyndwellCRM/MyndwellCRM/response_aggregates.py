@@ -0,0 +1,172 @@
+import math
+import threading
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+from models import *
+
+def _answered(answer: Any) -> bool:
+    return answer not in (None, '', [])
+
+class QuestionAggregate:
+    """Running results for one question of one deployment.
+
+    SINGLE and MULTI keep a count per choice code. SCALE also keeps a
+    histogram plus a Welford running mean and sum of squared deviations
+    over the choice weights, so responses can be added and removed in
+    O(1). FREE keeps only the number of answers. weights defaults to the
+    bank's QuestionChoice.weight; deployments pass their survey plan's,
+    which apply the template's overrides.
+    """
+
+    def __init__(self, question: Question, weights: Optional[Mapping[str, float]] = None):
+        self.question_id = question.id
+        self.code = question.code
+        self.text = question.text
+        self.type = question.type
+        self.choices = [(c.code, c.label) for c in question.choices]
+        if weights is None:
+            weights = {c.code: c.weight for c in question.choices if c.weight is not None}
+        self.weights = dict(weights)
+        self.answered = 0
+        self.counts: Dict[str, int] = {code: 0 for code, _ in self.choices}
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def apply(self, answer: Any, sign: int):
+        """Add (sign 1) or remove (sign -1) one answer"""
+        if not _answered(answer):
+            return
+        self.answered += sign
+        if self.type == QuestionType.FREE:
+            return
+        for code in (answer if isinstance(answer, list) else [answer]):
+            self.counts[code] = self.counts.get(code, 0) + sign
+        weight = self.weights.get(answer) if self.type == QuestionType.SCALE else None
+        if weight is None:
+            return
+        if sign > 0:
+            self.n += 1
+            delta = weight - self.mean
+            self.mean += delta / self.n
+            self.m2 += delta * (weight - self.mean)
+        elif self.n <= 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+        else:
+            self.n -= 1
+            delta = weight - self.mean
+            self.mean -= delta / self.n
+            self.m2 -= delta * (weight - self.mean)
+
+    @property
+    def variance(self) -> Optional[float]:
+        return max(self.m2, 0.0) / self.n if self.n else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            'question_id': self.question_id,
+            'code': self.code,
+            'text': self.text,
+            'type': self.type.value,
+            'answered': self.answered
+        }
+        if self.type == QuestionType.FREE:
+            return result
+        result['counts'] = [{'code': code, 'label': label, 'count': self.counts.get(code, 0)}
+                            for code, label in self.choices]
+        if self.type == QuestionType.SCALE:
+            variance = self.variance
+            result['mean'] = round(self.mean, 4) if self.n else None
+            result['variance'] = round(variance, 4) if variance is not None else None
+            result['stddev'] = round(math.sqrt(variance), 4) if variance is not None else None
+        return result
+
+class DeploymentResults:
+    """Aggregates for every question of one deployment's survey"""
+
+    def __init__(self, deployment_id: str, questions: Iterable[Question],
+                 weights: Optional[Mapping[str, Mapping[str, float]]] = None):
+        self.deployment_id = deployment_id
+        self.responses = 0
+        weights = weights or {}
+        self.questions: Dict[str, QuestionAggregate] = {q.id: QuestionAggregate(q, weights.get(q.id))
+                                                        for q in questions}
+
+    def apply(self, response: SurveyResponse, sign: int):
+        self.responses += sign
+        for question_id, answer in response.answers.items():
+            aggregate = self.questions.get(question_id)
+            if aggregate is not None:
+                aggregate.apply(answer, sign)
+
+    @property
+    def scale_count(self) -> int:
+        return sum(q.n for q in self.questions.values())
+
+    @property
+    def scale_sum(self) -> float:
+        return sum(q.mean * q.n for q in self.questions.values())
+
+    @property
+    def scale_mean(self) -> Optional[float]:
+        """Mean weight over every SCALE answer in the deployment"""
+        count = self.scale_count
+        return self.scale_sum / count if count else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        mean = self.scale_mean
+        return {
+            'deployment_id': self.deployment_id,
+            'responses': self.responses,
+            'scale_mean': round(mean, 4) if mean is not None else None,
+            'questions': [q.to_dict() for q in self.questions.values()]
+        }
+
+class ResponseAggregates:
+    """Per-deployment survey results, maintained from response writes.
+
+    A deployment's results are built once from its stored responses on
+    first read, then adjusted by each submission, resubmission or
+    deletion. Changes to questions or survey templates drop everything
+    so the next read rebuilds against the new definitions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[str, DeploymentResults] = {}
+
+    def invalidate(self, deployment_id: Optional[str] = None):
+        with self._lock:
+            if deployment_id is None:
+                self._results.clear()
+            else:
+                self._results.pop(deployment_id, None)
+
+    def get(self, deployment_id: str) -> Optional[DeploymentResults]:
+        with self._lock:
+            return self._results.get(deployment_id)
+
+    def load(self, deployment_id: str, questions: List[Question], responses: Iterable[SurveyResponse],
+             weights: Optional[Mapping[str, Mapping[str, float]]] = None) -> DeploymentResults:
+        results = DeploymentResults(deployment_id, questions, weights)
+        for response in responses:
+            results.apply(response, 1)
+        with self._lock:
+            self._results[deployment_id] = results
+        return results
+
+    def apply(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: fold a response change into its deployment's results"""
+        if collection in ('questions', 'survey_templates') and before is not None:
+            self.invalidate()
+            return
+        if collection == 'deployments' and before is not None:
+            if after is None or after.survey_template_id != before.survey_template_id:
+                self.invalidate(before.id)
+            return
+        if collection != 'responses':
+            return
+        with self._lock:
+            if before is not None and before.deployment_id in self._results:
+                self._results[before.deployment_id].apply(before, -1)
+            if after is not None and after.deployment_id in self._results:
+                self._results[after.deployment_id].apply(after, 1)
@@ -1,41 +1,104 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response
 from app import app
 from data_store import *
 from models import *
-from datetime import datetime
+from instrumentation import instrumentation
+from importer import import_persons, register_persons, registrant_values, ImportFormatError
+from email_dispatch import get_dispatcher
+from email_templates import TemplateError, compile_template, template_cache
+from exports import AUDIT_COLUMNS, RESULT_COLUMNS, export_response, participant_columns, person_columns, result_rows
+from page_cache import conditional, fragment, revalidated
+from pagination import DEFAULT_PAGE_SIZE
+from scheduler import validate_reminders
+from survey_plan import SurveyPlanError
+from serialization import to_dict
+from datetime import datetime, timedelta
+import itertools
+import json
+
+# Query argument -> filterable field for each list view
+USER_FILTERS = {'company_id': 'company_id', 'status': 'status', 'role': 'roles'}
+COMPANY_FILTERS = {'status': 'status'}
+SURVEY_FILTERS = {'status': 'status', 'program': 'program'}
+DEPLOYMENT_FILTERS = {'company_id': 'company_id', 'status': 'status'}
+AUDIT_FILTERS = {'action': 'action', 'entity_type': 'entity_type', 'entity_id': 'entity_id'}
+
+# Seconds between keep-alive comments on an idle event stream
+STREAM_HEARTBEAT = 15
+
+# Rows serialized per chunk of a streamed JSON array
+STREAM_BATCH = 500
+
+# Most registrants one batch registration request may carry
+MAX_REGISTRANTS = 5000
+
+def page_request(filter_args, descending=False):
+    """Read filter, sort and cursor query arguments for a paginated list"""
+    return {
+        'filters': {field: request.args.get(arg) for arg, field in filter_args.items()},
+        'sort': request.args.get('sort', 'created_at'),
+        'descending': request.args.get('order', 'desc' if descending else 'asc') == 'desc',
+        'cursor': request.args.get('cursor') or None,
+        'limit': request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    }
+
+def page_json(page):
+    return jsonify({
+        'items': [to_dict(item) for item in page.items],
+        'next_cursor': page.next_cursor,
+        'limit': page.limit
+    })
+
+def sse_event(event: str, data, event_id=None) -> str:
+    """One server-sent event with a JSON payload"""
+    lines = [f'event: {event}', f'data: {json.dumps(data)}']
+    if event_id is not None:
+        lines.insert(0, f'id: {event_id}')
+    return '\n'.join(lines) + '\n\n'
+
+def audit_window():
+    """Time range from ?date=YYYY-MM-DD, or ?since= / ?until= ISO timestamps"""
+    if request.args.get('date'):
+        start = datetime.strptime(request.args['date'], '%Y-%m-%d')
+        return {'start': start, 'end': start + timedelta(days=1)}
+    return {
+        'start': datetime.fromisoformat(request.args['since']) if request.args.get('since') else None,
+        'end': datetime.fromisoformat(request.args['until']) if request.args.get('until') else None
+    }
+
+app.add_template_global(fragment)
+
+@app.template_global()
+def page_args(**overrides):
+    """Current query arguments with overrides applied, for pagination links"""
+    args = request.args.to_dict()
+    args.update(overrides)
+    return {key: value for key, value in args.items() if value is not None}
 
 @app.route('/')
 def dashboard():
     """Dashboard with KPIs and overview"""
-    companies = CompanyService.get_all()
-    persons = PersonService.get_all()
-    surveys = SurveyTemplateService.get_all()
-    deployments = DeploymentService.get_all()
-    
-    # Calculate KPIs
-    total_companies = len(companies)
-    total_users = len(persons)
-    active_surveys = len([s for s in surveys if s.status == SurveyStatus.READY])
-    active_deployments = len([d for d in deployments if d.status == DeploymentStatus.ACTIVE])
-    
-    # Recent activity
-    recent_deployments = sorted(deployments, key=lambda x: x.created_at, reverse=True)[:5]
+    kpis = DashboardService.get_kpis()
+    recent_deployments = DashboardService.get_recent_deployments()
     
     return render_template('dashboard.html', 
-                         total_companies=total_companies,
-                         total_users=total_users,
-                         active_surveys=active_surveys,
-                         active_deployments=active_deployments,
+                         total_companies=kpis['total_companies'],
+                         total_users=kpis['total_users'],
+                         active_surveys=kpis['active_surveys'],
+                         active_deployments=kpis['active_deployments'],
                          recent_deployments=recent_deployments)
 
 # User Management Routes
 @app.route('/users')
 def users_index():
-    """List all users"""
-    persons = PersonService.get_all()
-    companies = CompanyService.get_all()
-    company_map = {c.id: c.name for c in companies}
-    return render_template('users/index.html', persons=persons, company_map=company_map)
+    """List users one page at a time"""
+    try:
+        page = PersonService.page(**page_request(USER_FILTERS))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('users_index'))
+    return render_template('users/index.html', persons=page.items, page=page,
+                           company_map=CompanyService.name_map())
 
 @app.route('/users/create', methods=['GET', 'POST'])
 def users_create():
@@ -99,9 +162,13 @@ def users_delete(user_id):
 # Survey Template Routes
 @app.route('/surveys')
 def surveys_index():
-    """List all survey templates"""
-    surveys = SurveyTemplateService.get_all()
-    return render_template('surveys/index.html', surveys=surveys)
+    """List survey templates one page at a time"""
+    try:
+        page = SurveyTemplateService.page(**page_request(SURVEY_FILTERS))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('surveys_index'))
+    return render_template('surveys/index.html', surveys=page.items, page=page)
 
 @app.route('/surveys/create', methods=['GET', 'POST'])
 def surveys_create():
@@ -144,21 +211,53 @@ def surveys_edit(survey_id):
     questions = QuestionService.get_all()
     return render_template('surveys/edit.html', survey=survey, questions=questions)
 
+@app.route('/api/surveys/<survey_id>/questions', methods=['POST'])
+def api_survey_questions(survey_id):
+    """Apply {operations: [...]} to a survey's question list atomically and return the new order"""
+    data = request.get_json(silent=True) or {}
+    try:
+        survey = SurveyTemplateService.edit_questions(survey_id, data.get('operations') or [])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if survey is None:
+        return jsonify({'error': 'Survey template not found'}), 404
+    questions = {sq.question_id: QuestionService.get_by_id(sq.question_id) for sq in survey.questions}
+    return jsonify({
+        'questions': [{
+            'question_id': sq.question_id,
+            'code': questions[sq.question_id].code if questions[sq.question_id] else None,
+            'order': sq.order,
+            'section': sq.section
+        } for sq in survey.questions],
+        'updated_at': survey.updated_at.isoformat()
+    })
+
+@app.route('/api/surveys/<survey_id>/plan')
+def api_survey_plan(survey_id):
+    """Compiled branching plan of a survey template, with unreachable and missing questions"""
+    survey = SurveyTemplateService.get_by_id(survey_id)
+    if not survey:
+        return jsonify({'error': 'Survey template not found'}), 404
+    try:
+        return jsonify(survey_plans.get(survey).to_dict())
+    except SurveyPlanError as e:
+        return jsonify({'error': str(e)}), 422
+
 # Deployment Routes
 @app.route('/deployments')
+@conditional('deployments', 'companies', 'survey_templates')
 def deployments_index():
-    """List all deployments"""
-    deployments = DeploymentService.get_all()
-    companies = CompanyService.get_all()
-    surveys = SurveyTemplateService.get_all()
-    
-    company_map = {c.id: c.name for c in companies}
-    survey_map = {s.id: s.name for s in surveys}
-    
+    """List deployments one page at a time"""
+    try:
+        page = DeploymentService.page(**page_request(DEPLOYMENT_FILTERS))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('deployments_index'))
     return render_template('deployments/index.html', 
-                         deployments=deployments, 
-                         company_map=company_map,
-                         survey_map=survey_map)
+                         deployments=page.items, 
+                         page=page,
+                         company_map=CompanyService.name_map(),
+                         survey_map=SurveyTemplateService.name_map())
 
 @app.route('/deployments/create', methods=['GET', 'POST'])
 def deployments_create():
@@ -169,6 +268,13 @@ def deployments_create():
             body=request.form['email_body'],
             preview_text=request.form.get('email_preview', '')
         )
+        try:
+            compile_template(email_template)
+        except TemplateError as e:
+            flash(str(e), 'error')
+            return render_template('deployments/create.html',
+                                   companies=CompanyService.get_all(),
+                                   surveys=SurveyTemplateService.get_all())
         
         deployment = Deployment(
             id=generate_id(),
@@ -202,18 +308,27 @@ def deployments_monitor(deployment_id):
     
     company = CompanyService.get_by_id(deployment.company_id)
     survey = SurveyTemplateService.get_by_id(deployment.survey_template_id)
+    results = ResponseService.get_results(deployment_id)
     
     return render_template('deployments/monitor.html', 
                          deployment=deployment, 
                          company=company, 
-                         survey=survey)
+                         survey=survey,
+                         results=results)
 
 # Company Routes
 @app.route('/companies')
+@conditional('companies', 'persons')
 def companies_index():
-    """List all companies"""
-    companies = CompanyService.get_all()
-    return render_template('companies/index.html', companies=companies, data_store=data_store)
+    """List companies one page at a time"""
+    try:
+        page = CompanyService.page(**page_request(COMPANY_FILTERS))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('companies_index'))
+    # Counted inside the cached company cards, so only when those are rebuilt
+    return render_template('companies/index.html', companies=page.items, page=page,
+                           user_count=PersonService.count_by_company)
 
 @app.route('/companies/create', methods=['GET', 'POST'])
 def companies_create():
@@ -246,34 +361,161 @@ def questions_index():
 
 # Reports Routes
 @app.route('/reports')
+@conditional(*REPORT_INPUTS)
 def reports_index():
     """Reports dashboard"""
     deployments = DeploymentService.get_all()
     companies = CompanyService.get_all()
     
-    return render_template('reports/index.html', deployments=deployments, companies=companies)
+    # Totals per company, read from the precomputed response aggregates
+    company_stats, totals = ResponseService.summarize_by_company()
+    
+    return render_template('reports/index.html', deployments=deployments, companies=companies,
+                           company_stats=company_stats, totals=totals, report_inputs=REPORT_INPUTS)
 
 # Audit Trail Routes
 @app.route('/audit')
 def audit_index():
-    """Audit trail"""
-    audit_logs = list(data_store['audit_logs'].values())
-    return render_template('audit/index.html', audit_logs=audit_logs)
+    """Audit trail, newest first"""
+    try:
+        page = AuditLogService.page(**page_request(AUDIT_FILTERS, descending=True), **audit_window())
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('audit_index'))
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    stats = {
+        'total': AuditLogService.count(),
+        'today': AuditLogService.count(today, today + timedelta(days=1))
+    }
+    return render_template('audit/index.html', audit_logs=page.items, page=page, stats=stats)
 
 # API Endpoints for AJAX
 @app.route('/api/questions/search')
 def api_questions_search():
     """Search questions for survey builder"""
     query = request.args.get('q', '')
-    questions = QuestionService.search(query) if query else QuestionService.get_all()
+    try:
+        types = [QuestionType(t) for t in request.args.getlist('type')]
+    except ValueError:
+        return jsonify({'error': 'Unknown question type'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    questions, total = QuestionService.search_page(query, types=types, offset=offset, limit=limit)
     
-    return jsonify([{
+    response = jsonify([{
         'id': q.id,
         'code': q.code,
         'text': q.text,
         'type': q.type.value,
         'choices': [{'code': c.code, 'label': c.label} for c in q.choices]
     } for q in questions])
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/api/users')
+def api_users():
+    """Page through users with optional company/status/role filters"""
+    try:
+        return page_json(PersonService.page(**page_request(USER_FILTERS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/companies')
+def api_companies():
+    """Page through companies"""
+    try:
+        return page_json(CompanyService.page(**page_request(COMPANY_FILTERS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/surveys')
+def api_surveys():
+    """Page through survey templates"""
+    try:
+        return page_json(SurveyTemplateService.page(**page_request(SURVEY_FILTERS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/deployments')
+def api_deployments():
+    """Page through deployments with optional company/status filters"""
+    try:
+        return page_json(DeploymentService.page(**page_request(DEPLOYMENT_FILTERS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    """Dashboard KPI counters"""
+    return jsonify(DashboardService.get_kpis())
+
+@app.route('/api/cache-stats')
+def api_cache_stats():
+    """Hit/miss counts and generations of the service read cache"""
+    stats = read_cache.stats()
+    stats['survey_plans'] = survey_plans.stats()
+    return jsonify(stats)
+
+@app.route('/metrics')
+def metrics():
+    """Request, service and template timings plus collection sizes in Prometheus text format"""
+    return Response(instrumentation.render(collection_sizes()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/audit-logs')
+def api_audit_logs():
+    """Page through audit logs, newest first"""
+    try:
+        return page_json(AuditLogService.page(**page_request(AUDIT_FILTERS, descending=True), **audit_window()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/deployments/<deployment_id>/send', methods=['POST'])
+def api_deployment_send(deployment_id):
+    """Start a deployment and queue its invite emails in the background"""
+    deployment = DeploymentService.get_by_id(deployment_id)
+    if not deployment:
+        return jsonify({'error': 'Deployment not found'}), 404
+    if deployment.status in (DeploymentStatus.COMPLETED, DeploymentStatus.CANCELLED):
+        return jsonify({'error': f'A {deployment.status.value} deployment cannot be sent'}), 409
+    if deployment.email_template is None:
+        return jsonify({'error': 'Deployment has no email template'}), 400
+    try:
+        template_cache.get(deployment)
+    except TemplateError as e:
+        return jsonify({'error': str(e)}), 400
+    # Sending again only reaches people not invited yet, so a retry or a
+    # restart mid-dispatch resumes where the last send stopped
+    if deployment.status in (DeploymentStatus.DRAFT, DeploymentStatus.SCHEDULED):
+        DeploymentService.update(deployment_id, {'status': DeploymentStatus.ACTIVE})
+    get_dispatcher().enqueue_deployment(deployment_id)
+    return jsonify({'message': 'Invites queued', 'deployment_id': deployment_id}), 202
+
+@app.route('/api/deployments/<deployment_id>/schedule', methods=['POST'])
+def api_deployment_schedule(deployment_id):
+    """Set start/end dates and reminders; a draft with a start date becomes scheduled"""
+    deployment = DeploymentService.get_by_id(deployment_id)
+    if not deployment:
+        return jsonify({'error': 'Deployment not found'}), 404
+    if deployment.status not in (DeploymentStatus.DRAFT, DeploymentStatus.SCHEDULED, DeploymentStatus.ACTIVE):
+        return jsonify({'error': f'A {deployment.status.value} deployment cannot be rescheduled'}), 400
+    data = request.get_json() or {}
+    try:
+        updates = {}
+        for field in ('start_date', 'end_date'):
+            if field in data:
+                updates[field] = datetime.fromisoformat(data[field]) if data[field] else None
+        if 'reminders' in data:
+            updates['reminders'] = validate_reminders(data['reminders'])
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    start = updates.get('start_date', deployment.start_date)
+    end = updates.get('end_date', deployment.end_date)
+    if start and end and end <= start:
+        return jsonify({'error': 'end_date must be after start_date'}), 400
+    if deployment.status == DeploymentStatus.DRAFT and start:
+        updates['status'] = DeploymentStatus.SCHEDULED
+    deployment = DeploymentService.update(deployment_id, updates)
+    return jsonify(to_dict(deployment))
 
 @app.route('/api/deployments/<deployment_id>/metrics')
 def api_deployment_metrics(deployment_id):
@@ -283,3 +525,374 @@ def api_deployment_metrics(deployment_id):
         return jsonify({'error': 'Deployment not found'}), 404
     
     return jsonify(deployment.metrics)
+
+@app.route('/api/deployments/<deployment_id>/events')
+def api_deployment_events(deployment_id):
+    """Server-sent events: the current metrics, then each tick's changes to them"""
+    # Subscribe before reading so no change falls between the two
+    subscription = metrics_bus.subscribe([deployment_id])
+    deployment = DeploymentService.get_by_id(deployment_id)
+    if not deployment:
+        metrics_bus.unsubscribe(subscription)
+        return jsonify({'error': 'Deployment not found'}), 404
+
+    def events():
+        try:
+            yield sse_event('metrics', deployment.metrics, metrics_bus.sequence)
+            while True:
+                sequence, changes = subscription.wait(STREAM_HEARTBEAT)
+                if not changes:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield sse_event('metrics', changes[deployment_id], sequence)
+        finally:
+            # Runs when the client disconnects and the server closes the stream
+            metrics_bus.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/deployments/<deployment_id>/results')
+def api_deployment_results(deployment_id):
+    """Per-question results for a deployment"""
+    results = ResponseService.get_results(deployment_id)
+    if results is None:
+        return jsonify({'error': 'Deployment not found'}), 404
+    return jsonify(results.to_dict())
+
+@app.route('/api/deployments/<deployment_id>/responses', methods=['POST'])
+def api_deployment_respond(deployment_id):
+    """Submit a person's answers as {person_id, answers: {question_id: answer}}"""
+    data = request.get_json(silent=True) or {}
+    try:
+        response = ResponseService.submit(deployment_id, data.get('person_id', ''), data.get('answers') or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Response recorded', 'response_id': response.id}), 201
+
+@app.route('/api/reports/crosstab')
+def api_reports_crosstab():
+    """Cross-tab of a question's answers by respondent dimensions.
+    
+    ?question_id=...&by=department&by=location groups the answers;
+    deployment_id, company_id and filter.<dimension>=<value> narrow them;
+    format=csv downloads the table.
+    """
+    filters = {}
+    for arg, dimension in (('deployment_id', 'deployment'), ('company_id', 'company')):
+        if request.args.get(arg):
+            filters[dimension] = request.args.getlist(arg)
+    for arg in request.args:
+        if arg.startswith('filter.'):
+            filters[arg[len('filter.'):]] = request.args.getlist(arg)
+    try:
+        table = ReportService.crosstab(request.args.get('question_id', ''), request.args.getlist('by'), filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if request.args.get('format') == 'csv':
+        return Response(table.to_csv(), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=crosstab.csv'})
+    return jsonify({'columns': table.columns, 'rows': table.to_dicts()})
+
+# Survey response page linked from invite emails
+@app.route('/respond/<deployment_id>/<person_id>', methods=['GET', 'POST'])
+def respond(deployment_id, person_id):
+    """Let an invited person fill in a deployment's survey"""
+    deployment = DeploymentService.get_by_id(deployment_id)
+    person = PersonService.get_by_id(person_id)
+    if not deployment or not person or person.company_id != deployment.company_id:
+        return render_template('respond/survey.html', error='This survey link is not valid.'), 404
+    try:
+        plan = ResponseService.get_plan(deployment)
+    except SurveyPlanError:
+        app.logger.exception('Survey of deployment %s does not compile', deployment_id)
+        plan = None
+    if plan is None:
+        return render_template('respond/survey.html', deployment=deployment,
+                               error='This survey is not available right now.'), 503
+    questions = [planned.question for planned in plan.questions]
+    
+    if request.method == 'POST':
+        answers = {}
+        for question in questions:
+            field = f'q_{question.id}'
+            if question.type == QuestionType.MULTI:
+                answers[question.id] = request.form.getlist(field)
+            else:
+                answers[question.id] = request.form.get(field)
+        try:
+            ResponseService.submit(deployment_id, person_id, answers)
+        except ValueError as e:
+            return render_template('respond/survey.html', deployment=deployment, person=person,
+                                   questions=questions, answers=answers, error=str(e)), 400
+        return render_template('respond/survey.html', deployment=deployment, person=person, submitted=True)
+    
+    previous = ResponseService.get_for_person(deployment_id, person_id)
+    if deployment.status == DeploymentStatus.ACTIVE:
+        ParticipantService.record_progress(deployment_id, person_id, ParticipationStatus.IN_PROGRESS)
+    return render_template('respond/survey.html', deployment=deployment, person=person,
+                           questions=questions, answers=previous.answers if previous else {})
+
+# User Registration Routes
+@app.route('/register')
+def register_user_page():
+    """User registration page"""
+    companies = CompanyService.get_all()
+    return render_template('registration/index.html', companies=companies)
+
+@app.route('/register-user', methods=['POST'])
+def register_user():
+    """Register a single user"""
+    try:
+        data = request.get_json()
+        
+        # Create new person
+        person = Person(
+            id=generate_id(),
+            company_id=data['company_id'],
+            email=data['email'].lower(),
+            name=data['fullName'],
+            roles=['user'],
+            status=UserStatus.ACTIVE,
+            metadata={
+                'year_of_birth': data.get('yearOfBirth'),
+                'mobile': data.get('mobile'),
+                'alt_email': data.get('altEmail'),
+                'designation': data.get('designation'),
+                'department': data.get('department'),
+                'location': data.get('location'),
+                'marital_status': data.get('maritalStatus'),
+                'current_role': data.get('currentRole'),
+                'year_of_joining': data.get('yearOfJoining'),
+                'work_mode': data.get('workMode'),
+                'shift': data.get('shift')
+            }
+        )
+        
+        PersonService.create(person)
+        return jsonify({'message': 'User registered successfully'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/register-users', methods=['POST'])
+def register_users_bulk():
+    """Register multiple users via CSV or Excel upload"""
+    upload = request.files.get('xlsFile') or request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    
+    try:
+        result = import_persons(upload.stream, upload.filename,
+                                company_id=request.form.get('company_id') or None)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'message': f'{result.created} users registered successfully',
+        'count': result.created,
+        'rows': result.rows,
+        'error_count': result.error_count,
+        'errors': result.errors,
+        'errors_truncated': result.errors_truncated
+    })
+
+@app.route('/api/registrations', methods=['POST'])
+def api_register_batch():
+    """Register {company_id?, registrants: [...]} in one pass, each registrant shaped like /register-user's body"""
+    data = request.get_json(silent=True) or {}
+    registrants = data.get('registrants')
+    if not isinstance(registrants, list) or not all(isinstance(r, dict) for r in registrants):
+        return jsonify({'error': 'registrants must be a list of objects'}), 400
+    if len(registrants) > MAX_REGISTRANTS:
+        return jsonify({'error': f'At most {MAX_REGISTRANTS} registrants per request'}), 413
+    try:
+        result = register_persons(((index, registrant_values(r)) for index, r in enumerate(registrants)),
+                                  company_id=data.get('company_id') or None,
+                                  batch_size=max(len(registrants), 1))
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'message': f'{result.created} users registered successfully',
+        'count': result.created,
+        'rows': result.rows,
+        'error_count': result.error_count,
+        # index is the registrant's position in the request
+        'errors': [{'index': e['row'], 'email': e['email'], 'error': e['error']} for e in result.errors],
+        'errors_truncated': result.errors_truncated
+    })
+
+@app.route('/get-designations-departments-locations/<company_id>')
+def get_company_details(company_id):
+    """Dropdown values for a company's registration form: those its people use, then common defaults"""
+    company = CompanyService.get_by_id(company_id)
+    if not company:
+        return jsonify({'error': 'Company not found'}), 404
+    tag, options = CompanyService.registration_options(company_id)
+    return revalidated(tag, lambda: jsonify(options))
+
+# Survey Management Hub Routes
+@app.route('/survey-management-hub')
+def survey_management_hub():
+    """Survey management hub page"""
+    return render_template('survey_hub/index.html')
+
+@app.route('/survey-tracker')
+def survey_tracker():
+    """Survey tracker page"""
+    companies = CompanyService.get_all()
+    return render_template('survey_hub/tracker.html', companies=companies)
+
+@app.route('/survey-deployment')
+def survey_deployment():
+    """Survey deployment page"""
+    companies = CompanyService.get_all()
+    return render_template('survey_hub/deployment.html', companies=companies)
+
+@app.route('/report-generation')
+def report_generation():
+    """Report generation page"""
+    companies = CompanyService.get_all()
+    return render_template('survey_hub/reports.html', companies=companies)
+
+# API Routes for Survey Management
+@app.route('/api/companies/<company_id>/surveys')
+def api_company_surveys(company_id):
+    """Deployed surveys of a company; CompanySurveyId is the deployment id"""
+    survey_names = SurveyTemplateService.name_map()
+    return jsonify([{
+        'SurveyId': d.survey_template_id,
+        'SurveyName': f"{d.name} ({survey_names.get(d.survey_template_id, 'Unknown survey')})",
+        'CompanySurveyId': d.id
+    } for d in sorted(DeploymentService.get_by_company(company_id), key=lambda d: d.created_at, reverse=True)])
+
+def participant_json(participant: Participant, now: datetime) -> Dict:
+    return {
+        'PersonId': participant.person_id,
+        'DeploymentId': participant.deployment_id,
+        'FullName': participant.name,
+        'Email': participant.email,
+        'DeploymentStatus': participant.invite_status.value,
+        'SurveyStatus': participant.survey_status.value,
+        'ReportStatus': participant.report_status.value,
+        'SentAt': participant.sent_at.isoformat() if participant.sent_at else None,
+        'DaysSinceSent': (now - participant.sent_at).days if participant.sent_at else None,
+        'RemindersSent': participant.reminders_sent
+    }
+
+def participant_query(now):
+    """Filter, search, ?min_days= and sort query arguments for a deployment's participants"""
+    min_days = request.args.get('min_days', type=float)
+    return {
+        'filters': {field: request.args.get(field) for field in ('invite_status', 'survey_status', 'report_status')},
+        'search': request.args.get('search', ''),
+        'sent_before': now - timedelta(days=min_days) if min_days is not None else None,
+        'sort': request.args.get('sort', 'sent_at'),
+        'descending': request.args.get('order', 'asc') == 'desc',
+        'cursor': request.args.get('cursor') or None
+    }
+
+@app.route('/api/company-surveys/<company_survey_id>/status')
+def api_survey_status(company_survey_id):
+    """Participant status for a deployment, filtered, searched and paged server-side.
+
+    ?min_days=N keeps invites sent at least N days ago; ?stream=1 sends
+    every match as one JSON array, written out as it is read. Pages also
+    carry the deployment's participant counts per status value.
+    """
+    if not DeploymentService.get_by_id(company_survey_id):
+        return jsonify({'error': 'Deployment not found'}), 404
+    now = datetime.now()
+    query = participant_query(now)
+    stream = bool(request.args.get('stream'))
+    try:
+        if stream:
+            participants = ParticipantService.matching(company_survey_id, **query)
+        else:
+            page = ParticipantService.page(company_survey_id, limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+                                           **query)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not stream:
+        return jsonify({
+            'items': [participant_json(p, now) for p in page.items],
+            'next_cursor': page.next_cursor,
+            'limit': page.limit,
+            'counts': ParticipantService.status_counts(company_survey_id)
+        })
+
+    def rows():
+        yield '['
+        separator = ''
+        for batch in iter(lambda: list(itertools.islice(participants, STREAM_BATCH)), []):
+            yield separator + ','.join(json.dumps(participant_json(p, now)) for p in batch)
+            separator = ','
+        yield ']'
+    return Response(rows(), mimetype='application/json')
+
+@app.route('/api/send-reminder-emails', methods=['POST'])
+def send_reminder_emails():
+    """Queue reminder emails to selected users"""
+    try:
+        users = request.get_json()
+        by_deployment = {}
+        skipped = 0
+        for user in users:
+            person = PersonService.get_by_email(user.get('email', ''))
+            deployment_id = user.get('deploymentId')
+            if not person or not deployment_id or not DeploymentService.get_by_id(deployment_id):
+                skipped += 1
+                continue
+            by_deployment.setdefault(deployment_id, []).append(person.id)
+        
+        dispatcher = get_dispatcher()
+        for deployment_id, person_ids in by_deployment.items():
+            dispatcher.enqueue_deployment(deployment_id, person_ids, reminder=True)
+        queued = sum(len(ids) for ids in by_deployment.values())
+        return jsonify({'message': f'Reminder emails queued for {queued} users', 'queued': queued, 'skipped': skipped})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+# Export Endpoints
+@app.route('/export/users.<any(csv, xlsx):fmt>')
+def export_users(fmt):
+    """Users matching the list filters, streamed as a spreadsheet"""
+    query = page_request(USER_FILTERS)
+    try:
+        persons = PersonService.walk(query['filters'], query['sort'], query['descending'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return export_response(f"users-{datetime.now():%Y-%m-%d}", fmt, person_columns(CompanyService.name_map()),
+                           persons, 'Users')
+
+@app.route('/export/deployments/<deployment_id>/participants.<any(csv, xlsx):fmt>')
+def export_participants(deployment_id, fmt):
+    """Participant status for a deployment, with the status endpoint's filters, streamed as a spreadsheet"""
+    if not DeploymentService.get_by_id(deployment_id):
+        return jsonify({'error': 'Deployment not found'}), 404
+    now = datetime.now()
+    try:
+        participants = ParticipantService.matching(deployment_id, **participant_query(now))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return export_response(f'deployment-{deployment_id}-participants', fmt, participant_columns(now),
+                           participants, 'Participants')
+
+@app.route('/export/deployments/<deployment_id>/results.<any(csv, xlsx):fmt>')
+def export_results(deployment_id, fmt):
+    """Per-choice result counts for a deployment as a spreadsheet"""
+    results = ResponseService.get_results(deployment_id)
+    if results is None:
+        return jsonify({'error': 'Deployment not found'}), 404
+    return export_response(f'deployment-{deployment_id}-results', fmt, RESULT_COLUMNS,
+                           result_rows(results.to_dict()), 'Results')
+
+@app.route('/export/audit.<any(csv, xlsx):fmt>')
+def export_audit(fmt):
+    """Audit entries matching the trail's filters and time range, oldest first, streamed as a spreadsheet"""
+    try:
+        entries = AuditLogService.walk({field: request.args.get(arg) for arg, field in AUDIT_FILTERS.items()},
+                                       request.args.get('order', 'asc') == 'desc', **audit_window())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return export_response(f"audit-log-{datetime.now():%Y-%m-%d}", fmt, AUDIT_COLUMNS, entries, 'Audit Log')
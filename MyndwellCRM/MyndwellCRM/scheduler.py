@@ -0,0 +1,294 @@
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from flask import Flask
+from models import *
+import data_store
+from data_store import DeploymentService, ParticipantService, add_sync_listener, add_write_listener, sync_changes
+from email_dispatch import DispatchEngine, get_dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Statuses that still have timed transitions ahead of them
+OPEN_STATUSES = (DeploymentStatus.SCHEDULED, DeploymentStatus.ACTIVE)
+
+# Survey statuses that count as not having responded, for reminders
+NON_RESPONDERS = (ParticipationStatus.NOT_STARTED, ParticipationStatus.IN_PROGRESS)
+
+# Deployment fields the schedule is derived from
+SCHEDULE_FIELDS = ('status', 'start_date', 'end_date', 'reminders')
+
+# Superseded heap entries tolerated per live one before the heap is rebuilt
+COMPACT_RATIO = 4
+
+def schedule_key(deployment: Deployment) -> Tuple:
+    """The values of a deployment's schedule fields, copied so later in-place edits cannot alter it"""
+    return tuple(tuple(dict(r) for r in deployment.reminders) if field == 'reminders' else getattr(deployment, field)
+                 for field in SCHEDULE_FIELDS)
+
+def validate_reminders(reminders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Check reminder specs, [{'days_after': N}, ...], returning them ordered by days_after"""
+    for reminder in reminders:
+        days = reminder.get('days_after') if isinstance(reminder, dict) else None
+        if not isinstance(days, (int, float)) or isinstance(days, bool) or days <= 0:
+            raise ValueError('Each reminder needs a positive days_after')
+    return sorted(reminders, key=lambda r: r['days_after'])
+
+class DeploymentScheduler:
+    """Moves deployments through their lifecycle on time and sends reminders.
+
+    Each open deployment contributes its next events to a heap ordered
+    by due time: activation at start_date for SCHEDULED deployments,
+    completion at end_date, and one reminder per entry of
+    Deployment.reminders ({'days_after': N} after start_date, or after
+    creation when there is none). A reminder goes to invitees who have
+    not completed the survey, at least N days after their invite, and
+    records its 'sent_at' on the deployment so it is not repeated.
+
+    The heap is rebuilt from stored deployments on start, and write and
+    sync listeners replan a deployment whenever its schedule fields
+    change; superseded heap entries are skipped when they come due, and
+    the heap is rebuilt once they outnumber live entries COMPACT_RATIO
+    to one. One
+    thread sleeps until the next due time. Activations and reminders are
+    claimed in the backend first, so with several workers each fires
+    once. clock is injectable, and run_due() can be driven directly.
+    """
+
+    def __init__(self, clock: Callable[[], datetime] = datetime.now,
+                 dispatcher: Optional[Callable[[], DispatchEngine]] = None,
+                 poll: Optional[Callable[[], None]] = None, max_sleep: float = 60.0):
+        self.clock = clock
+        self.dispatcher = dispatcher or get_dispatcher
+        self.poll = poll
+        self.max_sleep = max_sleep
+        self._heap: List[Tuple[datetime, int, str, str, int, int]] = []
+        self._versions: Dict[str, int] = {}
+        # Schedule each deployment was last planned from, live heap entries per deployment, superseded entries
+        self._planned: Dict[str, Tuple] = {}
+        self._live: Dict[str, int] = {}
+        self._stale = 0
+        self._sequence = itertools.count()
+        self._wake = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    @staticmethod
+    def events(deployment: Deployment) -> List[Tuple[datetime, str, int]]:
+        """(due, kind, reminder index) still ahead for a deployment"""
+        if deployment.status not in OPEN_STATUSES:
+            return []
+        events = []
+        if deployment.status == DeploymentStatus.SCHEDULED and deployment.start_date:
+            events.append((deployment.start_date, 'activate', -1))
+        if deployment.end_date:
+            events.append((deployment.end_date, 'complete', -1))
+        start = deployment.start_date or deployment.created_at
+        for index, reminder in enumerate(deployment.reminders):
+            days = reminder.get('days_after')
+            if isinstance(days, (int, float)) and not reminder.get('sent_at'):
+                events.append((start + timedelta(days=days), 'remind', index))
+        return events
+
+    def plan(self, deployment: Deployment):
+        """Replace a deployment's pending events with those its current state implies"""
+        with self._wake:
+            self._supersede(deployment.id)
+            version = self._versions[deployment.id]
+            self._planned[deployment.id] = schedule_key(deployment)
+            events = self.events(deployment)
+            for due, kind, index in events:
+                heapq.heappush(self._heap, (due, next(self._sequence), kind, deployment.id, index, version))
+            if events:
+                self._live[deployment.id] = len(events)
+            self._compact()
+            self._wake.notify()
+
+    def replan(self, deployment: Deployment):
+        """plan() a deployment only when its schedule differs from the one last planned"""
+        with self._wake:
+            if self._planned.get(deployment.id) == schedule_key(deployment):
+                return
+        self.plan(deployment)
+
+    def forget(self, deployment_id: str):
+        with self._wake:
+            self._supersede(deployment_id)
+            self._planned.pop(deployment_id, None)
+
+    def rebuild(self, deployments):
+        with self._wake:
+            self._heap = []
+            self._versions = {}
+            self._planned = {}
+            self._live = {}
+            self._stale = 0
+        for deployment in deployments:
+            self.plan(deployment)
+
+    def _supersede(self, deployment_id: str):
+        self._versions[deployment_id] = self._versions.get(deployment_id, 0) + 1
+        self._stale += self._live.pop(deployment_id, 0)
+
+    def _compact(self):
+        if self._stale > COMPACT_RATIO * max(len(self._heap) - self._stale, 1):
+            self._heap = [entry for entry in self._heap if self._versions.get(entry[3]) == entry[5]]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def next_due(self) -> Optional[datetime]:
+        with self._wake:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pending(self) -> int:
+        with self._wake:
+            return len(self._heap) - self._stale
+
+    def _drop_stale(self):
+        while self._heap and self._versions.get(self._heap[0][3]) != self._heap[0][5]:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+    def run_due(self) -> int:
+        """Fire every event due by the clock; returns how many came due"""
+        fired = 0
+        while True:
+            with self._wake:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > self.clock():
+                    return fired
+                due, _, kind, deployment_id, index, _ = heapq.heappop(self._heap)
+                self._live[deployment_id] -= 1
+                if not self._live[deployment_id]:
+                    del self._live[deployment_id]
+            try:
+                self._fire(kind, deployment_id, index, due)
+                fired += 1
+            except Exception:
+                logger.exception('Scheduled %s of deployment %s failed', kind, deployment_id)
+
+    def _fire(self, kind: str, deployment_id: str, index: int, due: datetime):
+        deployment = DeploymentService.get_by_id(deployment_id)
+        if deployment is None:
+            return
+        if kind == 'activate':
+            if deployment.status != DeploymentStatus.SCHEDULED or \
+                    not data_store.backend.claim(f'activate:{deployment_id}:{int(due.timestamp())}'):
+                return
+            DeploymentService.update(deployment_id, {'status': DeploymentStatus.ACTIVE})
+            if deployment.email_template is not None:
+                self.dispatcher().enqueue_deployment(deployment_id)
+        elif kind == 'complete':
+            if deployment.status in OPEN_STATUSES:
+                DeploymentService.update(deployment_id, {'status': DeploymentStatus.COMPLETED})
+        elif kind == 'remind':
+            if deployment.status != DeploymentStatus.ACTIVE or index >= len(deployment.reminders) or \
+                    not data_store.backend.claim(f'remind:{deployment_id}:{index}:{int(due.timestamp())}'):
+                return
+            now = self.clock()
+            person_ids = [p.person_id for p in ParticipantService.awaiting_reminder(
+                deployment_id, deployment.reminders[index]['days_after'], now, NON_RESPONDERS)
+                if p.reminders_sent <= index]
+            if person_ids:
+                self.dispatcher().enqueue_deployment(deployment_id, person_ids, reminder=True)
+            reminders = [dict(r) for r in deployment.reminders]
+            reminders[index].update(sent_at=now.isoformat(), recipients=len(person_ids))
+            DeploymentService.update(deployment_id, {'reminders': reminders})
+
+    # Listeners
+
+    def on_write(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener: replan a deployment whose schedule fields changed"""
+        if collection != 'deployments':
+            return
+        if after is None:
+            self.forget(before.id)
+        else:
+            self.replan(after)
+
+    def on_remote_write(self, collection: str, record_id: str):
+        """Sync listener"""
+        if collection != 'deployments':
+            return
+        deployment = data_store.backend.get('deployments', record_id)
+        if deployment is None:
+            self.forget(record_id)
+        else:
+            self.replan(deployment)
+
+    # Background thread
+
+    def start(self):
+        with self._wake:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='deployment-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._wake:
+            self._running = False
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            if self.poll is not None:
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception('Scheduler poll failed')
+            self.run_due()
+            with self._wake:
+                if not self._running:
+                    return
+                self._drop_stale()
+                delay = self.max_sleep
+                if self._heap:
+                    delay = min(max((self._heap[0][0] - self.clock()).total_seconds(), 0.0), delay)
+                self._wake.wait(delay)
+                if not self._running:
+                    return
+
+_scheduler: Optional[DeploymentScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> DeploymentScheduler:
+    """The process-wide scheduler, planned from stored deployments on first use; start() runs it"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = DeploymentScheduler(poll=sync_changes)
+            add_write_listener(_scheduler.on_write)
+            add_sync_listener(_scheduler.on_remote_write)
+            _scheduler.rebuild(DeploymentService.get_all())
+        return _scheduler
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    """Start the audit flusher, the email workers and the scheduler, once per process"""
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        data_store.audit_trail.start()
+        get_dispatcher().start()
+        get_scheduler().start()
+        _background_started = True
+
+def init_app(app: Flask):
+    """Run the background threads from the app's first request, so importing it starts nothing;
+    BACKGROUND_TASKS = False leaves them off (tests, scripts)"""
+    if app.config.get('BACKGROUND_TASKS', True):
+        app.before_request(start_background_tasks)
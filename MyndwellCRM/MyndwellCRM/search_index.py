@@ -0,0 +1,138 @@
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from models import *
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+SPLIT_PATTERN = re.compile(r'[a-z]+|[0-9]+')
+
+# Relative weight of a token depending on the field it came from
+FIELD_WEIGHTS = {'code': 2.0, 'text': 1.0}
+EXACT_SCORE = 3.0
+PREFIX_SCORE = 1.5
+CODE_MATCH_BONUS = 10.0
+PHRASE_BONUS = 2.0
+
+def tokenize(value: str) -> List[str]:
+    """Lowercase word tokens; alphanumeric runs are also split at letter/digit boundaries"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(value.lower()):
+        tokens.append(token)
+        parts = SPLIT_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+class QuestionSearchIndex:
+    """Inverted index over question code and text for typeahead search.
+
+    Every query term must match a token, either exactly or, for
+    typeahead, as a prefix found by bisecting the sorted vocabulary.
+    Results are ranked by match quality and the field the match came from.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._vocabulary: List[str] = []
+        self._doc_tokens: Dict[str, Set[str]] = {}
+        self._questions: Dict[str, Question] = {}
+        self._by_type: Dict[QuestionType, Set[str]] = defaultdict(set)
+        self.stale = True
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def invalidate(self):
+        """Mark the index for a full rebuild on next use"""
+        self.stale = True
+
+    def rebuild(self, questions: Iterable[Question]):
+        with self._lock:
+            self._reset()
+            for question in questions:
+                self.add(question)
+            self.stale = False
+
+    def add(self, question: Question):
+        with self._lock:
+            self.remove(question.id)
+            weights: Dict[str, float] = {}
+            for field in ('code', 'text'):
+                for token in tokenize(getattr(question, field) or ''):
+                    weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS[field])
+            for token, weight in weights.items():
+                if token not in self._postings:
+                    insort(self._vocabulary, token)
+                self._postings[token][question.id] = weight
+            self._doc_tokens[question.id] = set(weights)
+            self._questions[question.id] = question
+            self._by_type[question.type].add(question.id)
+
+    def remove(self, question_id: str):
+        with self._lock:
+            question = self._questions.pop(question_id, None)
+            if question is None:
+                return
+            self._by_type[question.type].discard(question_id)
+            for token in self._doc_tokens.pop(question_id):
+                postings = self._postings[token]
+                postings.pop(question_id, None)
+                if not postings:
+                    del self._postings[token]
+                    del self._vocabulary[bisect_left(self._vocabulary, token)]
+
+    def _expand(self, term: str) -> List[str]:
+        start = bisect_left(self._vocabulary, term)
+        end = bisect_left(self._vocabulary, term + '\uffff')
+        return self._vocabulary[start:end]
+
+    def _term_scores(self, term: str) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for token in self._expand(term):
+            quality = EXACT_SCORE if token == term else PREFIX_SCORE * len(term) / len(token)
+            for question_id, weight in self._postings[token].items():
+                score = quality * weight
+                if score > scores.get(question_id, 0.0):
+                    scores[question_id] = score
+        return scores
+
+    def search(self, query: str, types: Optional[Iterable[QuestionType]] = None,
+               offset: int = 0, limit: Optional[int] = None) -> Tuple[List[Question], int]:
+        """Return one page of ranked matches and the total number of matches"""
+        terms = list(dict.fromkeys(TOKEN_PATTERN.findall(query.lower())))
+        with self._lock:
+            allowed = None
+            if types:
+                allowed = set().union(*(self._by_type.get(t, set()) for t in types))
+            if not terms:
+                ids = [qid for qid in self._questions if allowed is None or qid in allowed]
+                page = ids[offset:offset + limit if limit is not None else None]
+                return [self._questions[qid] for qid in page], len(ids)
+
+            scores: Optional[Dict[str, float]] = None
+            # Rarest terms first keeps the candidate set small while intersecting
+            for term_scores in sorted((self._term_scores(t) for t in terms), key=len):
+                if scores is None:
+                    scores = {qid: s for qid, s in term_scores.items() if allowed is None or qid in allowed}
+                else:
+                    scores = {qid: s + term_scores[qid] for qid, s in scores.items() if qid in term_scores}
+                if not scores:
+                    return [], 0
+
+            phrase = query.strip().lower()
+            for question_id in scores:
+                question = self._questions[question_id]
+                if question.code.lower() == phrase:
+                    scores[question_id] += CODE_MATCH_BONUS
+                elif phrase in question.text.lower():
+                    scores[question_id] += PHRASE_BONUS
+
+            ranked = sorted(scores, key=lambda qid: (-scores[qid], self._questions[qid].code))
+            page = ranked[offset:offset + limit if limit is not None else None]
+            return [self._questions[qid] for qid in page], len(ranked)
@@ -0,0 +1,52 @@
+from collections.abc import Mapping
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Type, Union, get_args, get_origin, get_type_hints
+
+def to_dict(obj: Any) -> Any:
+    """Convert a model instance into JSON-compatible primitives"""
+    if is_dataclass(obj):
+        return {f.name: to_dict(getattr(obj, f.name)) for f in fields(obj)}
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, (dict, Mapping)):
+        return {key: to_dict(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_dict(value) for value in obj]
+    return obj
+
+@lru_cache(maxsize=None)
+def _field_types(cls: Type) -> Dict[str, Any]:
+    return get_type_hints(cls)
+
+def _decode(tp: Any, value: Any) -> Any:
+    if value is None:
+        return None
+    origin = get_origin(tp)
+    if origin is Union:
+        args = [a for a in get_args(tp) if a is not type(None)]
+        return _decode(args[0], value) if len(args) == 1 else value
+    if origin in (list, tuple):
+        args = get_args(tp)
+        return [_decode(args[0], v) for v in value] if args else list(value)
+    if origin is dict:
+        args = get_args(tp)
+        return {k: _decode(args[1], v) for k, v in value.items()} if args else dict(value)
+    if isinstance(tp, type):
+        if is_dataclass(tp):
+            return from_dict(tp, value)
+        if issubclass(tp, Enum):
+            return tp(value)
+        if issubclass(tp, datetime):
+            return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return value
+
+def from_dict(cls: Type, data: Dict[str, Any]) -> Any:
+    """Rebuild a model instance from the output of to_dict"""
+    types = _field_types(cls)
+    kwargs = {name: _decode(types[name], value) for name, value in data.items() if name in types}
+    return cls(**kwargs)
@@ -0,0 +1,519 @@
+import atexit
+import gc
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from itertools import chain, islice
+from array import array
+from collections import defaultdict
+from collections.abc import MutableMapping
+from dataclasses import fields
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from serialization import to_dict, from_dict
+from storage import COLLECTIONS, INDEXED_FIELDS, SORT_FIELDS, MemoryBackend
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process, nothing to coordinate with
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'MWSNAP01'
+SNAPSHOT_FILE = 'snapshot.bin'
+JOURNAL_FILE = 'journal.log'
+# Held for as long as a process has the store open; the store is not shared between processes
+LOCK_FILE = 'lock'
+
+# Journal frame header: payload length and CRC32 of the payload
+FRAME = struct.Struct('<II')
+# Snapshot footer: offset and length of the pickled index, then the magic again
+FOOTER = struct.Struct('<QQ8s')
+
+FSYNC_MODES = ('always', 'batch', 'never')
+
+def _field_names(cls: type) -> Tuple[str, ...]:
+    return tuple(f.name for f in fields(cls))
+
+def _encode(record: Any, names: Tuple[str, ...]) -> bytes:
+    """A record as the pickled list of its to_dict values; field names are stored once per collection"""
+    return pickle.dumps([to_dict(getattr(record, name)) for name in names], protocol=pickle.HIGHEST_PROTOCOL)
+
+def _decode(cls: type, names: Tuple[str, ...], data: bytes) -> Any:
+    return from_dict(cls, dict(zip(names, pickle.loads(data))))
+
+def _layout() -> Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]]:
+    """Indexed and sort fields per collection; saved keys are only reused if this matches"""
+    return {c: (INDEXED_FIELDS[c], SORT_FIELDS[c]) for c in COLLECTIONS}
+
+class SavedCollection:
+    """Column layout of one collection in a mapped snapshot.
+
+    Records are addressed by position: ids, byte ranges of the encoded
+    records, and per field the index keys and sort value the record was
+    filed under when the snapshot was written.
+    """
+
+    def __init__(self, cls: type, buffer: Any, names: Tuple[str, ...], ids: List[str],
+                 offsets: array, lengths: array, index_keys: Dict[str, Tuple[list, array]],
+                 sort_values: Dict[str, list], order: Dict[str, array],
+                 buckets: Dict[str, Tuple[list, array, array]]):
+        self.cls = cls
+        self.buffer = buffer
+        self.names = names
+        self.ids = ids
+        self.positions = dict(zip(ids, range(len(ids))))
+        self.offsets = offsets
+        self.lengths = lengths
+        self.index_keys = index_keys
+        self.sort_values = sort_values
+        self.order = order
+        self.buckets = buckets
+
+    def raw(self, position: int) -> bytes:
+        offset = self.offsets[position]
+        return self.buffer[offset:offset + self.lengths[position]]
+
+    def decode(self, position: int) -> Any:
+        return _decode(self.cls, self.names, self.raw(position))
+
+    def keys_at(self, position: int) -> Tuple[Dict[str, list], Dict[str, str]]:
+        return ({f: list(key_sets[codes[position]]) for f, (key_sets, codes) in self.index_keys.items()},
+                {f: column[position] for f, column in self.sort_values.items()})
+
+    def indexes(self) -> Dict[str, Dict[Any, Dict[str, None]]]:
+        indexes = {}
+        for field, (keys, counts, positions) in self.buckets.items():
+            members = map(self.ids.__getitem__, positions)
+            indexes[field] = {key: dict.fromkeys(islice(members, count)) for key, count in zip(keys, counts)}
+        return indexes
+
+    def sorted_entries(self) -> Dict[str, List[Tuple[str, str]]]:
+        ids = self.ids
+        return {field: list(zip(map(self.sort_values[field].__getitem__, order), map(ids.__getitem__, order)))
+                for field, order in self.order.items()}
+
+class LazyRecords(MutableMapping):
+    """A collection dict whose records are decoded from the snapshot on first access"""
+
+    def __init__(self, saved: SavedCollection):
+        self.saved = saved
+        self._raw = dict(saved.positions)
+        self._records: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def raw(self, record_id: str) -> Optional[bytes]:
+        """Encoded bytes of a record nobody has decoded yet"""
+        position = self._raw.get(record_id)
+        return None if position is None else self.saved.raw(position)
+
+    def __getitem__(self, record_id: str) -> Any:
+        record = self._records.get(record_id)
+        if record is not None:
+            return record
+        with self._lock:
+            record = self._records.get(record_id)
+            if record is None:
+                position = self._raw.pop(record_id, None)
+                if position is None:
+                    raise KeyError(record_id)
+                record = self._records[record_id] = self.saved.decode(position)
+        return record
+
+    def __setitem__(self, record_id: str, record: Any):
+        with self._lock:
+            self._records[record_id] = record
+            self._raw.pop(record_id, None)
+
+    def __delitem__(self, record_id: str):
+        with self._lock:
+            found = self._records.pop(record_id, None) is not None
+            found = self._raw.pop(record_id, None) is not None or found
+        if not found:
+            raise KeyError(record_id)
+
+    def __contains__(self, record_id: object) -> bool:
+        return record_id in self._records or record_id in self._raw
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            ids = list(self._records) + list(self._raw)
+        return iter(ids)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records) + len(self._raw)
+
+    def copy(self) -> 'LazyRecords':
+        """A point-in-time view sharing the mapped snapshot and decoded records"""
+        view = LazyRecords(self.saved)
+        with self._lock:
+            view._raw = self._raw.copy()
+            view._records = self._records.copy()
+        return view
+
+class SavedKeys(MutableMapping):
+    """MemoryBackend._keys for a restored collection.
+
+    Keys of records untouched since the snapshot are read from its
+    columns on demand; keys filed since then live in a plain dict.
+    """
+
+    def __init__(self, saved: SavedCollection):
+        self.saved = saved
+        self._filed: Dict[str, Tuple[Dict[str, list], Dict[str, str]]] = {}
+        # Saved ids that were unfiled or re-filed since the snapshot
+        self._shadowed: set = set()
+
+    def __getitem__(self, record_id: str) -> Tuple[Dict[str, list], Dict[str, str]]:
+        keys = self._filed.get(record_id)
+        if keys is not None:
+            return keys
+        position = self.saved.positions.get(record_id)
+        if position is None or record_id in self._shadowed:
+            raise KeyError(record_id)
+        return self.saved.keys_at(position)
+
+    def __setitem__(self, record_id: str, keys: Tuple[Dict[str, list], Dict[str, str]]):
+        if record_id in self.saved.positions:
+            self._shadowed.add(record_id)
+        self._filed[record_id] = keys
+
+    def __delitem__(self, record_id: str):
+        if self._filed.pop(record_id, None) is not None:
+            return
+        if record_id not in self.saved.positions or record_id in self._shadowed:
+            raise KeyError(record_id)
+        self._shadowed.add(record_id)
+
+    def __iter__(self) -> Iterator[str]:
+        saved = (i for i in self.saved.ids if i not in self._shadowed)
+        return iter(list(self._filed) + list(saved))
+
+    def __len__(self) -> int:
+        return len(self.saved.ids) - len(self._shadowed) + len(self._filed)
+
+    def copy(self) -> 'SavedKeys':
+        view = SavedKeys(self.saved)
+        view._filed = self._filed.copy()
+        view._shadowed = self._shadowed.copy()
+        return view
+
+def write_snapshot(path: str, store: Dict[str, Any], keys: Dict[str, Any],
+                   sorted_entries: Dict[str, Dict[str, List[Tuple[str, str]]]]):
+    """Write every collection plus the index keys, sort values and sort order of a
+    MemoryBackend to path atomically.
+
+    Records still undecoded in a LazyRecords are copied as raw bytes.
+    """
+    temporary = path + '.tmp'
+    index = {'layout': _layout(), 'collections': {}}
+    with open(temporary, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        offset = len(SNAPSHOT_MAGIC)
+        for collection, cls in COLLECTIONS.items():
+            names = _field_names(cls)
+            records = store[collection]
+            record_keys = keys[collection]
+            copy_raw = isinstance(records, LazyRecords) and records.saved.names == names
+            ids, offsets, lengths = [], array('Q'), array('Q')
+            # Per indexed field: distinct key tuples and, per position, which one the record has
+            index_keys = {field: ([], array('I'), {}) for field in INDEXED_FIELDS[collection]}
+            sort_values = {field: [] for field in SORT_FIELDS[collection]}
+            # One object per distinct string, so the pickled index stores repeats once
+            shared: Dict[str, str] = {}
+            share = lambda value: shared.setdefault(value, value) if type(value) is str else value
+            for record_id in list(records):
+                data = records.raw(record_id) if copy_raw else None
+                if data is None:
+                    record = records.get(record_id)
+                    if record is None:
+                        continue
+                    data = _encode(record, names)
+                f.write(data)
+                ids.append(record_id)
+                offsets.append(offset)
+                lengths.append(len(data))
+                offset += len(data)
+                record_index_keys, record_sort_values = record_keys[record_id]
+                for field, (key_sets, codes, lookup) in index_keys.items():
+                    key_set = tuple(map(share, record_index_keys[field]))
+                    code = lookup.get(key_set)
+                    if code is None:
+                        code = lookup[key_set] = len(key_sets)
+                        key_sets.append(key_set)
+                    codes.append(code)
+                for field, column in sort_values.items():
+                    column.append(share(record_sort_values[field]))
+            positions = dict(zip(ids, range(len(ids))))
+            order = {field: array('I', [positions[i] for _, i in entries])
+                     for field, entries in sorted_entries[collection].items()}
+            # Per indexed field: the keys, how many records each holds and their positions grouped by key
+            buckets = {}
+            for field, (key_sets, codes, _) in index_keys.items():
+                groups = defaultdict(list)
+                for position, code in enumerate(codes):
+                    for key in key_sets[code]:
+                        groups[key].append(position)
+                buckets[field] = (list(groups), array('I', map(len, groups.values())),
+                                  array('I', chain.from_iterable(groups.values())))
+            index['collections'][collection] = {
+                'names': names, 'ids': ids, 'offsets': offsets, 'lengths': lengths,
+                'index_keys': {f: (key_sets, codes) for f, (key_sets, codes, _) in index_keys.items()},
+                'sort_values': sort_values, 'order': order, 'buckets': buckets
+            }
+        payload = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(payload)
+        f.write(FOOTER.pack(offset, len(payload), SNAPSHOT_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+def read_snapshot(path: str) -> Tuple[Dict[str, SavedCollection], bool]:
+    """Map a snapshot; also returns whether its saved keys match the current layout"""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError(f'{path} is not a snapshot')
+    index_offset, index_length, magic = FOOTER.unpack(buffer[-FOOTER.size:])
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f'{path} is truncated')
+    index = pickle.loads(buffer[index_offset:index_offset + index_length])
+    collections = {}
+    for collection, cls in COLLECTIONS.items():
+        saved = index['collections'].get(collection)
+        if saved is None:
+            saved = {'names': _field_names(cls), 'ids': [], 'offsets': array('Q'), 'lengths': array('Q'),
+                     'index_keys': {}, 'sort_values': {}, 'order': {}, 'buckets': {}}
+        collections[collection] = SavedCollection(cls, buffer, **saved)
+    return collections, index['layout'] == _layout()
+
+class Journal:
+    """Append-only write-ahead log of backend writes.
+
+    fsync='always' syncs every write before it returns; 'batch' syncs
+    from a background thread every interval seconds; 'never' leaves it
+    to the OS.
+    """
+
+    def __init__(self, path: str, fsync: str = 'batch', interval: float = 1.0):
+        if fsync not in FSYNC_MODES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_MODES)}")
+        self.path = path
+        self.fsync = fsync
+        self.interval = interval
+        self._file = open(path, 'ab')
+        self._lock = threading.Lock()
+        self._dirty = False
+        if fsync == 'batch':
+            threading.Thread(target=self._run_sync, name='journal-sync', daemon=True).start()
+        atexit.register(self.sync)
+
+    @property
+    def size(self) -> int:
+        return self._file.tell()
+
+    def append(self, entry: Tuple[str, str, Any]):
+        payload = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._file.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            if self.fsync == 'always':
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            else:
+                self._dirty = True
+                if self.fsync == 'never':
+                    self._file.flush()
+
+    def sync(self):
+        with self._lock:
+            if self._dirty and not self._file.closed:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def _run_sync(self):
+        while not self._file.closed:
+            time.sleep(self.interval)
+            try:
+                self.sync()
+            except (OSError, ValueError):
+                logger.exception('Failed to sync journal')
+
+    @property
+    def rotated_path(self) -> str:
+        return self.path + '.old'
+
+    def _read(self, path: str) -> Tuple[List[bytes], int, int]:
+        """Intact payloads in a journal file, the length they cover and the file size"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        payloads, position = [], 0
+        while position + FRAME.size <= len(data):
+            length, checksum = FRAME.unpack_from(data, position)
+            payload = data[position + FRAME.size:position + FRAME.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            payloads.append(payload)
+            position += FRAME.size + length
+        return payloads, position, len(data)
+
+    def replay(self) -> Iterator[Tuple[str, str, Any]]:
+        """Entries in write order, starting with a journal rotated out by an unfinished snapshot;
+        a torn or corrupt tail is cut off"""
+        if os.path.exists(self.rotated_path):
+            payloads, _, _ = self._read(self.rotated_path)
+            yield from map(pickle.loads, payloads)
+        payloads, position, size = self._read(self.path)
+        yield from map(pickle.loads, payloads)
+        if position < size:
+            logger.warning('Discarding %d bytes of incomplete journal in %s', size - position, self.path)
+            with self._lock:
+                self._file.truncate(position)
+                self._file.seek(position)
+
+    def rotate(self):
+        """Move the entries so far aside and continue in an empty journal.
+
+        If an earlier rotated journal is still there (its snapshot never
+        finished), the entries are appended to it instead.
+        """
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if os.path.exists(self.rotated_path):
+                with open(self.path, 'rb') as current, open(self.rotated_path, 'ab') as rotated:
+                    rotated.write(current.read())
+                    rotated.flush()
+                    os.fsync(rotated.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+            previous, self._file = self._file, open(self.path, 'ab')
+            previous.close()
+            self._dirty = False
+
+    def discard_rotated(self):
+        """Drop the rotated entries once a snapshot holds everything in them"""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+class PersistentMemoryBackend(MemoryBackend):
+    """MemoryBackend that survives restarts via a snapshot plus a write-ahead journal.
+
+    On open the snapshot is memory-mapped: index and sort keys saved
+    with it are filed directly and records are decoded only when first
+    read. Every put and delete is then appended to the journal, which is
+    replayed on the next start. Once the journal passes snapshot_bytes a
+    new snapshot is written in the background and the journal it covers
+    is dropped.
+    """
+
+    def __init__(self, store: Dict[str, Any], directory: str, fsync: str = 'batch',
+                 interval: float = 1.0, snapshot_bytes: int = 64 * 1024 * 1024):
+        for collection in COLLECTIONS:
+            store[collection] = {}
+        super().__init__(store)
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f'{directory} is already open in another process; '
+                                   'use an SQLite or PostgreSQL STORAGE_URL to share state between workers')
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.snapshot_bytes = snapshot_bytes
+        self._snapshotting = threading.Lock()
+        # Loading creates millions of long-lived objects; collecting midway would only rescan them
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self._load_snapshot()
+            self.journal = Journal(os.path.join(directory, JOURNAL_FILE), fsync, interval)
+            self._replay()
+        finally:
+            if collecting:
+                gc.enable()
+
+    @classmethod
+    def from_url(cls, url: str, store: Dict[str, Any]) -> 'PersistentMemoryBackend':
+        """file://<directory>?fsync=always|batch|never&interval=<s>&snapshot_mb=<n>"""
+        parts = urlsplit(url)
+        options = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        return cls(store, parts.netloc + parts.path,
+                   fsync=options.get('fsync', 'batch'),
+                   interval=float(options.get('interval', 1.0)),
+                   snapshot_bytes=int(float(options.get('snapshot_mb', 64)) * 1024 * 1024))
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        collections, layout_matches = read_snapshot(self.snapshot_path)
+        for collection, saved in collections.items():
+            records = self.store[collection] = LazyRecords(saved)
+            if layout_matches:
+                self.restore(collection, saved.indexes(), saved.sorted_entries(), SavedKeys(saved))
+            else:
+                # Indexed fields changed since the snapshot: decode and file every record
+                with self.bulk():
+                    for record in records.values():
+                        self._index(collection, record)
+
+    def _replay(self):
+        with self.bulk():
+            for op, collection, payload in self.journal.replay():
+                if op == 'put':
+                    MemoryBackend.put_many(self, collection, (from_dict(COLLECTIONS[collection], d) for d in payload))
+                elif op == 'delete':
+                    MemoryBackend.delete(self, collection, payload)
+
+    def put_many(self, collection: str, records: Iterable[Any]):
+        records = list(records)
+        with self._lock:
+            super().put_many(collection, records)
+            self.journal.append(('put', collection, [to_dict(r) for r in records]))
+        self._maybe_snapshot()
+
+    def delete(self, collection: str, record_id: str) -> bool:
+        with self._lock:
+            if not super().delete(collection, record_id):
+                return False
+            self.journal.append(('delete', collection, record_id))
+        self._maybe_snapshot()
+        return True
+
+    def snapshot(self):
+        """Write a snapshot of everything and drop the journal it covers.
+
+        Only copying the collection and index references holds up
+        writers; encoding runs after the journal is rotated, and writes
+        made meanwhile land in the new journal.
+        """
+        with self._snapshotting:
+            with self._lock:
+                store = {c: records.copy() for c, records in self.store.items()}
+                keys = {c: keys.copy() for c, keys in self._keys.items()}
+                sorted_entries = {c: {f: list(entries) for f, entries in fields.items()}
+                                  for c, fields in self.sorted.items()}
+                self.journal.rotate()
+            write_snapshot(self.snapshot_path, store, keys, sorted_entries)
+            self.journal.discard_rotated()
+
+    def _maybe_snapshot(self):
+        if self.journal.size < self.snapshot_bytes or self._snapshotting.locked():
+            return
+        threading.Thread(target=self._background_snapshot, name='snapshot', daemon=True).start()
+
+    def _background_snapshot(self):
+        try:
+            self.snapshot()
+        except OSError:
+            logger.exception('Snapshot failed; the journal is kept')
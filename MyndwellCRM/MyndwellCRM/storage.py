@@ -0,0 +1,620 @@
+import json
+import re
+import threading
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from contextlib import contextmanager
+from copy import copy
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from models import *
+from serialization import to_dict, from_dict
+
+# Model class stored in each collection
+COLLECTIONS = {
+    'companies': Company,
+    'persons': Person,
+    'questions': Question,
+    'survey_templates': SurveyTemplate,
+    'deployments': Deployment,
+    'responses': SurveyResponse,
+    'participants': Participant
+}
+
+# Fields every backend keeps a secondary index on. Audit logs live in the
+# append-only AuditTrail (audit.py), which indexes the same way.
+INDEXED_FIELDS = {
+    'companies': ('status',),
+    'persons': ('company_id', 'email', 'status', 'roles'),
+    'questions': ('type',),
+    'survey_templates': ('status', 'program'),
+    'deployments': ('company_id', 'status'),
+    'responses': ('deployment_id', 'person_id'),
+    'participants': ('deployment_id', 'person_id'),
+    'audit_logs': ('entity_type', 'entity_id', 'action')
+}
+
+# List-valued fields; a record is filed under each element
+LIST_FIELDS = {'roles'}
+
+# Fields each collection can be ordered by for keyset pagination.
+# 'created_at' is the creation time (AuditLog.timestamp for audit logs).
+SORT_FIELDS = {
+    'companies': ('created_at', 'name'),
+    'persons': ('created_at', 'name', 'email'),
+    'questions': ('created_at', 'code'),
+    'survey_templates': ('created_at', 'name'),
+    'deployments': ('created_at', 'name', 'start_date'),
+    'responses': ('created_at',),
+    'participants': ('created_at',),
+    'audit_logs': ('created_at',)
+}
+
+def index_key(field: str, value: Any) -> Any:
+    """Normalize a field value into the form stored in an index"""
+    if isinstance(value, Enum):
+        return value.value
+    if field == 'email' and isinstance(value, str):
+        return value.lower()
+    return value
+
+def _index_keys(field: str, value: Any) -> List[Any]:
+    if field in LIST_FIELDS:
+        return list(dict.fromkeys(value or []))
+    return [index_key(field, value)]
+
+def _created(record: Any) -> Optional[datetime]:
+    return getattr(record, 'created_at', None) or getattr(record, 'timestamp', None)
+
+def sort_value(record: Any, field: str) -> str:
+    """Order-preserving string form of a sort field, shared by every backend and by cursors"""
+    value = _created(record) if field == 'created_at' else getattr(record, field)
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='microseconds')
+    if isinstance(value, Enum):
+        value = value.value
+    return str(value).lower()
+
+class StorageBackend:
+    """Interface the services use to read and write model collections"""
+
+    def get(self, collection: str, record_id: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def all(self, collection: str) -> List[Any]:
+        raise NotImplementedError
+
+    def find(self, collection: str, field: str, value: Any) -> List[Any]:
+        raise NotImplementedError
+
+    def count(self, collection: str, field: Optional[str] = None, value: Any = None) -> int:
+        raise NotImplementedError
+
+    def counts_by(self, collection: str, field: str) -> Dict[Any, int]:
+        raise NotImplementedError
+
+    def page(self, collection: str, filters: Dict[str, Any], sort: str = 'created_at',
+             descending: bool = False, after: Optional[Tuple[str, str]] = None,
+             limit: int = 50) -> List[Any]:
+        """Up to limit records matching every filter, ordered by (sort value, id)
+        and starting strictly after the (sort value, id) cursor"""
+        raise NotImplementedError
+
+    def put(self, collection: str, record: Any):
+        self.put_many(collection, [record])
+
+    def put_many(self, collection: str, records: Iterable[Any]):
+        raise NotImplementedError
+
+    def delete(self, collection: str, record_id: str) -> bool:
+        raise NotImplementedError
+
+    def modify(self, collection: str, record_id: str, change: Callable[[Any], None]) -> Optional[Tuple[Any, Any]]:
+        """Apply change to a stored record and save it, with no other modify()
+        of that record in between; (copy from before, record after), or None
+        if there is no such record"""
+        raise NotImplementedError
+
+    def changes_since(self, cursor: Optional[int]) -> Tuple[int, Optional[List[Tuple[str, str]]]]:
+        """(new cursor, [(collection, record id)]) for writes other processes
+        committed after cursor; None starts from the latest write.
+
+        Changes is None when some were pruned before this process read
+        them. A store private to one process never has any.
+        """
+        return cursor or 0, []
+
+    def claim(self, name: str) -> bool:
+        """True for the first caller only, across every process sharing the store"""
+        raise NotImplementedError
+
+class MemoryBackend(StorageBackend):
+    """Per-process dict storage; records are shared live objects"""
+
+    # A filter bucket smaller than this share of the collection is sorted
+    # directly instead of walking the sorted index
+    SELECTIVE_FILTER_RATIO = 0.25
+    # Locks modify() holds per record, shared by ids that hash alike
+    RECORD_LOCKS = 64
+
+    def __init__(self, store: Dict[str, Dict[str, Any]]):
+        self.store = store
+        self.indexes = {c: {f: defaultdict(dict) for f in INDEXED_FIELDS[c]} for c in COLLECTIONS}
+        # (sort value, id) pairs kept in order for each sortable field
+        self.sorted = {c: {f: [] for f in SORT_FIELDS[c]} for c in COLLECTIONS}
+        # Index and sort keys each record was filed under, so in-place edits can be unfiled
+        self._keys = {c: {} for c in COLLECTIONS}
+        self._claims = set()
+        self._lock = threading.RLock()
+        self._record_locks = [threading.Lock() for _ in range(self.RECORD_LOCKS)]
+        # Sorted-index changes held back during bulk(): per collection and
+        # field, entries to add (ordered set) and entries to drop
+        self._pending: Optional[Dict[str, Dict[str, Tuple[Dict, set]]]] = None
+        with self.bulk():
+            for collection, records in store.items():
+                for record in records.values():
+                    self._index(collection, record)
+
+    @contextmanager
+    def bulk(self):
+        """Hold back sorted-index maintenance for a batch of writes and merge it once at the end"""
+        with self._lock:
+            if self._pending is not None:
+                yield
+                return
+            self._pending = {c: {f: ({}, set()) for f in SORT_FIELDS[c]} for c in COLLECTIONS}
+            try:
+                yield
+            finally:
+                pending, self._pending = self._pending, None
+                for collection, fields in pending.items():
+                    for field, (added, removed) in fields.items():
+                        entries = self.sorted[collection][field]
+                        if removed:
+                            entries[:] = [entry for entry in entries if entry not in removed]
+                        if added:
+                            entries.extend(added)
+                            entries.sort()
+
+    def _file_sorted(self, collection: str, field: str, entry: Tuple[str, str]):
+        if self._pending is None:
+            insort(self.sorted[collection][field], entry)
+            return
+        added, removed = self._pending[collection][field]
+        if entry in removed:
+            removed.discard(entry)
+        else:
+            added[entry] = None
+
+    def _unfile_sorted(self, collection: str, field: str, entry: Tuple[str, str]):
+        if self._pending is not None:
+            added, removed = self._pending[collection][field]
+            if entry in added:
+                del added[entry]
+            else:
+                removed.add(entry)
+            return
+        entries = self.sorted[collection][field]
+        position = bisect_left(entries, entry)
+        if position < len(entries) and entries[position] == entry:
+            del entries[position]
+
+    def restore(self, collection: str, indexes: Dict[str, Dict[Any, Dict[str, None]]],
+                sorted_entries: Dict[str, List[Tuple[str, str]]], keys: Any):
+        """Install index structures saved earlier instead of filing each record"""
+        with self._lock:
+            for field, buckets in indexes.items():
+                self.indexes[collection][field] = defaultdict(dict, buckets)
+            self.sorted[collection].update(sorted_entries)
+            self._keys[collection] = keys
+
+    def _index(self, collection: str, record: Any):
+        keys = {}
+        for field, index in self.indexes[collection].items():
+            keys[field] = _index_keys(field, getattr(record, field))
+            for key in keys[field]:
+                index[key][record.id] = None
+        sort_keys = {}
+        for field in self.sorted[collection]:
+            sort_keys[field] = sort_value(record, field)
+            self._file_sorted(collection, field, (sort_keys[field], record.id))
+        self._keys[collection][record.id] = (keys, sort_keys)
+
+    def _unindex(self, collection: str, record_id: str):
+        keys, sort_keys = self._keys[collection].pop(record_id, ({}, {}))
+        for field, field_keys in keys.items():
+            for key in field_keys:
+                bucket = self.indexes[collection][field].get(key)
+                if bucket is not None:
+                    bucket.pop(record_id, None)
+                    if not bucket:
+                        del self.indexes[collection][field][key]
+        for field, value in sort_keys.items():
+            self._unfile_sorted(collection, field, (value, record_id))
+
+    def get(self, collection: str, record_id: str) -> Optional[Any]:
+        return self.store[collection].get(record_id)
+
+    def all(self, collection: str) -> List[Any]:
+        return list(self.store[collection].values())
+
+    def find(self, collection: str, field: str, value: Any) -> List[Any]:
+        ids = self.indexes[collection][field].get(index_key(field, value), {})
+        records = self.store[collection]
+        return [records[record_id] for record_id in list(ids)]
+
+    def count(self, collection: str, field: Optional[str] = None, value: Any = None) -> int:
+        if field is None:
+            return len(self.store[collection])
+        return len(self.indexes[collection][field].get(index_key(field, value), {}))
+
+    def counts_by(self, collection: str, field: str) -> Dict[Any, int]:
+        return {key: len(ids) for key, ids in self.indexes[collection][field].items()}
+
+    def page(self, collection: str, filters: Dict[str, Any], sort: str = 'created_at',
+             descending: bool = False, after: Optional[Tuple[str, str]] = None,
+             limit: int = 50) -> List[Any]:
+        with self._lock:
+            entries = self.sorted[collection][sort]
+            buckets = sorted((self.indexes[collection][f].get(index_key(f, v), {}) for f, v in filters.items()),
+                             key=len)
+            if buckets and len(buckets[0]) < len(entries) * self.SELECTIVE_FILTER_RATIO:
+                # Few matches: order the smallest bucket rather than walking the whole index
+                sort_keys = self._keys[collection]
+                keyed = sorted(((sort_keys[i][1][sort], i) for i in buckets[0]
+                                if all(i in b for b in buckets[1:])), reverse=descending)
+                if after is not None:
+                    keyed = [k for k in keyed if (k < after if descending else k > after)]
+                ids = [record_id for _, record_id in keyed[:limit]]
+            else:
+                if descending:
+                    end = bisect_left(entries, tuple(after)) if after is not None else len(entries)
+                    walk = (entries[i] for i in range(end - 1, -1, -1))
+                else:
+                    start = bisect_right(entries, tuple(after)) if after is not None else 0
+                    walk = (entries[i] for i in range(start, len(entries)))
+                ids = []
+                for _, record_id in walk:
+                    if all(record_id in b for b in buckets):
+                        ids.append(record_id)
+                        if len(ids) >= limit:
+                            break
+            records = self.store[collection]
+            return [records[record_id] for record_id in ids]
+
+    def put_many(self, collection: str, records: Iterable[Any]):
+        with self._lock:
+            for record in records:
+                self._unindex(collection, record.id)
+                self.store[collection][record.id] = record
+                self._index(collection, record)
+
+    def delete(self, collection: str, record_id: str) -> bool:
+        with self._lock:
+            if self.store[collection].pop(record_id, None) is None:
+                return False
+            self._unindex(collection, record_id)
+            return True
+
+    def modify(self, collection: str, record_id: str, change: Callable[[Any], None]) -> Optional[Tuple[Any, Any]]:
+        with self._record_locks[hash((collection, record_id)) % self.RECORD_LOCKS]:
+            record = self.get(collection, record_id)
+            if record is None:
+                return None
+            before = copy(record)
+            change(record)
+            self.put(collection, record)
+            return before, record
+
+    def claim(self, name: str) -> bool:
+        with self._lock:
+            if name in self._claims:
+                return False
+            self._claims.add(name)
+            return True
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+class SQLBackend(StorageBackend):
+    """Shared SQL storage (SQLite or PostgreSQL) over a pooled SQLAlchemy engine.
+
+    Each collection is one table holding the JSON-encoded record plus
+    indexed columns for the fields in INDEXED_FIELDS and sort_<field>
+    columns for SORT_FIELDS. Sort columns hold sort_value(), never NULL,
+    so a page is a range scan of its (column, id) index. Records
+    returned are detached copies; callers write changes back with put().
+
+    Every write also appends (collection, record id, writer) to a
+    changes table in the same transaction, so other processes sharing
+    the database can tell which of their cached results went stale.
+    Writes commit one at a time (SQLite does so anyway; on PostgreSQL
+    the changes table is locked), so the feed is in commit order.
+    Sequence numbers can skip (PostgreSQL does not reuse those of
+    rolled-back inserts), so pruning records the highest seq it removed
+    in changes_meta, and only a reader behind that point has lost
+    history.
+    """
+
+    # Rows kept in the changes table; a reader further behind rebuilds everything
+    CHANGE_RETENTION = 10000
+    # Writes between prunes of the changes table
+    PRUNE_INTERVAL = 1000
+
+    def __init__(self, url: str, pool_size: int = 5, max_overflow: int = 10, batch_size: int = 500):
+        from sqlalchemy import create_engine, event
+        from sqlalchemy.pool import StaticPool
+
+        options = {'pool_pre_ping': True}
+        is_sqlite = url.startswith('sqlite')
+        if is_sqlite:
+            options['connect_args'] = {'check_same_thread': False}
+        if is_sqlite and (url in ('sqlite://', 'sqlite:///') or ':memory:' in url):
+            options['poolclass'] = StaticPool
+        else:
+            options.update(pool_size=pool_size, max_overflow=max_overflow)
+
+        self.engine = create_engine(url, **options)
+        self.batch_size = batch_size
+        self.is_postgres = self.engine.dialect.name == 'postgresql'
+        # Tags this process's rows in the changes table
+        self.writer = uuid.uuid4().hex
+        self._writes = 0
+        if is_sqlite:
+            event.listen(self.engine, 'connect', _sqlite_pragmas)
+        self._create_schema()
+
+    @staticmethod
+    def _sort_column(field: str) -> str:
+        return 'created_at' if field == 'created_at' else f'sort_{field}'
+
+    def _columns(self, collection: str) -> Tuple[str, ...]:
+        sort_columns = tuple(self._sort_column(f) for f in SORT_FIELDS[collection] if f != 'created_at')
+        return INDEXED_FIELDS[collection] + sort_columns
+
+    def _create_schema(self):
+        from sqlalchemy import inspect, text
+        backfill = []
+        with self.engine.begin() as conn:
+            for collection in COLLECTIONS:
+                columns = self._columns(collection)
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {collection} "
+                    f"(id VARCHAR(64) PRIMARY KEY, created_at VARCHAR(32), data TEXT NOT NULL"
+                    + ''.join(f", {c} VARCHAR(320)" for c in columns) + ")"
+                ))
+                existing = {c['name'] for c in inspect(conn).get_columns(collection)}
+                missing = [c for c in columns if c not in existing]
+                for column in missing:
+                    conn.execute(text(f"ALTER TABLE {collection} ADD COLUMN {column} VARCHAR(320)"))
+                if missing:
+                    backfill.append(collection)
+                # Sort columns are never NULL, so pages compare and order on the
+                # bare (column, id) index; rows written before that get ''
+                conn.execute(text(f"UPDATE {collection} SET created_at = '' WHERE created_at IS NULL"))
+                conn.execute(text(
+                    f"CREATE INDEX IF NOT EXISTS ix_{collection}_created_at ON {collection} (created_at)"
+                ))
+                for field in INDEXED_FIELDS[collection]:
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{collection}_{field} ON {collection} ({field})"
+                    ))
+                for field in SORT_FIELDS[collection]:
+                    column = self._sort_column(field)
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{collection}_{column}_id ON {collection} ({column}, id)"
+                    ))
+            seq = 'seq BIGSERIAL PRIMARY KEY' if self.is_postgres else 'seq INTEGER PRIMARY KEY AUTOINCREMENT'
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS changes ({seq}, collection VARCHAR(32) NOT NULL, "
+                f"record_id VARCHAR(64) NOT NULL, writer VARCHAR(32) NOT NULL)"
+            ))
+            conn.execute(text("CREATE TABLE IF NOT EXISTS changes_meta (name VARCHAR(32) PRIMARY KEY, value BIGINT NOT NULL)"))
+            conn.execute(text("INSERT INTO changes_meta (name, value) VALUES ('pruned_through', 0) "
+                              "ON CONFLICT (name) DO NOTHING"))
+            conn.execute(text("CREATE TABLE IF NOT EXISTS claims (name VARCHAR(64) PRIMARY KEY)"))
+        # Columns added to an existing table are filled in from the stored records
+        for collection in backfill:
+            self.put_many(collection, self.all(collection))
+
+    def _decode(self, collection: str, data: str) -> Any:
+        return from_dict(COLLECTIONS[collection], json.loads(data))
+
+    def _query(self, sql: str, **params) -> List[Any]:
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            return conn.execute(text(sql), params).fetchall()
+
+    @staticmethod
+    def _condition(field: str, value: Any, param: str) -> Tuple[str, Any]:
+        if field in LIST_FIELDS:
+            key = re.sub(r'([\\%_])', r'\\\1', str(value))
+            return f"{field} LIKE :{param} ESCAPE '\\'", f"%,{key},%"
+        return f"{field} = :{param}", index_key(field, value)
+
+    def get(self, collection: str, record_id: str) -> Optional[Any]:
+        rows = self._query(f"SELECT data FROM {collection} WHERE id = :id", id=record_id)
+        return self._decode(collection, rows[0][0]) if rows else None
+
+    def all(self, collection: str) -> List[Any]:
+        rows = self._query(f"SELECT data FROM {collection} ORDER BY created_at, id")
+        return [self._decode(collection, row[0]) for row in rows]
+
+    def find(self, collection: str, field: str, value: Any) -> List[Any]:
+        condition, param = self._condition(field, value, 'value')
+        rows = self._query(
+            f"SELECT data FROM {collection} WHERE {condition} ORDER BY created_at, id", value=param
+        )
+        return [self._decode(collection, row[0]) for row in rows]
+
+    def count(self, collection: str, field: Optional[str] = None, value: Any = None) -> int:
+        if field is None:
+            return self._query(f"SELECT COUNT(*) FROM {collection}")[0][0]
+        condition, param = self._condition(field, value, 'value')
+        return self._query(f"SELECT COUNT(*) FROM {collection} WHERE {condition}", value=param)[0][0]
+
+    def counts_by(self, collection: str, field: str) -> Dict[Any, int]:
+        if field in LIST_FIELDS:
+            counts: Dict[Any, int] = defaultdict(int)
+            for (value,) in self._query(f"SELECT {field} FROM {collection}"):
+                for key in filter(None, (value or '').split(',')):
+                    counts[key] += 1
+            return dict(counts)
+        rows = self._query(f"SELECT {field}, COUNT(*) FROM {collection} GROUP BY {field}")
+        return {key: count for key, count in rows}
+
+    def page(self, collection: str, filters: Dict[str, Any], sort: str = 'created_at',
+             descending: bool = False, after: Optional[Tuple[str, str]] = None,
+             limit: int = 50) -> List[Any]:
+        column = self._sort_column(sort)
+        conditions, params = [], {'limit': limit}
+        for position, (field, value) in enumerate(filters.items()):
+            condition, params[f'f{position}'] = self._condition(field, value, f'f{position}')
+            conditions.append(condition)
+        if after is not None:
+            op = '<' if descending else '>'
+            conditions.append(f"({column}, id) {op} (:after_value, :after_id)")
+            params['after_value'], params['after_id'] = after
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        direction = 'DESC' if descending else 'ASC'
+        rows = self._query(
+            f"SELECT data FROM {collection} {where} "
+            f"ORDER BY {column} {direction}, id {direction} LIMIT :limit", **params
+        )
+        return [self._decode(collection, row[0]) for row in rows]
+
+    def _row(self, collection: str, record: Any) -> Dict[str, Any]:
+        row = {
+            'id': record.id,
+            'created_at': sort_value(record, 'created_at'),
+            'data': json.dumps(to_dict(record))
+        }
+        for field in INDEXED_FIELDS[collection]:
+            if field in LIST_FIELDS:
+                row[field] = ',' + ','.join(_index_keys(field, getattr(record, field))) + ','
+            else:
+                row[field] = index_key(field, getattr(record, field))
+        for field in SORT_FIELDS[collection]:
+            if field != 'created_at':
+                row[self._sort_column(field)] = sort_value(record, field)
+        return row
+
+    def _upsert(self, collection: str):
+        from sqlalchemy import text
+        columns = ('id', 'created_at', 'data') + self._columns(collection)
+        return text(
+            f"INSERT INTO {collection} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(':' + c for c in columns)}) "
+            f"ON CONFLICT (id) DO UPDATE SET "
+            + ', '.join(f"{c} = excluded.{c}" for c in columns[1:])
+        )
+
+    def put_many(self, collection: str, records: Iterable[Any]):
+        sql = self._upsert(collection)
+        batch = []
+        with self._write() as conn:
+            for record in records:
+                batch.append(self._row(collection, record))
+                if len(batch) >= self.batch_size:
+                    self._execute_batch(conn, sql, collection, batch)
+                    batch = []
+            if batch:
+                self._execute_batch(conn, sql, collection, batch)
+
+    def _execute_batch(self, conn, sql, collection: str, batch: List[Dict[str, Any]]):
+        conn.execute(sql, batch)
+        self._record_changes(conn, collection, [row['id'] for row in batch])
+
+    def delete(self, collection: str, record_id: str) -> bool:
+        from sqlalchemy import text
+        with self._write() as conn:
+            result = conn.execute(text(f"DELETE FROM {collection} WHERE id = :id"), {'id': record_id})
+            if result.rowcount:
+                self._record_changes(conn, collection, [record_id])
+            return result.rowcount > 0
+
+    def modify(self, collection: str, record_id: str, change: Callable[[Any], None]) -> Optional[Tuple[Any, Any]]:
+        from sqlalchemy import text
+        with self._write() as conn:
+            if self.is_postgres:
+                select = f"SELECT data FROM {collection} WHERE id = :id FOR UPDATE"
+            else:
+                # Writing first takes SQLite's write lock before the read, not after
+                conn.execute(text(f"UPDATE {collection} SET id = id WHERE id = :id"), {'id': record_id})
+                select = f"SELECT data FROM {collection} WHERE id = :id"
+            row = conn.execute(text(select), {'id': record_id}).fetchone()
+            if row is None:
+                return None
+            record = self._decode(collection, row[0])
+            before = copy(record)
+            change(record)
+            self._execute_batch(conn, self._upsert(collection), collection, [self._row(collection, record)])
+            return before, record
+
+    @contextmanager
+    def _write(self):
+        """Transaction for a write; on PostgreSQL it waits for other writers to commit first"""
+        from sqlalchemy import text
+        with self.engine.begin() as conn:
+            if self.is_postgres:
+                conn.execute(text("LOCK TABLE changes IN SHARE ROW EXCLUSIVE MODE"))
+            yield conn
+        self._writes += 1
+        if self._writes % self.PRUNE_INTERVAL == 0:
+            with self.engine.begin() as conn:
+                cutoff = conn.execute(text("SELECT MAX(seq) FROM changes")).scalar()
+                if cutoff is not None and cutoff > self.CHANGE_RETENTION:
+                    cutoff -= self.CHANGE_RETENTION
+                    conn.execute(text("DELETE FROM changes WHERE seq <= :cutoff"), {'cutoff': cutoff})
+                    conn.execute(text("UPDATE changes_meta SET value = :cutoff "
+                                      "WHERE name = 'pruned_through' AND value < :cutoff"), {'cutoff': cutoff})
+
+    def _record_changes(self, conn, collection: str, record_ids: List[str]):
+        from sqlalchemy import text
+        conn.execute(text("INSERT INTO changes (collection, record_id, writer) VALUES (:collection, :record_id, :writer)"),
+                     [{'collection': collection, 'record_id': i, 'writer': self.writer} for i in record_ids])
+
+    def changes_since(self, cursor: Optional[int]) -> Tuple[int, Optional[List[Tuple[str, str]]]]:
+        if cursor is None:
+            return self._query("SELECT COALESCE(MAX(seq), 0) FROM changes")[0][0], []
+        from sqlalchemy import text
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT seq, collection, record_id, writer FROM changes WHERE seq > :cursor ORDER BY seq"
+            ), {'cursor': cursor}).fetchall()
+            # Read after the rows, so a prune that raced with them is seen too
+            pruned = conn.execute(text("SELECT value FROM changes_meta WHERE name = 'pruned_through'")).scalar()
+        if pruned is not None and pruned > cursor:
+            return max([pruned] + [row[0] for row in rows[-1:]]), None
+        if not rows:
+            return cursor, []
+        return rows[-1][0], [(collection, record_id) for _, collection, record_id, writer in rows
+                             if writer != self.writer]
+
+    def claim(self, name: str) -> bool:
+        from sqlalchemy import text
+        from sqlalchemy.exc import IntegrityError
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text("INSERT INTO claims (name) VALUES (:name)"), {'name': name})
+            return True
+        except IntegrityError:
+            return False
+
+def create_backend(url: str = 'memory', store: Optional[Dict[str, Dict[str, Any]]] = None) -> StorageBackend:
+    """Build a backend from a storage URL: 'memory', 'file://<directory>' for a
+    memory store persisted by snapshot and journal, or an SQLAlchemy database URL"""
+    if url == 'memory':
+        return MemoryBackend(store if store is not None else {c: {} for c in COLLECTIONS})
+    if url.startswith('file:'):
+        from snapshot import PersistentMemoryBackend
+        return PersistentMemoryBackend.from_url(url, store if store is not None else {})
+    return SQLBackend(url)
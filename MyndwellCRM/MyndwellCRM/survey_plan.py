@@ -0,0 +1,348 @@
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Pattern, Set, Tuple
+from models import *
+
+# Branch target that ends the survey, and branching key taken by any answer without its own entry
+END = 'end'
+FALLBACK = '*'
+
+class SurveyPlanError(ValueError):
+    """Raised when a survey's branching or validation rules cannot be compiled"""
+
+def _unanswered(answer: Any) -> bool:
+    return answer in (None, '', [])
+
+@dataclass(frozen=True)
+class PlannedQuestion:
+    """One question of a compiled survey, with everything answering it needs resolved.
+
+    min_value/max_value bound the bank's QuestionChoice.weight for SINGLE
+    and SCALE (out-of-range choices are simply not accepted), the number of
+    selections for MULTI and the text length for FREE. branches maps a
+    choice code to the position answered next; any other answer, or
+    none, goes to fallback. A position equal to the plan's length ends it.
+    """
+    question: Question
+    position: int
+    section: str
+    required: bool
+    accepted: frozenset
+    weights: Mapping[str, float]
+    pattern: Optional[Pattern]
+    min_value: Optional[int]
+    max_value: Optional[int]
+    branches: Mapping[str, int]
+    fallback: int
+
+    @property
+    def id(self) -> str:
+        return self.question.id
+
+    def normalize(self, answer: Any) -> Any:
+        """Validate one submitted answer, returning its stored form (None or [] when unanswered)"""
+        question = self.question
+        if question.type == QuestionType.MULTI:
+            selected = list(dict.fromkeys(answer if isinstance(answer, list) else [answer] if answer else []))
+            invalid = [code for code in selected if code not in self.accepted]
+            if invalid:
+                raise ValueError(f"Invalid choice(s) for {question.code}: {', '.join(map(str, invalid))}")
+            if selected and not self._within(len(selected)):
+                raise ValueError(f"{question.code} needs {self._bounds('selections')}")
+            return selected
+        if answer in (None, ''):
+            return None
+        if question.type == QuestionType.FREE:
+            text = str(answer).strip()
+            if self.pattern is not None and not self.pattern.fullmatch(text):
+                raise ValueError(f"Answer to {question.code} is not in the expected format")
+            if not self._within(len(text)):
+                raise ValueError(f"Answer to {question.code} needs {self._bounds('characters')}")
+            return text
+        if answer not in self.accepted:
+            raise ValueError(f"Invalid choice for {question.code}: {answer}")
+        return answer
+
+    def _within(self, value: int) -> bool:
+        return (self.min_value is None or value >= self.min_value) and \
+            (self.max_value is None or value <= self.max_value)
+
+    def _bounds(self, unit: str) -> str:
+        if self.min_value is not None and self.max_value is not None:
+            return f'{self.min_value} to {self.max_value} {unit}'
+        return f'at least {self.min_value} {unit}' if self.min_value is not None else f'at most {self.max_value} {unit}'
+
+    def next_position(self, answer: Any) -> int:
+        """Position answered after this question given its normalized answer"""
+        if _unanswered(answer):
+            return self.fallback
+        if isinstance(answer, list):
+            return next((self.branches[code] for code in answer if code in self.branches), self.fallback)
+        return self.branches.get(answer, self.fallback)
+
+    def score(self, answer: Any) -> Optional[float]:
+        """Sum of the weights of the chosen codes, or None if none carries a weight"""
+        codes = answer if isinstance(answer, list) else [answer]
+        weights = [self.weights[code] for code in codes if code in self.weights]
+        return sum(weights) if weights else None
+
+@dataclass(frozen=True)
+class SurveyPlan:
+    """Immutable execution plan of a survey template.
+
+    Questions are resolved from the bank once, in survey order, with
+    their regexes compiled, weights merged (SurveyQuestion.weights over
+    QuestionChoice.weight) and branch targets turned into positions.
+    The branching graph is checked for cycles at compile time; questions
+    no path reaches are listed in unreachable, and referenced questions
+    missing from the bank in missing.
+    """
+    template_id: str
+    version: str
+    questions: Tuple[PlannedQuestion, ...]
+    positions: Mapping[str, int]
+    unreachable: Tuple[str, ...]
+    missing: Tuple[str, ...]
+
+    def get(self, question_id: str) -> Optional[PlannedQuestion]:
+        position = self.positions.get(question_id)
+        return self.questions[position] if position is not None else None
+
+    def first(self) -> Optional[PlannedQuestion]:
+        return self.questions[0] if self.questions else None
+
+    def next_question(self, question_id: str, answer: Any) -> Optional[PlannedQuestion]:
+        """Question to ask after answering question_id with answer, or None at the end"""
+        planned = self.get(question_id)
+        if planned is None:
+            raise ValueError(f'Unknown question: {question_id}')
+        position = planned.next_position(planned.normalize(answer))
+        return self.questions[position] if position < len(self.questions) else None
+
+    def evaluate(self, answers: Dict[str, Any]) -> Dict[str, Any]:
+        """Validated answers along the branch path the answers take; off-path answers are dropped"""
+        unknown = set(answers) - set(self.positions)
+        if unknown:
+            raise ValueError(f"Unknown question(s): {', '.join(sorted(unknown))}")
+        normalized = {}
+        position = 0
+        while position < len(self.questions):
+            planned = self.questions[position]
+            answer = planned.normalize(answers.get(planned.id))
+            if _unanswered(answer):
+                if planned.required:
+                    raise ValueError(f"{planned.question.code} requires an answer")
+            else:
+                normalized[planned.id] = answer
+            position = planned.next_position(answer)
+        return normalized
+
+    def path(self, answers: Dict[str, Any]) -> List[PlannedQuestion]:
+        """Questions asked given normalized answers, in order"""
+        path, position = [], 0
+        while position < len(self.questions):
+            planned = self.questions[position]
+            path.append(planned)
+            position = planned.next_position(answers.get(planned.id))
+        return path
+
+    def scores(self, answers: Dict[str, Any]) -> Dict[str, float]:
+        """Weighted score per section of normalized answers"""
+        scores: Dict[str, float] = {}
+        for question_id, answer in answers.items():
+            planned = self.get(question_id)
+            score = planned.score(answer) if planned is not None else None
+            if score is not None:
+                scores[planned.section] = scores.get(planned.section, 0.0) + score
+        return scores
+
+    def to_dict(self) -> Dict[str, Any]:
+        def target(position: int) -> str:
+            return self.questions[position].id if position < len(self.questions) else END
+
+        return {
+            'template_id': self.template_id,
+            'version': self.version,
+            'questions': [{
+                'question_id': p.id,
+                'code': p.question.code,
+                'section': p.section,
+                'required': p.required,
+                'weights': dict(p.weights),
+                'branches': {code: target(position) for code, position in p.branches.items()},
+                'next': target(p.fallback)
+            } for p in self.questions],
+            'unreachable': list(self.unreachable),
+            'missing': list(self.missing)
+        }
+
+def _find_cycle(edges: List[Set[int]]) -> Optional[List[int]]:
+    """Positions forming a cycle in the branching graph, if there is one"""
+    state = [0] * len(edges)  # 0 unvisited, 1 on the current path, 2 done
+    for root in range(len(edges)):
+        if state[root]:
+            continue
+        stack = [(root, iter(sorted(edges[root])))]
+        path = [root]
+        state[root] = 1
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                path.pop()
+                state[node] = 2
+            elif state[child] == 1:
+                return path[path.index(child):] + [child]
+            elif state[child] == 0:
+                state[child] = 1
+                path.append(child)
+                stack.append((child, iter(sorted(edges[child]))))
+    return None
+
+def compile_survey(template: SurveyTemplate, questions: Mapping[str, Question]) -> SurveyPlan:
+    """Resolve a template against the question bank and check its rules, raising SurveyPlanError"""
+    ordered = sorted(template.questions, key=lambda sq: sq.order)
+    present = [sq for sq in ordered if sq.question_id in questions]
+    missing = tuple(sq.question_id for sq in ordered if sq.question_id not in questions)
+    positions: Dict[str, int] = {}
+    for sq in present:
+        if sq.question_id in positions:
+            raise SurveyPlanError(f'{questions[sq.question_id].code} appears more than once')
+        positions[sq.question_id] = len(positions)
+    by_code = {questions[sq.question_id].code: positions[sq.question_id] for sq in present}
+    end = len(present)
+
+    def resolve(source: Question, target: Any) -> int:
+        if target == END:
+            return end
+        position = positions.get(target, by_code.get(target))
+        if position is None:
+            raise SurveyPlanError(f'{source.code} branches to {target}, which is not in this survey')
+        return position
+
+    planned = []
+    for position, sq in enumerate(present):
+        question = questions[sq.question_id]
+        validation = question.validation
+        codes = {c.code for c in question.choices}
+        unknown = sorted(set(sq.weights) - codes)
+        if unknown:
+            raise SurveyPlanError(f"{question.code} weights unknown choice(s): {', '.join(unknown)}")
+        accepted = frozenset(codes)
+        if question.type in (QuestionType.SINGLE, QuestionType.SCALE):
+            accepted = frozenset(c.code for c in question.choices if c.weight is None or (
+                (validation.min_value is None or c.weight >= validation.min_value) and
+                (validation.max_value is None or c.weight <= validation.max_value)))
+        weights = {c.code: float(c.weight) for c in question.choices if c.weight is not None}
+        weights.update({code: float(weight) for code, weight in sq.weights.items()})
+        pattern = None
+        if validation.regex and question.type == QuestionType.FREE:
+            try:
+                pattern = re.compile(validation.regex)
+            except re.error as e:
+                raise SurveyPlanError(f'{question.code} has an invalid format pattern: {e}')
+        branches, fallback = {}, position + 1
+        for code, target in sq.branching.items():
+            if code == FALLBACK:
+                fallback = resolve(question, target)
+            elif code in codes:
+                branches[code] = resolve(question, target)
+            else:
+                raise SurveyPlanError(f'{question.code} branches on unknown choice {code}')
+        bounded = question.type in (QuestionType.MULTI, QuestionType.FREE)
+        planned.append(PlannedQuestion(
+            question=question, position=position, section=sq.section, required=validation.required,
+            accepted=accepted, weights=MappingProxyType(weights), pattern=pattern,
+            min_value=validation.min_value if bounded else None, max_value=validation.max_value if bounded else None,
+            branches=MappingProxyType(branches), fallback=fallback))
+
+    edges = [{p.fallback, *p.branches.values()} - {end} for p in planned]
+    cycle = _find_cycle(edges)
+    if cycle:
+        raise SurveyPlanError('Branching loops back: ' + ' -> '.join(planned[p].question.code for p in cycle))
+    reached, frontier = set(), [0] if planned else []
+    while frontier:
+        position = frontier.pop()
+        if position not in reached:
+            reached.add(position)
+            frontier.extend(edges[position])
+    unreachable = tuple(p.id for p in planned if p.position not in reached)
+    return SurveyPlan(template_id=template.id, version=template.version, questions=tuple(planned),
+                      positions=MappingProxyType(positions), unreachable=unreachable, missing=missing)
+
+class SurveyPlanCache:
+    """Compiled survey plans keyed by template id and version.
+
+    A plan is compiled on first use and reused while the template's
+    version is unchanged. Writes to the template or to any question it
+    references (including a missing one being created) drop the plan, so
+    edits that keep the version string are picked up too.
+    """
+
+    def __init__(self, load_question: Callable[[str], Optional[Question]]):
+        self.load_question = load_question
+        self._lock = threading.Lock()
+        self._plans: Dict[str, SurveyPlan] = {}
+        self._templates_by_question: Dict[str, Set[str]] = defaultdict(set)
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template: SurveyTemplate) -> SurveyPlan:
+        with self._lock:
+            plan = self._plans.get(template.id)
+            if plan is not None and plan.version == template.version:
+                self.hits += 1
+                return plan
+            self.misses += 1
+            generation = self._generation
+        questions = {}
+        for sq in template.questions:
+            question = self.load_question(sq.question_id)
+            if question is not None:
+                questions[sq.question_id] = question
+        plan = compile_survey(template, questions)
+        with self._lock:
+            # A write while compiling may have made this plan stale already
+            if self._generation == generation:
+                self._plans[template.id] = plan
+                for sq in template.questions:
+                    self._templates_by_question[sq.question_id].add(template.id)
+        return plan
+
+    def invalidate(self, template_id: Optional[str] = None):
+        with self._lock:
+            self._generation += 1
+            if template_id is None:
+                self._plans.clear()
+                self._templates_by_question.clear()
+            else:
+                self._plans.pop(template_id, None)
+
+    def invalidate_question(self, question_id: str):
+        with self._lock:
+            self._generation += 1
+            for template_id in self._templates_by_question.pop(question_id, ()):
+                self._plans.pop(template_id, None)
+
+    def on_write(self, collection: str, before: Optional[Any], after: Optional[Any]):
+        """Write listener"""
+        if collection == 'survey_templates' and before is not None:
+            self.invalidate(before.id)
+        elif collection == 'questions':
+            self.invalidate_question((before or after).id)
+
+    def on_remote_write(self, collection: str, record_id: str):
+        """Sync listener"""
+        if collection == 'survey_templates':
+            self.invalidate(record_id)
+        elif collection == 'questions':
+            self.invalidate_question(record_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'plans': len(self._plans)}
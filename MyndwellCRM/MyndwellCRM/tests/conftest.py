@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+# Importing the app must not start the flusher, email workers or scheduler,
+# nor write audit segments or emails into the source tree
+os.environ.setdefault('BACKGROUND_TASKS', '0')
+os.environ.setdefault('STORAGE_URL', 'memory')
+os.environ.setdefault('AUDIT_LOG_DIR', tempfile.mkdtemp(prefix='myndwell-audit-'))
+os.environ.setdefault('EMAIL_OUTBOX_DIR', tempfile.mkdtemp(prefix='myndwell-outbox-'))
+
+import pytest
+import data_store
+from models import *
+
+def _empty_store():
+    for records in data_store.data_store.values():
+        records.clear()
+    data_store.configure_storage('memory')
+
+@pytest.fixture
+def store():
+    """An empty in-memory store behind every service"""
+    # The app seeds sample data when first imported, so import it before emptying
+    import app
+    _empty_store()
+    yield data_store
+    _empty_store()
+
+@pytest.fixture
+def company(store):
+    return data_store.CompanyService.create(Company(id='', name='Acme', domains=['acme.com'], status='active'))
+
+@pytest.fixture
+def client(store):
+    from app import app
+    return app.test_client()
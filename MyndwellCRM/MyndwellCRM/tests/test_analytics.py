@@ -0,0 +1,62 @@
+import pytest
+from analytics import ResponseAnalytics
+from data_store import (DeploymentService, PersonService, QuestionService, ReportService, ResponseService,
+                        SurveyTemplateService)
+from models import *
+
+MOOD = Question(id='q1', code='MOOD', text='Mood', type=QuestionType.SCALE,
+                choices=[QuestionChoice(code=c, label=c.upper(), weight=float(w)) for c, w in (('a', 1), ('b', 2), ('c', 3))])
+
+def person(person_id: str, department: str) -> Person:
+    return Person(id=person_id, company_id='c1', email=f'{person_id}@acme.com', name=person_id, roles=['user'],
+                  status=UserStatus.ACTIVE, metadata={'department': department})
+
+def response(response_id: str, person_id: str, answer: str, deployment_id: str = 'd1') -> SurveyResponse:
+    return SurveyResponse(id=response_id, deployment_id=deployment_id, person_id=person_id, answers={'q1': answer})
+
+@pytest.fixture
+def analytics():
+    persons = {p.id: p for p in (person('p1', 'Sales'), person('p2', 'Sales'), person('p3', 'Ops'))}
+    analytics = ResponseAnalytics(capacity=2)
+    analytics.load([response('r1', 'p1', 'a'), response('r2', 'p2', 'c'), response('r3', 'p3', 'b', 'd2')],
+                   persons, {'q1': MOOD}, {'d2': {'q1': {'a': 10.0, 'b': 20.0, 'c': 30.0}}})
+    return analytics
+
+def test_crosstab_groups_counts_and_scores(analytics):
+    table = analytics.crosstab(MOOD, ['department'])
+    assert table.columns == ['department', 'responses', 'A', 'B', 'C', 'mean', 'stddev']
+    # d2 scores with its survey plan's weights, d1 with the bank's
+    assert table.rows == [['Ops', 1, 0, 1, 0, 20.0, 0.0], ['Sales', 2, 1, 0, 1, 2.0, 1.0]]
+    assert analytics.crosstab(MOOD, [], {'deployment': ['d1']}).rows == [[2, 1, 0, 1, 2.0, 1.0]]
+
+def test_resubmissions_overwrite_and_deletions_mask(analytics):
+    analytics.upsert(response('r1', 'p1', 'c'), person('p1', 'Sales'), {'q1': MOOD}, {})
+    analytics.remove('r3')
+    analytics.upsert(response('r4', 'p4', 'a'), None, {'q1': MOOD}, {})
+    table = analytics.crosstab(MOOD, ['department'])
+    assert table.rows == [['Sales', 2, 0, 0, 2, 3.0, 0.0], [None, 1, 1, 0, 0, 1.0, 0.0]]
+
+def test_crosstab_means_agree_with_survey_results(company):
+    QuestionService.create(Question(id='q1', code='MOOD', text='Mood', type=QuestionType.SCALE,
+                                    choices=[QuestionChoice(code=c.code, label=c.label, weight=c.weight)
+                                             for c in MOOD.choices]))
+    template = SurveyTemplateService.create(SurveyTemplate(
+        id='', name='Pulse', version='1', program='wellbeing', status=SurveyStatus.READY,
+        questions=[SurveyQuestion(id='sq1', survey_template_id='', question_id='q1', order=1, section='Mood',
+                                  weights={'a': 5.0, 'c': 15.0})]))
+    deployment = DeploymentService.create(Deployment(id='', company_id=company.id, survey_template_id=template.id,
+                                                     name='Pulse', status=DeploymentStatus.ACTIVE, audience_type='all'))
+    for i, answer in enumerate('acb'):
+        someone = PersonService.create(Person(id='', company_id=company.id, email=f'p{i}@acme.com', name=f'P{i}',
+                                              roles=['user'], status=UserStatus.ACTIVE))
+        ResponseService.submit(deployment.id, someone.id, {'q1': answer})
+
+    def means():
+        crosstab = ReportService.crosstab('q1').to_dicts()[0]['mean']
+        return crosstab, ResponseService.get_results(deployment.id).to_dict()['questions'][0]['mean']
+
+    assert means() == (7.3333, 7.3333)
+    questions = [SurveyQuestion(id='sq1', survey_template_id=template.id, question_id='q1', order=1,
+                                section='Mood', weights={})]
+    SurveyTemplateService.update(template.id, {'questions': questions})
+    assert means() == (2.0, 2.0)
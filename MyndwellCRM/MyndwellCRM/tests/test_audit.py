@@ -0,0 +1,109 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+from audit import SEGMENT_SUFFIX, SIDECAR_SUFFIX, AuditTrail, Location
+from models import *
+
+class Clock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        self.now += timedelta(milliseconds=1)
+        return self.now
+
+def context():
+    return 'tester', '127.0.0.1', 'pytest'
+
+def make_trail(directory, clock=None, **options) -> AuditTrail:
+    options.setdefault('refresh_interval', 0)
+    return AuditTrail(str(directory), context=context, clock=clock or Clock(datetime(2024, 1, 1)), **options)
+
+def files(directory, suffix):
+    return sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+
+def record_many(trail, count, entity_type='company'):
+    return [trail.record('update', entity_type, f'{entity_type}-{i % 5}', {'name': [str(i), str(i + 1)]})
+            for i in range(count)]
+
+def test_entries_survive_a_restart_across_segments(tmp_path):
+    trail = make_trail(tmp_path, segment_max_bytes=2000)
+    written = []
+    for _ in range(6):
+        written += record_many(trail, 10)
+        trail.flush()
+    assert len(files(tmp_path, SEGMENT_SUFFIX)) > 2
+    # Every segment but the one being appended to has a sidecar index
+    assert len(files(tmp_path, SIDECAR_SUFFIX)) == len(files(tmp_path, SEGMENT_SUFFIX)) - 1
+    # Written entries are held only as their locations
+    assert all(isinstance(trail._where[e.id], Location) for e in written)
+
+    reopened = make_trail(tmp_path, segment_max_bytes=2000)
+    assert [e.id for e in reopened.all()] == [e.id for e in written]
+    history = reopened.get_by_entity('company', 'company-3')
+    assert [e.id for e in history] == [e.id for e in written if e.entity_id == 'company-3']
+    assert history[0].diff == {'name': ['3', '4']} and history[0].actor == 'tester'
+
+def test_pages_filter_and_window_by_time(tmp_path):
+    trail = make_trail(tmp_path)
+    companies = record_many(trail, 8)
+    users = record_many(trail, 4, 'user')
+    trail.flush()
+    pending = record_many(trail, 3, 'user')
+
+    page = trail.page('audit_logs', {'entity_type': 'user'}, descending=True, limit=5)
+    assert [e.id for e in page] == [e.id for e in reversed(users + pending)][:5]
+    start, end = companies[2].timestamp, companies[6].timestamp
+    assert trail.count(start, end) == 4
+    assert [e.id for e in trail.window(start, end).page('audit_logs', {'action': 'update'})] == \
+        [e.id for e in companies[2:6]]
+
+def test_expiry_deletes_whole_segments_past_retention(tmp_path):
+    clock = Clock(datetime(2023, 1, 1))
+    trail = make_trail(tmp_path, clock, segment_max_bytes=1000, retention_days=30)
+    old = record_many(trail, 20)
+    trail.flush()
+    old += record_many(trail, 20)
+    trail.flush()
+    clock.now = datetime(2024, 1, 1)
+    new = record_many(trail, 20)
+    trail.flush()
+    new += record_many(trail, 20)
+    trail.flush()
+    trail.compact()
+    assert [e.id for e in trail.all()] == [e.id for e in new]
+    assert [e.id for e in make_trail(tmp_path, clock, retention_days=30).all()] == [e.id for e in new]
+
+def test_a_torn_tail_is_skipped_and_not_appended_to(tmp_path):
+    trail = make_trail(tmp_path)
+    first = record_many(trail, 3)
+    trail.flush()
+    with open(tmp_path / files(tmp_path, SEGMENT_SUFFIX)[-1], 'ab') as f:
+        f.write(b'{"id": "torn')
+    reopened = make_trail(tmp_path, Clock(datetime(2024, 2, 1)))
+    assert [e.id for e in reopened.all()] == [e.id for e in first]
+    second = record_many(reopened, 2)
+    reopened.flush()
+    assert len(files(tmp_path, SEGMENT_SUFFIX)) == 2
+    assert [e.id for e in make_trail(tmp_path).all()] == [e.id for e in first + second]
+
+def test_workers_sharing_a_directory_list_each_others_entries(tmp_path):
+    one, two = make_trail(tmp_path), make_trail(tmp_path)
+    mine = record_many(one, 3)
+    one.flush()
+    theirs = record_many(two, 2, 'user')
+    two.flush()
+    expected = sorted(e.id for e in mine + theirs)
+    assert sorted(e.id for e in one.all()) == expected
+    assert sorted(e.id for e in two.all()) == expected
+    assert [e.id for e in one.get_by_entity('user', 'user-1')] == [theirs[1].id]
+
+@pytest.mark.parametrize('collection, entity_type', [('responses', 'response'), ('participants', 'participant')])
+def test_writes_to_every_collection_are_recorded(tmp_path, collection, entity_type):
+    trail = make_trail(tmp_path)
+    record = Company(id='x1', name='Acme', domains=[], status='active')
+    trail.on_write(collection, None, record)
+    trail.on_write(collection, record, Company(id='x1', name='Acme Inc', domains=[], status='active'))
+    actions = [(e.entity_type, e.action, e.diff) for e in trail.get_by_entity(entity_type, 'x1')]
+    assert actions[0][:2] == (entity_type, 'create')
+    assert actions[1] == (entity_type, 'update', {'name': ['Acme', 'Acme Inc']})
@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import sys
+from flask import Flask
+import scheduler
+from audit import AuditTrail
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, threading
+from app import app
+threads = lambda: sorted(t.name for t in threading.enumerate() if t.name != 'MainThread')
+imported = threads()
+app.test_client().get('/api/dashboard')
+print(json.dumps({'imported': imported, 'served': threads(), 'audit': app.config['AUDIT_LOG_DIR'],
+                  'outbox': app.config['EMAIL_OUTBOX_DIR']}))
+'''
+
+def probe(tmp_path, **env):
+    environment = {k: v for k, v in os.environ.items()
+                   if k not in ('BACKGROUND_TASKS', 'AUDIT_LOG_DIR', 'EMAIL_OUTBOX_DIR')}
+    environment.update(LOG_LEVEL='WARNING', **env)
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=tmp_path, env=environment,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def test_threads_start_with_the_first_request(tmp_path):
+    seen = probe(tmp_path, PYTHONPATH=APP_DIR, AUDIT_LOG_DIR=str(tmp_path / 'audit'),
+                 EMAIL_OUTBOX_DIR=str(tmp_path / 'outbox'))
+    assert seen['imported'] == []
+    assert {'audit-flusher', 'deployment-scheduler', 'email-dispatch-0'} <= set(seen['served'])
+    assert (seen['audit'], seen['outbox']) == (str(tmp_path / 'audit'), str(tmp_path / 'outbox'))
+    # Nothing is written relative to the working directory
+    assert sorted(os.listdir(tmp_path)) == ['audit', 'outbox']
+
+def test_background_tasks_can_be_switched_off(tmp_path):
+    seen = probe(tmp_path, PYTHONPATH=APP_DIR, BACKGROUND_TASKS='0', AUDIT_LOG_DIR=str(tmp_path / 'audit'))
+    assert seen['served'] == []
+    assert seen['outbox'] == os.path.join(APP_DIR, 'instance', 'outbox')
+
+def test_init_app_registers_a_first_request_hook():
+    app = Flask(__name__)
+    scheduler.init_app(app)
+    assert scheduler.start_background_tasks in app.before_request_funcs[None]
+    quiet = Flask(__name__)
+    quiet.config['BACKGROUND_TASKS'] = False
+    scheduler.init_app(quiet)
+    assert not quiet.before_request_funcs.get(None)
+
+def test_audit_entries_flush_inline_without_a_flusher(tmp_path):
+    trail = AuditTrail(str(tmp_path), flush_size=3, context=lambda: ('tester', '', ''))
+    for i in range(3):
+        trail.record('create', 'company', f'c{i}', {})
+    assert trail._flusher is None
+    assert [e.entity_id for e in AuditTrail(str(tmp_path)).all()] == ['c0', 'c1', 'c2']
@@ -0,0 +1,107 @@
+import threading
+from collections import Counter
+import pytest
+from data_store import DeploymentService, ParticipantService, PersonService
+from email_dispatch import DispatchEngine, MemoryTransport
+from models import *
+from storage import create_backend
+
+class FlakyTransport(MemoryTransport):
+    """Fails the first `failures` sends to each recipient"""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.attempts = Counter()
+
+    def send(self, message):
+        self.attempts[message.to] += 1
+        if self.attempts[message.to] <= self.failures:
+            raise OSError('relay unavailable')
+        super().send(message)
+
+def make_deployment(company, count: int, max_attempts: int = 1, status=DeploymentStatus.ACTIVE) -> Deployment:
+    PersonService.create_many([Person(id='', company_id=company.id, email=f'user{i}@acme.com', name=f'User {i}',
+                                      roles=['user'], status=UserStatus.ACTIVE) for i in range(count)])
+    return DeploymentService.create(Deployment(
+        id='', company_id=company.id, survey_template_id='t', name='Pulse', status=status, audience_type='all',
+        email_template=EmailTemplate(subject='Hi {{name}}', body='Answer at {{survey_link}}'),
+        max_attempts=max_attempts))
+
+def run(engine: DispatchEngine, *jobs):
+    engine.start()
+    try:
+        for job in jobs:
+            engine.enqueue_deployment(*job)
+        assert engine.wait_idle(10)
+    finally:
+        engine.stop()
+
+def test_concurrent_sends_invite_everyone_once(company):
+    deployment = make_deployment(company, 30)
+    transport = MemoryTransport()
+    engine = DispatchEngine(transport, workers=4, rate_per_company=1000, burst=1000, render_batch_size=7)
+    run(engine, (deployment.id,), (deployment.id,))
+    assert sorted(m.to for m in transport.sent) == sorted(f'user{i}@acme.com' for i in range(30))
+    assert transport.sent[0].subject.startswith('Hi User')
+    assert DeploymentService.get_by_id(deployment.id).metrics['invites_sent'] == 30
+    assert ParticipantService.status_counts(deployment.id)['invite_status'] == {'sent': 30}
+
+    # Sending again only reaches people not invited yet
+    PersonService.create(Person(id='', company_id=company.id, email='late@acme.com', name='Late',
+                                roles=['user'], status=UserStatus.ACTIVE))
+    run(engine, (deployment.id,))
+    assert [m.to for m in transport.sent[30:]] == ['late@acme.com']
+
+def test_failed_sends_are_retried_up_to_max_attempts(company):
+    deployment = make_deployment(company, 3, max_attempts=2)
+    transport = FlakyTransport(failures=1)
+    run(DispatchEngine(transport, workers=2, backoff_base=0.01), (deployment.id,))
+    assert len(transport.sent) == 3
+    assert 'invites_failed' not in DeploymentService.get_by_id(deployment.id).metrics
+
+def test_sends_give_up_after_max_attempts(company):
+    deployment = make_deployment(company, 1, max_attempts=2)
+    transport = FlakyTransport(failures=5)
+    run(DispatchEngine(transport, workers=2, backoff_base=0.01), (deployment.id,))
+    assert transport.sent == [] and transport.attempts['user0@acme.com'] == 2
+    assert DeploymentService.get_by_id(deployment.id).metrics['invites_failed'] == 1
+    assert ParticipantService.status_counts(deployment.id)['invite_status'] == {'failed': 1}
+
+def test_metric_increments_are_atomic(company):
+    deployment = make_deployment(company, 0)
+
+    def bump():
+        for _ in range(200):
+            DeploymentService.increment_metrics(deployment.id, {'invites_sent': 1, 'reminders_sent': 2})
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics = DeploymentService.get_by_id(deployment.id).metrics
+    assert (metrics['invites_sent'], metrics['reminders_sent']) == (1600, 3200)
+
+def test_sql_modify_is_atomic_across_threads(tmp_path):
+    backend = create_backend(f"sqlite:///{tmp_path / 'store.db'}")
+    backend.put('deployments', Deployment(id='d', company_id='c', survey_template_id='t', name='d',
+                                          status=DeploymentStatus.ACTIVE, audience_type='all'))
+
+    def bump():
+        for _ in range(50):
+            backend.modify('deployments', 'd', lambda d: d.metrics.update(sent=d.metrics.get('sent', 0) + 1))
+
+    threads = [threading.Thread(target=bump) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.get('deployments', 'd').metrics['sent'] == 300
+    assert backend.modify('deployments', 'missing', lambda d: None) is None
+
+@pytest.mark.parametrize('status', [DeploymentStatus.COMPLETED, DeploymentStatus.CANCELLED])
+def test_closed_deployments_cannot_be_sent(client, company, status):
+    deployment = make_deployment(company, 1, status=status)
+    response = client.post(f'/api/deployments/{deployment.id}/send')
+    assert response.status_code == 409
@@ -0,0 +1,58 @@
+import io
+from datetime import date, datetime
+import numpy as np
+import pytest
+import exports
+from data_store import PersonService
+from exports import cell, csv_chunks, xlsx_chunks
+from importer import import_persons, iter_csv_rows, iter_xlsx_rows
+from models import *
+
+@pytest.mark.parametrize('value, expected', [
+    (None, ''), (True, 'Yes'), (3, 3), (2.5, 2.5), (float('nan'), ''), (float('-inf'), ''),
+    (np.float64(1.25), 1.25), (np.int64(4), '4'), (UserStatus.ACTIVE, 'active'),
+    (datetime(2024, 1, 2, 3, 4, 5, 678), '2024-01-02T03:04:05'), (date(2024, 1, 2), '2024-01-02'),
+    (['a', 1], 'a; 1'), ({'b': 1, 'a': None}, '{"a": null, "b": 1}'),
+])
+def test_cell_values(value, expected):
+    assert cell(value) == expected
+    assert type(cell(value)) is type(expected)
+
+def test_xlsx_round_trips_through_the_importer_reader(monkeypatch):
+    monkeypatch.setattr(exports, 'EXPORT_BATCH', 4)
+    columns = [(f'Column {i}', lambda row, i=i: row[i % len(row)]) for i in range(30)]
+    records = [['<b>&"x"</b>', 'émoji 🎉', 'ctrl\x01char', 7, 0.1, float('nan'), float('inf'), np.float64(2.5),
+                None, '', '=SUM(A1)']] * 10
+    chunks = list(xlsx_chunks(columns, records, sheet='Bad/Name?'))
+    # Header, one chunk per batch of records, then the end of the archive
+    assert len(chunks) == 1 + 3 + 1
+    rows = list(iter_xlsx_rows(io.BytesIO(b''.join(chunks))))
+    assert rows[0] == [f'Column {i}' for i in range(30)]
+    expected = ['<b>&"x"</b>', 'émoji 🎉', 'ctrlchar', '7', '0.1', None, None, '2.5', None, None, '=SUM(A1)']
+    assert rows[1][:11] == expected
+    assert rows[1][22:30] == expected[:8]
+    assert len(rows) == 11
+
+def test_csv_escapes_formulas_and_reads_back():
+    columns = [('Name', lambda r: r[0]), ('Score', lambda r: r[1])]
+    text = ''.join(csv_chunks(columns, [('=HYPERLINK("x")', 1.5), ('-1', float('nan')), ('plain, "quoted"', None)]))
+    assert text.startswith('﻿')
+    rows = list(iter_csv_rows(io.BytesIO(text.encode('utf-8'))))
+    assert rows == [['Name', 'Score'], ['\'=HYPERLINK("x")', '1.5'], ["'-1", ''], ['plain, "quoted"', '']]
+
+@pytest.mark.parametrize('fmt', ['csv', 'xlsx'])
+def test_user_exports_re_import(client, company, fmt):
+    PersonService.create_many([Person(id='', company_id=company.id, email=f'p{i}@acme.com', name=f'Person {i}',
+                                      roles=['user'], status=UserStatus.ACTIVE, metadata={'department': 'Ops'})
+                               for i in range(5)])
+    response = client.get(f'/export/users.{fmt}')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith(f'.{fmt}"')
+    data = response.get_data()
+    for person in PersonService.get_by_company(company.id):
+        PersonService.delete(person.id)
+
+    result = import_persons(io.BytesIO(data), f'users.{fmt}', company.id)
+    assert (result.created, result.error_count) == (5, 0)
+    people = sorted(PersonService.get_by_company(company.id), key=lambda p: p.email)
+    assert [(p.name, p.metadata.get('department')) for p in people] == [(f'Person {i}', 'Ops') for i in range(5)]
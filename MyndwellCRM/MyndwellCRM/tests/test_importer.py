@@ -0,0 +1,67 @@
+import csv
+import io
+import pytest
+from data_store import CompanyService, PersonService
+from importer import ImportFormatError, import_persons
+from models import *
+
+def upload(text, encoding='utf-8'):
+    return io.BytesIO(text.encode(encoding))
+
+def test_imports_valid_rows_and_reports_the_rest(company):
+    result = import_persons(upload(
+        'Full Name,Email,Department\n'
+        'Ann,ann@acme.com,Sales\n'
+        'Bob,bob@other.com,\n'
+        ',nameless@acme.com,\n'
+        'Ann Again,ANN@acme.com,\n'
+        'Cy,not-an-email,\n'
+    ), 'people.csv', company.id, batch_size=1)
+    assert (result.rows, result.created, result.error_count) == (5, 1, 4)
+    assert [(e['row'], e['error']) for e in result.errors] == [
+        (3, 'Email domain does not belong to the company'),
+        (4, 'Full name is required'),
+        (5, 'Email is already registered'),
+        (6, 'Invalid email address'),
+    ]
+    person = PersonService.get_by_email('ann@acme.com')
+    assert person.company_id == company.id
+    assert person.metadata['department'] == 'Sales'
+
+def test_company_column_must_match_the_selected_company(company):
+    other = CompanyService.create(Company(id='', name='Other', domains=['acme.com'], status='active'))
+    result = import_persons(upload(f'Full Name,Email,Company ID\nAnn,ann@acme.com,{other.id}\n'),
+                            'people.csv', company.id)
+    assert result.created == 0
+    assert result.errors[0]['error'] == 'Company does not match the selected company'
+
+def test_domain_decides_the_company_when_none_is_selected(company):
+    result = import_persons(upload('Email,Name\nann@acme.com,Ann\n'), 'people.csv')
+    assert result.created == 1
+    assert PersonService.get_by_email('ann@acme.com').company_id == company.id
+
+def test_non_utf8_csv_is_a_format_error(company):
+    with pytest.raises(ImportFormatError, match='not UTF-8'):
+        import_persons(upload('Full Name,Email\nJosé,jose@acme.com\n', 'latin-1'), 'people.csv', company.id)
+
+def test_malformed_csv_is_a_format_error(company):
+    huge = 'x' * (csv.field_size_limit() + 1)
+    with pytest.raises(ImportFormatError, match='Line 2 is not valid CSV'):
+        import_persons(upload(f'Full Name,Email\n{huge},a@acme.com\n'), 'people.csv', company.id)
+
+@pytest.mark.parametrize('filename, message', [
+    ('people.xls', 'Legacy .xls'),
+    ('people.txt', 'Unsupported file type'),
+    ('people.xlsx', 'not a valid .xlsx'),
+])
+def test_unreadable_uploads_are_format_errors(company, filename, message):
+    with pytest.raises(ImportFormatError, match=message):
+        import_persons(upload('Full Name,Email\n'), filename, company.id)
+
+def test_header_needs_name_and_email(company):
+    with pytest.raises(ImportFormatError, match='Header row'):
+        import_persons(upload('Email\nann@acme.com\n'), 'people.csv', company.id)
+
+def test_unknown_company_is_rejected(store):
+    with pytest.raises(ImportFormatError, match='Company not found'):
+        import_persons(upload('Full Name,Email\n'), 'people.csv', 'missing')
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import pytest
+from models import *
+from pagination import decode_cursor, encode_cursor, paginate, walk
+from storage import COLLECTIONS, create_backend, sort_value
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return create_backend('memory', {c: {} for c in COLLECTIONS})
+    return create_backend(f"sqlite:///{tmp_path / 'store.db'}")
+
+def people(count: int):
+    # Few distinct names and creation times, so pages split runs of equal sort values
+    start = datetime(2024, 1, 1)
+    return [Person(id=f'p{i:03}', company_id=f'c{i % 2}', email=f'user{i:03}@acme.com', name=f'Name {i % 4}',
+                   roles=['user'], status=UserStatus.ACTIVE if i % 5 else UserStatus.INACTIVE,
+                   created_at=start + timedelta(minutes=i // 3))
+            for i in range(count)]
+
+def expected(records, sort, descending, **filters):
+    matching = [r for r in records if all(getattr(r, f) == v for f, v in filters.items())]
+    return [r.id for r in sorted(matching, key=lambda r: (sort_value(r, sort), r.id), reverse=descending)]
+
+def all_pages(backend, sort, descending, filters=None, limit=7):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = paginate(backend, 'persons', filters, sort, descending, cursor, limit)
+        assert len(page.items) <= limit
+        ids += [p.id for p in page.items]
+        pages += 1
+        if not page.has_more:
+            return ids, pages
+        cursor = page.next_cursor
+
+@pytest.mark.parametrize('sort', ['created_at', 'name', 'email'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_visit_every_record_once_in_order(backend, sort, descending):
+    records = people(50)
+    backend.put_many('persons', records)
+    ids, pages = all_pages(backend, sort, descending)
+    assert ids == expected(records, sort, descending)
+    assert pages == 8
+
+@pytest.mark.parametrize('filters', [{'company_id': 'c1'}, {'status': UserStatus.INACTIVE},
+                                     {'company_id': 'c0', 'status': UserStatus.ACTIVE}])
+def test_filtered_pages(backend, filters):
+    records = people(60)
+    backend.put_many('persons', records)
+    ids, _ = all_pages(backend, 'name', True, filters)
+    assert ids == expected(records, 'name', True, **filters)
+
+def test_pages_stay_stable_across_inserts(backend):
+    records = people(20)
+    backend.put_many('persons', records[:10])
+    first = paginate(backend, 'persons', limit=5)
+    backend.put_many('persons', records[10:])
+    second = paginate(backend, 'persons', cursor=first.next_cursor, limit=5)
+    assert [p.id for p in first.items + second.items] == expected(records, 'created_at', False)[:10]
+
+def test_walk_reads_in_batches(backend):
+    records = people(23)
+    backend.put_many('persons', records)
+    assert [p.id for p in walk(backend, 'persons', sort='email', batch=5)] == expected(records, 'email', False)
+
+def test_bad_arguments_are_rejected_up_front(backend):
+    with pytest.raises(ValueError, match='Cannot filter'):
+        walk(backend, 'persons', {'name': 'x'})
+    with pytest.raises(ValueError, match='Cannot sort'):
+        paginate(backend, 'persons', sort='status')
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        paginate(backend, 'persons', cursor='not-a-cursor')
+
+def test_cursor_round_trip():
+    position = ('2024-01-01T00:00:00.000000', 'p001')
+    assert decode_cursor(encode_cursor(position)) == position
+
+def test_sql_pages_range_scan_the_sort_index(tmp_path):
+    from sqlalchemy import event
+    backend = create_backend(f"sqlite:///{tmp_path / 'store.db'}")
+    backend.put_many('persons', people(10))
+    statements = []
+    event.listen(backend.engine, 'before_cursor_execute',
+                 lambda conn, cursor, statement, params, *_: statements.append((statement, params)))
+    backend.page('persons', {}, sort='name', after=('name 1', 'p001'), limit=3)
+    statement, params = next(s for s in statements if s[0].startswith('SELECT data FROM persons'))
+    with backend.engine.connect() as conn:
+        plan = ' '.join(str(row[-1]) for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params))
+    assert 'USING INDEX ix_persons_sort_name_id' in plan
+    assert 'TEMP B-TREE' not in plan
@@ -0,0 +1,102 @@
+import itertools
+import random
+from datetime import datetime, timedelta
+import pytest
+import participant_index
+from data_store import DeploymentService, ParticipantService, PersonService
+from models import *
+from participant_index import ParticipantIndex
+from storage import sort_value
+
+START = datetime(2024, 3, 1)
+
+def participants(count: int, seed: int = 3):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        sent = rng.random() < 0.7
+        rows.append(Participant(
+            id=f'd1:p{i:03}', deployment_id='d1', company_id='c1', person_id=f'p{i:03}',
+            name=f'Person {rng.randint(0, 9)}', email=f'p{i:03}@acme.com',
+            invite_status=InviteStatus.SENT if sent else rng.choice([InviteStatus.PENDING, InviteStatus.FAILED]),
+            survey_status=rng.choice(list(ParticipationStatus)) if sent else ParticipationStatus.NOT_STARTED,
+            sent_at=START + timedelta(hours=rng.randint(0, 48)) if sent else None))
+    return rows
+
+def expected(rows, filters, sort, descending=False):
+    matching = [p for p in rows if all(getattr(p, f) == v for f, v in filters.items())]
+    return [p.id for p in sorted(matching, key=lambda p: (sort_value(p, sort), p.id), reverse=descending)]
+
+@pytest.fixture
+def index(monkeypatch):
+    # Small batches so walks cross several lock acquisitions
+    monkeypatch.setattr(participant_index, 'WALK_BATCH', 7)
+    return ParticipantIndex()
+
+@pytest.mark.parametrize('filters', [
+    {},
+    {'invite_status': InviteStatus.SENT},
+    {'invite_status': InviteStatus.FAILED},
+    {'invite_status': InviteStatus.SENT, 'survey_status': ParticipationStatus.COMPLETED},
+])
+@pytest.mark.parametrize('sort', ['sent_at', 'name'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_walk_matches_a_filtered_sort(index, filters, sort, descending):
+    rows = participants(120)
+    index.load('d1', rows)
+    assert [p.id for p in index.walk('d1', filters, sort, descending)] == expected(rows, filters, sort, descending)
+
+def test_walk_resumes_after_a_position(index):
+    rows = participants(60)
+    index.load('d1', rows)
+    filters = {'invite_status': InviteStatus.PENDING}
+    ids = expected(rows, filters, 'name')
+    middle = next(p for p in rows if p.id == ids[len(ids) // 2])
+    after = (sort_value(middle, 'name'), middle.id)
+    assert [p.id for p in index.walk('d1', filters, 'name', after=after)] == ids[len(ids) // 2 + 1:]
+
+def refiled(participant: Participant, **changes) -> Participant:
+    return Participant(**{**{f: getattr(participant, f) for f in participant.__slots__}, **changes})
+
+def test_writes_during_a_walk_are_rechecked(index):
+    rows = participants(80)
+    index.load('d1', rows)
+    filters = {'invite_status': InviteStatus.FAILED}
+    assert len(expected(rows, filters, 'name')) > participant_index.WALK_BATCH
+    walk = index.walk('d1', filters, 'name')
+    # Read the first batch, then refile every match not read in yet before the walk reaches it
+    seen = {p.id for p in itertools.islice(walk, participant_index.WALK_BATCH)}
+    for p in rows:
+        if p.invite_status == InviteStatus.FAILED and p.id not in seen:
+            index.apply('participants', p, refiled(p, invite_status=InviteStatus.SENT))
+    assert list(walk) == []
+
+def test_counts_follow_writes(index):
+    rows = participants(40)
+    index.load('d1', rows)
+    before = rows[0]
+    after = refiled(before, survey_status=ParticipationStatus.COMPLETED, invite_status=InviteStatus.SENT)
+    index.apply('participants', before, after)
+    index.apply('participants', rows[1], None)
+    current = [after] + rows[2:]
+    counts = index.counts('d1')
+    for field in ('invite_status', 'survey_status'):
+        brute = {}
+        for p in current:
+            brute[getattr(p, field).value] = brute.get(getattr(p, field).value, 0) + 1
+        assert {k: v for k, v in counts[field].items() if v} == brute
+
+def test_status_api_pages_and_counts(client, company):
+    persons = PersonService.create_many([Person(id='', company_id=company.id, email=f'p{i}@acme.com', name=f'P{i}',
+                                                roles=['user'], status=UserStatus.ACTIVE) for i in range(5)])
+    deployment = DeploymentService.create(Deployment(id='', company_id=company.id, survey_template_id='t',
+                                                     name='Pulse', status=DeploymentStatus.ACTIVE, audience_type='all'))
+    ParticipantService.enroll(deployment, persons)
+    ParticipantService.record_deliveries(deployment.id, {p.id: ('sent', START) for p in persons[:3]})
+    ParticipantService.record_deliveries(deployment.id, {persons[3].id: ('failed', START)})
+
+    body = client.get(f'/api/company-surveys/{deployment.id}/status?invite_status=sent&limit=2').get_json()
+    assert len(body['items']) == 2 and body['next_cursor']
+    rest = client.get(f"/api/company-surveys/{deployment.id}/status?invite_status=sent&cursor={body['next_cursor']}")
+    assert len(rest.get_json()['items']) == 1
+    assert {k: v for k, v in body['counts']['invite_status'].items() if v} == {'sent': 3, 'failed': 1, 'pending': 1}
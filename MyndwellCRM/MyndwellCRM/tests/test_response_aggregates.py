@@ -0,0 +1,68 @@
+import random
+import statistics
+import pytest
+from models import *
+from response_aggregates import QuestionAggregate, ResponseAggregates
+
+SCALE = Question(id='q1', code='MOOD', text='Mood', type=QuestionType.SCALE,
+                 choices=[QuestionChoice(code=str(i), label=str(i), weight=float(i)) for i in range(1, 6)])
+MULTI = Question(id='q2', code='TOPICS', text='Topics', type=QuestionType.MULTI,
+                 choices=[QuestionChoice(code=c, label=c) for c in 'abc'])
+
+def response(response_id: str, **answers) -> SurveyResponse:
+    return SurveyResponse(id=response_id, deployment_id='d1', person_id=response_id, answers=answers)
+
+def test_running_mean_and_variance_match_a_recount():
+    aggregate = QuestionAggregate(SCALE)
+    rng = random.Random(7)
+    kept = []
+    for _ in range(500):
+        if kept and rng.random() < 0.4:
+            aggregate.apply(kept.pop(rng.randrange(len(kept))), -1)
+        else:
+            answer = str(rng.randint(1, 5))
+            aggregate.apply(answer, 1)
+            kept.append(answer)
+    weights = [float(a) for a in kept]
+    assert aggregate.n == len(kept)
+    assert aggregate.mean == pytest.approx(statistics.fmean(weights))
+    assert aggregate.variance == pytest.approx(statistics.pvariance(weights))
+    assert aggregate.counts == {str(i): kept.count(str(i)) for i in range(1, 6)}
+
+def test_removing_every_answer_resets_the_statistics():
+    aggregate = QuestionAggregate(SCALE)
+    for answer in '135':
+        aggregate.apply(answer, 1)
+    for answer in '531':
+        aggregate.apply(answer, -1)
+    assert (aggregate.n, aggregate.mean, aggregate.m2, aggregate.variance) == (0, 0.0, 0.0, None)
+    assert aggregate.to_dict()['mean'] is None
+
+def test_plan_weights_override_the_bank():
+    aggregate = QuestionAggregate(SCALE, {'1': 10.0, '2': 20.0})
+    aggregate.apply('1', 1)
+    aggregate.apply('2', 1)
+    aggregate.apply('3', 1)
+    assert (aggregate.n, aggregate.mean, aggregate.answered) == (2, 15.0, 3)
+
+def test_write_listener_folds_resubmissions_and_deletions():
+    aggregates = ResponseAggregates()
+    first = response('r1', q1='2', q2=['a', 'b'])
+    aggregates.load('d1', [SCALE, MULTI], [first])
+    second = response('r2', q1='4', q2=['b'])
+    aggregates.apply('responses', None, second)
+    aggregates.apply('responses', first, response('r1', q1='5', q2=[]))
+    results = aggregates.get('d1').to_dict()
+    scale, multi = results['questions']
+    assert results['responses'] == 2
+    assert (scale['answered'], scale['mean'], scale['variance']) == (2, 4.5, 0.25)
+    assert [c['count'] for c in multi['counts']] == [0, 1, 0]
+
+    aggregates.apply('responses', second, None)
+    assert aggregates.get('d1').to_dict()['scale_mean'] == 5.0
+
+def test_question_edits_drop_cached_results():
+    aggregates = ResponseAggregates()
+    aggregates.load('d1', [SCALE], [])
+    aggregates.apply('questions', SCALE, SCALE)
+    assert aggregates.get('d1') is None
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+import pytest
+from data_store import DeploymentService, ParticipantService, PersonService
+from models import *
+from scheduler import DeploymentScheduler, validate_reminders
+
+T0 = datetime(2024, 5, 1, 9, 0)
+
+class Clock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+class Dispatcher:
+    """Records what the scheduler queues instead of sending it"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def enqueue_deployment(self, deployment_id, person_ids=None, reminder=False):
+        self.jobs.append((deployment_id, sorted(person_ids) if person_ids else None, reminder))
+
+@pytest.fixture
+def deployment(company):
+    return DeploymentService.create(Deployment(
+        id='', company_id=company.id, survey_template_id='t', name='Pulse', status=DeploymentStatus.SCHEDULED,
+        audience_type='all', start_date=T0 + timedelta(hours=1), end_date=T0 + timedelta(days=10),
+        email_template=EmailTemplate(subject='Hi', body='{{survey_link}}'), reminders=[{'days_after': 2}]))
+
+def make_scheduler(clock, dispatcher) -> DeploymentScheduler:
+    scheduler = DeploymentScheduler(clock=clock, dispatcher=lambda: dispatcher)
+    scheduler.rebuild(DeploymentService.get_all())
+    return scheduler
+
+def test_lifecycle_runs_on_the_injected_clock(deployment):
+    clock, dispatcher = Clock(T0), Dispatcher()
+    scheduler = make_scheduler(clock, dispatcher)
+    assert scheduler.run_due() == 0
+    assert scheduler.next_due() == deployment.start_date
+    assert scheduler.pending() == 3
+
+    clock.now = deployment.start_date
+    assert scheduler.run_due() == 1
+    assert DeploymentService.get_by_id(deployment.id).status == DeploymentStatus.ACTIVE
+    assert dispatcher.jobs == [(deployment.id, None, False)]
+
+    persons = PersonService.create_many([Person(id='', company_id=deployment.company_id, email=f'p{i}@acme.com',
+                                                name=f'P{i}', roles=['user'], status=UserStatus.ACTIVE)
+                                         for i in range(3)])
+    ParticipantService.enroll(deployment, persons)
+    ParticipantService.record_deliveries(deployment.id, {p.id: ('sent', clock.now) for p in persons})
+    ParticipantService.record_progress(deployment.id, persons[0].id, ParticipationStatus.COMPLETED)
+
+    clock.now += timedelta(days=2) - timedelta(seconds=1)
+    assert scheduler.run_due() == 0
+    clock.now += timedelta(seconds=1)
+    assert scheduler.run_due() == 1
+    assert dispatcher.jobs[-1] == (deployment.id, sorted(p.id for p in persons[1:]), True)
+    reminder = DeploymentService.get_by_id(deployment.id).reminders[0]
+    assert reminder['recipients'] == 2 and reminder['sent_at'] == clock.now.isoformat()
+
+    clock.now = deployment.end_date
+    assert scheduler.run_due() == 1
+    assert DeploymentService.get_by_id(deployment.id).status == DeploymentStatus.COMPLETED
+    assert scheduler.pending() == 0 and scheduler.next_due() is None
+
+def test_replanning_supersedes_old_events(deployment):
+    clock, dispatcher = Clock(T0), Dispatcher()
+    scheduler = make_scheduler(clock, dispatcher)
+    later = T0 + timedelta(days=1)
+    scheduler.on_write('deployments', deployment,
+                       DeploymentService.update(deployment.id, {'start_date': later}))
+    assert scheduler.next_due() == later
+    assert scheduler.pending() == 3
+
+    clock.now = T0 + timedelta(hours=2)
+    assert scheduler.run_due() == 0
+    clock.now = later
+    assert scheduler.run_due() == 1
+    assert dispatcher.jobs == [(deployment.id, None, False)]
+
+def test_each_activation_fires_once_across_workers(deployment):
+    clock = Clock(deployment.start_date)
+    first, second = Dispatcher(), Dispatcher()
+    schedulers = [make_scheduler(clock, first), make_scheduler(clock, second)]
+    for scheduler in schedulers:
+        scheduler.run_due()
+    assert len(first.jobs) + len(second.jobs) == 1
+
+def test_deleted_deployments_are_dropped(deployment):
+    scheduler = make_scheduler(Clock(T0), Dispatcher())
+    scheduler.on_write('deployments', deployment, None)
+    assert scheduler.pending() == 0 and scheduler.next_due() is None
+
+@pytest.mark.parametrize('reminders', [[{'days_after': 0}], [{'days_after': True}], [{}], ['3']])
+def test_invalid_reminders_are_rejected(reminders):
+    with pytest.raises(ValueError):
+        validate_reminders(reminders)
+
+def test_reminders_are_ordered():
+    assert validate_reminders([{'days_after': 5}, {'days_after': 1.5}]) == [{'days_after': 1.5}, {'days_after': 5}]
@@ -0,0 +1,86 @@
+import pytest
+from models import *
+from survey_plan import SurveyPlanCache, SurveyPlanError, compile_survey
+
+def question(question_id, code, type, choices=(), **validation):
+    return Question(id=question_id, code=code, text=code, type=type,
+                    choices=[QuestionChoice(code=c, label=c, weight=w) for c, w in choices],
+                    validation=QuestionValidation(**validation))
+
+QUESTIONS = {q.id: q for q in (
+    question('q1', 'WORKS', QuestionType.SINGLE, [('yes', None), ('no', None)], required=True),
+    question('q2', 'HOURS', QuestionType.SCALE, [('1', 1), ('2', 2), ('3', 3), ('9', 9)], max_value=3),
+    question('q3', 'TOPICS', QuestionType.MULTI, [('a', 1), ('b', 2), ('c', 4)], min_value=1, max_value=2),
+    question('q4', 'NOTES', QuestionType.FREE, regex=r'[A-Z].*', max_value=10),
+)}
+
+def template(*rows, version='1'):
+    return SurveyTemplate(id='t1', name='Work', version=version, program='p', status=SurveyStatus.READY, questions=[
+        SurveyQuestion(id=f'sq{i}', survey_template_id='t1', question_id=question_id, order=i, section=section,
+                       branching=branching, weights=weights)
+        for i, (question_id, section, branching, weights) in enumerate(rows)])
+
+# Workers answer HOURS then TOPICS; everyone else skips straight to NOTES
+BRANCHING = template(('q1', 'Work', {'no': 'NOTES'}, {}), ('q2', 'Work', {}, {'3': 30}),
+                     ('q3', 'Topics', {}, {}), ('q4', 'Notes', {}, {}))
+
+def test_compile_resolves_positions_weights_and_branches():
+    plan = compile_survey(BRANCHING, QUESTIONS)
+    assert [p.id for p in plan.questions] == ['q1', 'q2', 'q3', 'q4']
+    assert plan.get('q2').weights == {'1': 1.0, '2': 2.0, '3': 30.0, '9': 9.0}
+    # Choices weighted outside the question's bounds are not accepted
+    assert plan.get('q2').accepted == {'1', '2', '3'}
+    assert plan.to_dict()['questions'][0]['branches'] == {'no': 'q4'}
+    assert plan.unreachable == () and plan.missing == ()
+
+def test_evaluate_follows_the_branch_path():
+    plan = compile_survey(BRANCHING, QUESTIONS)
+    answers = {'q1': 'yes', 'q2': '3', 'q3': ['b', 'a', 'b'], 'q4': ' Fine '}
+    assert plan.evaluate(answers) == {'q1': 'yes', 'q2': '3', 'q3': ['b', 'a'], 'q4': 'Fine'}
+    assert plan.scores(plan.evaluate(answers)) == {'Work': 30.0, 'Topics': 3.0}
+    # Answers off the path taken are dropped
+    assert plan.evaluate({**answers, 'q1': 'no'}) == {'q1': 'no', 'q4': 'Fine'}
+    assert [p.id for p in plan.path({'q1': 'no'})] == ['q1', 'q4']
+    assert plan.next_question('q1', 'no').id == 'q4'
+    assert plan.next_question('q4', '') is None
+
+@pytest.mark.parametrize('answers, message', [
+    ({}, 'WORKS requires an answer'),
+    ({'q1': 'maybe'}, 'Invalid choice for WORKS'),
+    ({'q1': 'yes', 'q2': '9'}, 'Invalid choice for HOURS'),
+    ({'q1': 'yes', 'q3': ['a', 'b', 'c']}, 'TOPICS needs 1 to 2 selections'),
+    ({'q1': 'no', 'q4': 'lowercase'}, 'not in the expected format'),
+    ({'q1': 'no', 'q4': 'Far too long'}, 'NOTES needs at most 10 characters'),
+    ({'q1': 'no', 'q9': 'x'}, 'Unknown question'),
+])
+def test_evaluate_rejects_invalid_answers(answers, message):
+    with pytest.raises(ValueError, match=message):
+        compile_survey(BRANCHING, QUESTIONS).evaluate(answers)
+
+@pytest.mark.parametrize('rows, message', [
+    ((('q1', 'A', {'yes': 'q2'}, {}), ('q2', 'A', {'*': 'WORKS'}, {})), 'Branching loops back: WORKS -> HOURS -> WORKS'),
+    ((('q1', 'A', {'yes': 'q9'}, {}),), 'not in this survey'),
+    ((('q1', 'A', {'perhaps': 'end'}, {}),), 'unknown choice perhaps'),
+    ((('q2', 'A', {}, {'7': 1}),), 'weights unknown choice'),
+    ((('q1', 'A', {}, {}), ('q1', 'B', {}, {})), 'appears more than once'),
+])
+def test_broken_rules_do_not_compile(rows, message):
+    with pytest.raises(SurveyPlanError, match=message):
+        compile_survey(template(*rows), QUESTIONS)
+
+def test_unreachable_and_missing_questions_are_reported():
+    plan = compile_survey(template(('q1', 'A', {'*': 'end'}, {}), ('q2', 'A', {}, {}), ('gone', 'A', {}, {})),
+                          QUESTIONS)
+    assert plan.unreachable == ('q2',)
+    assert plan.missing == ('gone',)
+
+def test_cache_recompiles_after_edits():
+    loads = []
+    cache = SurveyPlanCache(lambda question_id: loads.append(question_id) or QUESTIONS.get(question_id))
+    first = cache.get(BRANCHING)
+    assert cache.get(BRANCHING) is first
+    cache.on_write('questions', QUESTIONS['q3'], QUESTIONS['q3'])
+    second = cache.get(BRANCHING)
+    assert second is not first
+    assert cache.get(template(('q1', 'A', {}, {}), version='2')).questions[0].id == 'q1'
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'plans': 1}